@@ -12,29 +12,90 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
+import json
+
 from django.contrib import admin
 from django import forms
+from django.utils.html import format_html
 
 from quartet_vrs import models
+from quartet_vrs.pagination import EstimatedCountPaginator
+
 
 class GTINMapForm(forms.ModelForm):
     password = forms.CharField(max_length=100, widget=forms.PasswordInput(render_value=True))
 
+
+class RouteEndpointInline(admin.TabularInline):
+    model = models.RouteEndpoint
+    extra = 0
+
+
 @admin.register(models.GTINMap)
 class GTINMapAdmin(admin.ModelAdmin):
     form = GTINMapForm
-    list_display = ('gtin', 'host', 'port', 'path', 'gs1_compliant', 'use_ssl')
-    ordering = ('gtin',)
-    search_fields = ['gtin',]
+    inlines = [RouteEndpointInline]
+    list_display = ('gtin', 'prefix', 'host', 'port', 'path', 'gs1_compliant',
+                    'use_ssl', 'connect_timeout', 'read_timeout')
+    ordering = ('gtin', 'prefix')
+    search_fields = ['gtin', 'prefix']
+
 
 @admin.register(models.RequestLog)
 class RequestLogAdmin(admin.ModelAdmin):
-    list_display = ('success', 'operation', 'created', 'gtin', 'lot', 'expiry', 'remote_address', 'serial_number')
+    list_display = ('success', 'operation', 'created', 'gtin', 'lot', 'expiry', 'remote_address', 'serial_number',
+                    'failure_reason')
+    list_filter = ('success', 'operation')
     ordering = ('-created',)
-    search_fields = ['created', 'gtin', 'lot', 'expiry' , 'serial_number', 'success']
+    date_hierarchy = 'created'
+    # case sensitive prefix and exact lookups so that the indexes are used
+    search_fields = ['gtin__startswith', 'serial_number__startswith',
+                     'lot__startswith', 'request_gln__exact',
+                     'corr_uuid__exact']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ['created', 'gtin', 'lot', 'expiry', 'remote_address',
-                       'request_gln', 'corr_uuid', 'response', 'operation',
-                       'serial_number','user_name', 'success']
+                       'request_gln', 'corr_uuid', 'operation',
+                       'serial_number', 'user_name', 'success', 'verified',
+                       'failure_reason', 'responder_gln', 'location',
+                       'sample_rate', 'message']
+    exclude = ['response', 'payload']
+
+    def message(self, request_log):
+        # decompressed or rebuilt only on the change page
+        response = request_log.get_response()
+        if response is None:
+            return '-'
+        try:
+            response = json.dumps(json.loads(response), indent=2)
+        except ValueError:
+            pass
+        return format_html('<pre>{}</pre>', response)
+    message.short_description = 'Response'
+
+
+@admin.register(models.RequestLogRollup)
+class RequestLogRollupAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'operation', 'request_gln', 'gtin', 'success',
+                    'failure_reason', 'count')
+    list_filter = ('success', 'operation')
+    ordering = ('-hour',)
+    date_hierarchy = 'hour'
+    search_fields = ['request_gln__exact', 'gtin__exact']
+    readonly_fields = ['hour', 'operation', 'request_gln', 'gtin', 'success',
+                       'failure_reason', 'count']
+
+
+@admin.register(models.RouteHealth)
+class RouteHealthAdmin(admin.ModelAdmin):
+    list_display = ('base_url', 'healthy', 'availability', 'latency_p50',
+                    'latency_p90', 'latency_p99', 'last_checked')
+    ordering = ('base_url',)
+    search_fields = ['base_url']
+    readonly_fields = ['base_url', 'healthy', 'availability', 'latency_p50',
+                       'latency_p90', 'latency_p99', 'consecutive_failures',
+                       'last_checked', 'last_success']
+
 
 class CompanyAccessAdmin(admin.ModelAdmin):
     def get_gln(self, company_access):
@@ -58,3 +119,5 @@ def register_to_site(admin_site):
     admin_site.register(models.GTINMap, GTINMapAdmin)
     admin_site.register(models.RequestLog, RequestLogAdmin)
     admin_site.register(models.CompanyAccess, CompanyAccessAdmin)
+    admin_site.register(models.RequestLogRollup, RequestLogRollupAdmin)
+    admin_site.register(models.RouteHealth, RouteHealthAdmin)
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 class QuartetVrsConfig(AppConfig):
     name = 'quartet_vrs'
     verbose_name = 'QU4RTET Verification Router Service'
+
+    def ready(self):
+        from quartet_vrs import signals  # noqa: F401
@@ -0,0 +1,203 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    A file backed bloom filter of commissioned EPC URNs.  The file is
+    memory-mapped, so every gunicorn worker that opens it shares the same
+    pages and sees additions made by other processes.
+
+    File layout: an 8 byte magic value, the number of bits, the number of
+    hash functions and the approximate number of distinct keys added
+    (unsigned 64 bit, little endian), followed by the bit array.
+    """
+    MAGIC = b'VRSBLOOM'
+    HEADER = struct.Struct('<8sQQQ')
+
+    def __init__(self, path: str, writable: bool = False):
+        """
+        Opens an existing bloom filter file.  Use BloomFilter.create to
+        create a new one.
+        :param path: The path of the bloom filter file.
+        :param writable: Open the file for adding keys.
+        """
+        self.path = path
+        self.writable = writable
+        self._file = open(path, 'r+b' if writable else 'rb')
+        self._mmap = mmap.mmap(
+            self._file.fileno(), 0,
+            access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        )
+        magic, self.num_bits, self.num_hashes, _ = self.HEADER.unpack_from(
+            self._mmap)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError('%s is not a VRS bloom filter file.' % path)
+        self.inode = os.fstat(self._file.fileno()).st_ino
+
+    @classmethod
+    def create(cls, path: str, capacity: int, error_rate: float):
+        """
+        Creates an empty bloom filter file sized for the capacity and false
+        positive rate and opens it for writing.
+        :param capacity: The expected number of keys.
+        :param error_rate: The false positive rate at capacity, e.g. 0.001.
+        """
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_bits = max(8, num_bits + (-num_bits % 8))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        with open(path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, num_bits, num_hashes, 0))
+            f.truncate(cls.HEADER.size + num_bits // 8)
+        return cls(path, writable=True)
+
+    @property
+    def count(self):
+        return self.HEADER.unpack_from(self._mmap)[3]
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        self.update([key])
+
+    def update(self, keys):
+        """
+        Adds keys to the filter.  An exclusive lock on the file keeps
+        concurrent writers in other processes from losing bits.  Only keys
+        that set a new bit are counted, so re-adding a key does not grow
+        the count.
+        """
+        offset = self.HEADER.size
+        added = 0
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            for key in keys:
+                new = False
+                for position in self._positions(key):
+                    index = offset + (position >> 3)
+                    bit = 1 << (position & 7)
+                    if not self._mmap[index] & bit:
+                        self._mmap[index] |= bit
+                        new = True
+                if new:
+                    added += 1
+            self._mmap[:self.HEADER.size] = self.HEADER.pack(
+                self.MAGIC, self.num_bits, self.num_hashes,
+                self.count + added)
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def __contains__(self, key: str):
+        offset = self.HEADER.size
+        for position in self._positions(key):
+            if not self._mmap[offset + (position >> 3)] & 1 << (position & 7):
+                return False
+        return True
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        if self.writable:
+            self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+_lock = threading.Lock()
+_reader = None
+_checked = 0
+
+
+def get_bloom_filter():
+    """
+    Returns the shared, read-only bloom filter configured by
+    VRS_BLOOM_FILTER_PATH or None if there is not one.  The file is
+    reopened when it has been replaced by a rebuild, which is checked at
+    most every VRS_BLOOM_FILTER_RELOAD_INTERVAL seconds.
+    """
+    global _reader, _checked
+    path = getattr(settings, 'VRS_BLOOM_FILTER_PATH', None)
+    if not path:
+        return None
+    interval = getattr(settings, 'VRS_BLOOM_FILTER_RELOAD_INTERVAL', 60)
+    now = time.monotonic()
+    if _reader is not None and _reader.path == path and \
+            now - _checked < interval:
+        return _reader
+    with _lock:
+        _checked = now
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            logger.warning('The bloom filter %s does not exist.', path)
+            inode = None
+        replaced = _reader is not None and \
+            (_reader.path, _reader.inode) != (path, inode)
+        if replaced:
+            # requests may still be reading the old filter, it is closed
+            # by the garbage collector once they are done with it
+            _reader = None
+        if _reader is None and inode is not None:
+            _reader = BloomFilter(path)
+        return _reader
+
+
+_writer = None
+
+
+def add_to_bloom_filter(epcs):
+    """
+    Adds newly commissioned EPCs to the configured bloom filter file, if
+    there is one.  The file is kept open for writing and reopened when a
+    rebuild has replaced it, so additions always reach the live file.
+    """
+    global _writer
+    path = getattr(settings, 'VRS_BLOOM_FILTER_PATH', None)
+    if not epcs or not path:
+        return
+    with _lock:
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return
+        if _writer is not None and \
+                (_writer.path, _writer.inode) != (path, inode):
+            _writer.close()
+            _writer = None
+        if _writer is None:
+            _writer = BloomFilter(path, writable=True)
+        _writer.update(epcs)
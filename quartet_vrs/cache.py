@@ -0,0 +1,152 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe, in-process cache.  Entries expire after a
+    time-to-live and the least recently used entry is evicted once the
+    cache is full.  Each gunicorn worker holds its own copy, so entries
+    invalidated in one process age out of the others via the TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        """
+        :param maxsize: The maximum number of entries.  Zero disables the
+        cache.
+        :param ttl: The default time-to-live of an entry in seconds.  Zero
+        disables the cache.
+        :param timer: The clock used to expire entries.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """
+        :return: The cached value or default if the key is not cached or
+        has expired.
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Caches a value, evicting the least recently used entry if the
+        cache is full.
+        :param ttl: Overrides the default time-to-live for this entry.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self.timer() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for the key, calling loader(key) and
+        caching its result on a miss.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader(key)
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        :return: A dict with the size and hit/miss counters of the cache.
+        """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+CachedTradeItem = namedtuple('CachedTradeItem',
+                             ['company_prefix', 'gln', 'exists'])
+CachedTradeItem.__doc__ = """
+The master data the VRS needs for a GTIN.  exists is False for GTINs that
+are not in local master data.
+"""
+
+trade_item_cache = TTLCache(
+    maxsize=getattr(settings, 'VRS_TRADE_ITEM_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'VRS_TRADE_ITEM_CACHE_TTL', 300)
+)
+
+CachedCompanyAccess = namedtuple('CachedCompanyAccess',
+                                 ['exists', 'access_granted', 'responder_gln'])
+CachedCompanyAccess.__doc__ = """
+The access configured for a requestor GLN.  exists is False for GLNs that
+have no CompanyAccess record.
+"""
+
+company_access_cache = TTLCache(
+    maxsize=getattr(settings, 'VRS_COMPANY_ACCESS_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'VRS_COMPANY_ACCESS_CACHE_TTL', 300)
+)
+
+# Short lived negative results.  Keys are either a GTIN that is neither in
+# master data nor mapped to an external VRS, or a (GTIN, serial number)
+# tuple for a serial number that was never commissioned.
+negative_cache = TTLCache(
+    maxsize=getattr(settings, 'VRS_NEGATIVE_CACHE_SIZE', 100000),
+    ttl=getattr(settings, 'VRS_NEGATIVE_CACHE_TTL', 30)
+)
+
+# Responses of external VRSs keyed by (GTINMap primary key, forwarded URL).
+# Entries expire after the partner's Cache-Control max-age.
+external_response_cache = TTLCache(
+    maxsize=getattr(settings, 'VRS_EXTERNAL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'VRS_EXTERNAL_CACHE_TTL', 60)
+)
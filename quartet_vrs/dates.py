@@ -0,0 +1,50 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import re
+from functools import lru_cache
+
+from dateutil.parser import parser
+
+# ISO 8601 dates with an optional time and offset, e.g. 2015-12-31,
+# 2015-12-31T00:00:00.000-05:00, plus the compact YYYYMMDD form.
+_ISO_DATE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})(?:[T ].*)?$')
+# The GS1 YYMMDD form used in verification requests.
+_YYMMDD = re.compile(r'(\d{2})(\d{2})(\d{2})$')
+
+_parser = parser()
+
+
+@lru_cache(maxsize=4096)
+def format_exp_date(value: str) -> str:
+    """
+    Normalizes an expiration date to YYMMDD.  The ISO 8601 and YYMMDD
+    forms used by EPCIS ILMD and verification requests are handled
+    directly, anything else is parsed by dateutil.  Results are memoized
+    since most values repeat across the serial numbers of a lot.
+    :param value: The date to normalize.
+    :return: The date as YYMMDD.
+    :raises ValueError: if the value is not a valid date.
+    """
+    value = value.strip()
+    match = _ISO_DATE.match(value) or _YYMMDD.match(value)
+    if match:
+        year, month, day = match.groups()
+        if len(year) == 2:
+            year = '20' + year
+        # raises ValueError for dates such as 2015-02-30
+        datetime.date(int(year), int(month), int(day))
+        return year[2:] + month + day
+    return _parser.parse(value).strftime('%y%m%d')
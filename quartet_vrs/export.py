@@ -0,0 +1,121 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from quartet_vrs.models import RequestLog
+from quartet_vrs.payloads import decompress_payload
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+CONTENT_TYPES = {CSV: 'text/csv', NDJSON: 'application/x-ndjson'}
+FIELDS = ('id', 'created', 'operation', 'success', 'request_gln', 'gtin',
+          'lot', 'serial_number', 'expiry', 'corr_uuid', 'remote_address',
+          'user_name', 'verified', 'failure_reason', 'responder_gln',
+          'location', 'sample_rate', 'response')
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """
+    :param value: An ISO 8601 date or date and time, taken as UTC if it has
+    no offset.
+    :raises ValueError: If the value is not a date.
+    """
+    ret_val = parse_datetime(value)
+    if ret_val is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError('%s is not an ISO 8601 date.' % value)
+        ret_val = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(ret_val):
+        ret_val = timezone.make_aware(ret_val, datetime.timezone.utc)
+    return ret_val
+
+
+def get_export_queryset(start: datetime.datetime = None,
+                        end: datetime.datetime = None, request_gln: str = None,
+                        gtin: str = None):
+    """
+    :param start: The earliest creation time to export.
+    :param end: The creation time to export up to, exclusive.
+    :param request_gln: Only export the requests of this requestor GLN.
+    :param gtin: Only export the requests for this GTIN.
+    :return: The RequestLog values to export, oldest first.
+    """
+    queryset = RequestLog.objects.all()
+    if start:
+        queryset = queryset.filter(created__gte=start)
+    if end:
+        queryset = queryset.filter(created__lt=end)
+    if request_gln:
+        queryset = queryset.filter(request_gln=request_gln)
+    if gtin:
+        queryset = queryset.filter(gtin=gtin)
+    return queryset.order_by('created', 'pk').values_list(*FIELDS,
+                                                          'payload')
+
+
+class _Line:
+    """
+    A file-like object that returns what the csv writer writes to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, format: str = CSV, chunk_size: int = 2000):
+    """
+    Streams the rows of an export queryset.  The rows are read with
+    iterator(), which uses a server-side cursor on PostgreSQL, so memory
+    use does not depend on the size of the export.
+    :param format: 'csv', with a header line, or 'ndjson'.
+    :param chunk_size: The number of rows fetched from the database at a
+    time.
+    :return: A generator of lines.
+    """
+    if format == CSV:
+        return _csv_rows(queryset, chunk_size)
+    if format == NDJSON:
+        return _ndjson_rows(queryset, chunk_size)
+    raise ValueError('Unknown export format %s.' % format)
+
+
+def _get_record(row) -> dict:
+    record = dict(zip(FIELDS, row))
+    record['created'] = record['created'].isoformat()
+    if record['response'] is None and row[-1] is not None:
+        record['response'] = decompress_payload(row[-1])
+    return record
+
+
+def _csv_rows(queryset, chunk_size: int):
+    writer = csv.writer(_Line())
+    yield writer.writerow(FIELDS)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        record = _get_record(row)
+        yield writer.writerow([record[field] for field in FIELDS])
+
+
+def _ndjson_rows(queryset, chunk_size: int):
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield json.dumps(_get_record(row), cls=DjangoJSONEncoder,
+                         separators=(',', ':')) + '\n'
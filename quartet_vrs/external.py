@@ -0,0 +1,426 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from quartet_vrs.models import GTINMap
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# (GTINMap primary key, base URL) to a (fingerprint, Session) tuple.
+_sessions = {}
+# Base URL to CircuitBreaker.
+_breakers = {}
+# Base URL to the number of requests in flight.
+_outstanding = {}
+# Base URLs that are failing their health probes.
+_unhealthy = frozenset()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an external VRS whose circuit breaker is
+    open.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing external VRS.  After failure_threshold
+    consecutive failures the breaker opens and calls are refused for
+    open_interval seconds.  It then lets a single probe call through
+    (half-open), closing again if the probe succeeds and reopening if it
+    fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, open_interval: float,
+                 timer=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_interval = open_interval
+        self.timer = timer
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """
+        True while calls are being refused.
+        """
+        with self._lock:
+            return self.state == self.OPEN and \
+                self.timer() - self._opened_at < self.open_interval
+
+    def allow(self) -> bool:
+        """
+        :return: True if a call may be made.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self.timer() - self._opened_at < self.open_interval:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self.timer()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls.  The first caller for a key
+    makes the call and every caller that arrives while it is in flight
+    waits for and shares its result, or its exception.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, func):
+        """
+        :param key: Identifies identical calls.
+        :param func: Makes the call, taking no arguments.
+        :return: The result of func.
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._Call()
+                self._in_flight[key] = call
+                self.calls += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """
+        :return: A dict with the number of calls made and the number of
+        calls saved by sharing an in-flight call.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared,
+                    'in_flight': len(self._in_flight)}
+
+
+# Coalesces forwarded verifications by (GTINMap primary key, URL).
+single_flight = SingleFlight()
+
+
+def get_base_url(endpoint) -> str:
+    """
+    :param endpoint: A GTINMap or RouteEndpoint.
+    :return: The scheme, host and port of an external VRS endpoint.
+    """
+    protocol = "https://" if endpoint.use_ssl else "http://"
+    if endpoint.port is not None and endpoint.port != "443" and \
+            endpoint.port != "80":
+        return "{0}{1}:{2}".format(protocol, endpoint.host, endpoint.port)
+    return "{0}{1}".format(protocol, endpoint.host)
+
+
+def get_endpoints(gtin_map: GTINMap) -> list:
+    """
+    Queries the database unless the route's endpoints were prefetched, so
+    resolve them before handing a route to another thread.
+    :return: The RouteEndpoints of a route or, if it has none, a list
+    holding the route itself.
+    """
+    return list(gtin_map.endpoints.all()) or [gtin_map]
+
+
+def _create_session(gtin_map: GTINMap) -> requests.Session:
+    pool_size = getattr(settings, 'VRS_EXTERNAL_POOL_SIZE', 10)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if gtin_map.user_name is not None:
+        session.auth = HTTPBasicAuth(gtin_map.user_name, gtin_map.password)
+    return session
+
+
+def get_session(gtin_map: GTINMap, endpoint=None) -> requests.Session:
+    """
+    Returns the keep-alive session of a route endpoint, creating it on
+    first use and rebuilding it when the route's credentials have
+    changed.  Sessions live for the life of the worker so TCP and TLS
+    connections to the partner VRS are reused.
+    :param gtin_map: The route.
+    :param endpoint: The RouteEndpoint, defaults to the route's own host.
+    :return: A requests Session.
+    """
+    key = (gtin_map.pk, get_base_url(endpoint or gtin_map))
+    fingerprint = (gtin_map.user_name, gtin_map.password)
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is not None:
+            if entry[0] == fingerprint:
+                return entry[1]
+            entry[1].close()
+        session = _create_session(gtin_map)
+        _sessions[key] = (fingerprint, session)
+        return session
+
+
+def close_session(pk):
+    """
+    Closes the pooled connections of every endpoint of a route.
+    :param pk: The GTINMap primary key.
+    """
+    with _lock:
+        keys = [key for key in _sessions if key[0] == pk]
+        entries = [_sessions.pop(key) for key in keys]
+    for _, session in entries:
+        session.close()
+
+
+def close_sessions():
+    with _lock:
+        entries = list(_sessions.values())
+        _sessions.clear()
+    for _, session in entries:
+        session.close()
+
+
+def get_circuit_breaker(endpoint) -> CircuitBreaker:
+    """
+    Returns the breaker of an external VRS endpoint.  Routes that share a
+    host, port and protocol share a breaker.
+    :param endpoint: A GTINMap or RouteEndpoint.
+    """
+    base_url = get_base_url(endpoint)
+    with _lock:
+        breaker = _breakers.get(base_url)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                getattr(settings, 'VRS_EXTERNAL_FAILURE_THRESHOLD', 5),
+                getattr(settings, 'VRS_EXTERNAL_OPEN_INTERVAL', 30)
+            )
+            _breakers[base_url] = breaker
+        return breaker
+
+
+def reset_circuit_breakers():
+    with _lock:
+        _breakers.clear()
+
+
+def get_timeout(gtin_map: GTINMap):
+    """
+    :return: The (connect, read) timeout of a route in seconds.
+    """
+    connect_timeout = gtin_map.connect_timeout
+    if connect_timeout is None:
+        connect_timeout = getattr(settings, 'VRS_EXTERNAL_CONNECT_TIMEOUT',
+                                  3.05)
+    read_timeout = gtin_map.read_timeout
+    if read_timeout is None:
+        read_timeout = getattr(settings, 'VRS_EXTERNAL_READ_TIMEOUT', 10)
+    return connect_timeout, read_timeout
+
+
+def get_url(gtin_map: GTINMap, path: str) -> str:
+    """
+    :param path: The path, including the query string, relative to the
+    route's host.
+    :return: The full URL of a request to a route.
+    """
+    return urllib.parse.urljoin(get_base_url(gtin_map), path)
+
+
+def get_cache_ttl(response: requests.Response) -> float:
+    """
+    Works out how long an external VRS response may be cached from its
+    Cache-Control header.  Responses without a max-age use
+    VRS_EXTERNAL_CACHE_TTL and no response is cached for longer than
+    VRS_EXTERNAL_CACHE_MAX_TTL.
+    :return: The time-to-live in seconds, zero if the response must not
+    be cached.
+    """
+    ttl = getattr(settings, 'VRS_EXTERNAL_CACHE_TTL', 60)
+    for directive in response.headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name in ('no-store', 'no-cache', 'private'):
+            return 0
+        if name == 'max-age':
+            try:
+                ttl = max(int(value.strip('" ')), 0)
+            except ValueError:
+                return 0
+    return min(ttl, getattr(settings, 'VRS_EXTERNAL_CACHE_MAX_TTL', 300))
+
+
+def set_unhealthy(base_urls):
+    """
+    :param base_urls: The endpoints that are failing their health probes.
+    """
+    global _unhealthy
+    _unhealthy = frozenset(base_urls)
+
+
+def select_endpoints(gtin_map: GTINMap, endpoints: list = None) -> list:
+    """
+    Orders the endpoints of a route for a request.  Endpoints with the
+    fewest outstanding requests relative to their weight come first,
+    with idle endpoints chosen in proportion to their weights, and
+    endpoints that are failing their health probes or whose circuit
+    breaker is open come last.
+    :param endpoints: The route's endpoints from get_endpoints, looked up
+    when not given.
+    :return: A list of GTINMap or RouteEndpoint instances.
+    """
+    if endpoints is None:
+        endpoints = get_endpoints(gtin_map)
+    if len(endpoints) == 1:
+        return endpoints
+    scores = {}
+    with _lock:
+        for endpoint in endpoints:
+            base_url = get_base_url(endpoint)
+            breaker = _breakers.get(base_url)
+            # an exponential variate divided by the weight makes the
+            # chance of an idle endpoint being first proportional to it
+            unavailable = base_url in _unhealthy \
+                or (breaker is not None and breaker.is_open)
+            load = _outstanding.get(base_url, 0) + random.expovariate(1.0)
+            scores[id(endpoint)] = (unavailable,
+                                    load / max(endpoint.weight, 1))
+    return sorted(endpoints, key=lambda endpoint: scores[id(endpoint)])
+
+
+def _track(base_url: str, delta: int):
+    with _lock:
+        _outstanding[base_url] = _outstanding.get(base_url, 0) + delta
+
+
+def get(gtin_map: GTINMap, path: str,
+        endpoints: list = None) -> requests.Response:
+    """
+    Issues a GET to an external VRS over the pooled session of one of the
+    route's endpoints, failing over to the next endpoint on connection
+    errors and timeouts until VRS_EXTERNAL_DEADLINE seconds have passed.
+    The deadline is best-effort: no endpoint is tried once it has passed
+    and each attempt's connect and read timeouts are capped at the time
+    remaining, but the read timeout applies between bytes, so a partner
+    that keeps trickling a response can run past it.
+    Connection errors, timeouts and 5xx responses count as failures
+    towards the endpoint's circuit breaker.
+    :param gtin_map: The route.
+    :param path: The path, including the query string, relative to the
+    route's host.
+    :param endpoints: The route's endpoints from get_endpoints.  Pass them
+    in when calling from a thread that should not query the database.
+    :return: The response.
+    :raises CircuitOpenError: if the circuit breaker of every endpoint is
+    open.
+    """
+    deadline = time.monotonic() + getattr(settings, 'VRS_EXTERNAL_DEADLINE',
+                                          15)
+    connect_timeout, read_timeout = get_timeout(gtin_map)
+    error = None
+    for endpoint in select_endpoints(gtin_map, endpoints):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        base_url = get_base_url(endpoint)
+        breaker = get_circuit_breaker(endpoint)
+        if not breaker.allow():
+            error = error or CircuitOpenError(
+                'The external VRS at {0} is unavailable.'.format(base_url))
+            continue
+        _track(base_url, 1)
+        try:
+            response = get_session(gtin_map, endpoint).get(
+                urllib.parse.urljoin(base_url, path),
+                timeout=(min(connect_timeout, remaining),
+                         min(read_timeout, remaining))
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.record_failure()
+            logger.warning('Failing over from the external VRS at %s: %s',
+                           base_url, e)
+            error = e
+            continue
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            _track(base_url, -1)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+    raise error or requests.Timeout(
+        'No external VRS endpoint answered within the deadline.')
@@ -0,0 +1,139 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class FanOutClient:
+    """
+    Issues external VRS calls concurrently from an asyncio event loop that
+    runs on its own thread.  Each call is a blocking function, such as a
+    request over a route's pooled session, that is run on the loop's
+    executor, so a batch takes about as long as its slowest partner.
+    Concurrency is bounded globally and per host.
+
+    Synchronous code uses run(), coroutines use gather().
+    """
+
+    def __init__(self, max_concurrency: int, max_per_host: int):
+        """
+        :param max_concurrency: The maximum number of calls in flight.
+        :param max_per_host: The maximum number of calls in flight to a
+        single host.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._loop = None
+        self._executor = None
+        self._semaphore = None
+        self._host_semaphores = {}
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The client's event loop, which is started on first use.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix='vrs-fanout'
+                )
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=self._run_loop, args=(loop,),
+                                 name='vrs-fanout-loop', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    async def _call(self, host: str, func, args):
+        # runs on the client's loop, so the semaphores need no locking
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = asyncio.Semaphore(self.max_per_host)
+            self._host_semaphores[host] = host_semaphore
+        async with host_semaphore:
+            async with self._semaphore:
+                return await asyncio.get_event_loop().run_in_executor(
+                    self._executor, func, *args)
+
+    async def _gather(self, calls, timeout):
+        coroutines = [self._call(host, func, args)
+                      for host, func, args in calls]
+        if timeout is not None:
+            # the same deadline for every call, including those still
+            # waiting for a semaphore or an executor thread
+            coroutines = [asyncio.wait_for(coroutine, max(timeout, 0))
+                          for coroutine in coroutines]
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+
+    def submit(self, calls, timeout: float = None):
+        """
+        Schedules calls on the client's loop.
+        :param calls: An iterable of (host, func, args) tuples.
+        :param timeout: The number of seconds after which the calls that
+        have not finished are given up on.
+        :return: A concurrent.futures.Future of the results.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._gather(list(calls), timeout), self.loop)
+
+    def run(self, calls, timeout: float = None) -> list:
+        """
+        Runs calls concurrently and waits for all of them.
+        :param calls: An iterable of (host, func, args) tuples.
+        :param timeout: The maximum number of seconds to wait.  Calls that
+        have not finished by then are cancelled if they have not started,
+        or left to finish on their thread, and the caller does not wait
+        for them.
+        :return: The results in the order of the calls.  A call that
+        raised has its exception in place of a result, and one that did not
+        finish in time an asyncio.TimeoutError.
+        """
+        return self.submit(calls, timeout).result()
+
+    async def gather(self, calls, timeout: float = None) -> list:
+        """
+        The awaitable form of run() for use from any event loop.
+        """
+        return await asyncio.wrap_future(self.submit(calls, timeout))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_fanout_client() -> FanOutClient:
+    """
+    :return: The process wide FanOutClient configured by
+    VRS_EXTERNAL_MAX_CONCURRENCY and VRS_EXTERNAL_MAX_PER_HOST.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = FanOutClient(
+                getattr(settings, 'VRS_EXTERNAL_MAX_CONCURRENCY', 20),
+                getattr(settings, 'VRS_EXTERNAL_MAX_PER_HOST', 5)
+            )
+        return _client
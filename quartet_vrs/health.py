@@ -0,0 +1,209 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import logging
+import math
+import posixpath
+import time
+import urllib.parse
+from collections import deque
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from quartet_vrs import external
+from quartet_vrs.fanout import get_fanout_client
+from quartet_vrs.models import GTINMap, RouteHealth
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyWindow:
+    """
+    The outcomes and latencies of the most recent probes of an endpoint.
+    """
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+
+    @classmethod
+    def from_health(cls, health: RouteHealth, size: int):
+        """
+        Rebuilds a full window from the availability and latency
+        percentiles saved in RouteHealth, so that a restarted prober
+        carries on from the last results instead of starting empty.  The
+        samples are synthetic but reproduce the saved figures.
+        """
+        window = cls(size)
+        successes = int(round(health.availability * size))
+        if health.latency_p50 is None:
+            successes = 0
+        p90 = health.latency_p90 if health.latency_p90 is not None \
+            else health.latency_p50
+        p99 = health.latency_p99 if health.latency_p99 is not None else p90
+        rank = 0
+        for i in range(size):
+            # spread the failures evenly so that new probes age out a
+            # representative mix
+            if (i + 1) * successes // size == i * successes // size:
+                window.add(False, 0.0)
+                continue
+            rank += 1
+            if rank <= math.ceil(0.5 * successes):
+                latency = health.latency_p50
+            elif rank <= math.ceil(0.9 * successes):
+                latency = p90
+            else:
+                latency = p99
+            window.add(True, latency)
+        return window
+
+    def add(self, ok: bool, latency: float):
+        self.samples.append((ok, latency))
+
+    @property
+    def availability(self) -> float:
+        if not self.samples:
+            return 1.0
+        return sum(1 for ok, _ in self.samples if ok) / len(self.samples)
+
+    def percentile(self, percent: float):
+        """
+        :return: The nearest-rank percentile of the latency of successful
+        probes or None if there are none.
+        """
+        latencies = sorted(latency for ok, latency in self.samples if ok)
+        if not latencies:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * len(latencies))), 1)
+        return latencies[rank - 1]
+
+
+class HealthProber:
+    """
+    Calls checkConnectivity on every distinct external VRS endpoint and
+    records its availability and latency percentiles in RouteHealth.  An
+    endpoint becomes unhealthy after VRS_HEALTH_UNHEALTHY_AFTER
+    consecutive failed probes and healthy again after a successful one.
+    Any response below 500 counts as a success since it shows the
+    partner is up.
+    """
+
+    def __init__(self, window: int = None):
+        self.window = window or getattr(settings, 'VRS_HEALTH_WINDOW', 100)
+        self.unhealthy_after = getattr(settings, 'VRS_HEALTH_UNHEALTHY_AFTER',
+                                       3)
+        # base URL to LatencyWindow, seeded from RouteHealth on first use
+        self.windows = {}
+
+    def get_endpoints(self) -> dict:
+        """
+        :return: A dict of base URL to a (route, endpoint) tuple for every
+        distinct endpoint of every route.
+        """
+        ret_val = {}
+        for gtin_map in GTINMap.objects.prefetch_related('endpoints'):
+            for endpoint in external.get_endpoints(gtin_map):
+                ret_val.setdefault(external.get_base_url(endpoint),
+                                   (gtin_map, endpoint))
+        return ret_val
+
+    def probe(self, gtin_map: GTINMap, endpoint):
+        """
+        :return: An (ok, latency in milliseconds) tuple.
+        """
+        req_gln = getattr(settings, 'VRS_HEALTH_CHECK_GLN',
+                          getattr(settings, 'DEFAULT_VRS_RESPONDER_GLN', ''))
+        path = posixpath.join(gtin_map.path or '/',
+                              "checkConnectivity?gtin={0}&reqGLN={1}".format(
+                                  gtin_map.gtin or '', req_gln))
+        url = urllib.parse.urljoin(external.get_base_url(endpoint), path)
+        start = time.monotonic()
+        try:
+            response = external.get_session(gtin_map, endpoint).get(
+                url, timeout=external.get_timeout(gtin_map))
+            ok = response.status_code < 500
+        except requests.RequestException as e:
+            logger.warning('The health probe of %s failed: %s', url, e)
+            ok = False
+        return ok, (time.monotonic() - start) * 1000
+
+    def probe_all(self) -> list:
+        """
+        Probes every endpoint concurrently and saves the results.
+        :return: The updated RouteHealth records.
+        """
+        endpoints = self.get_endpoints()
+        results = get_fanout_client().run(
+            (base_url, self.probe, route_endpoint)
+            for base_url, route_endpoint in endpoints.items()
+        )
+        existing = {
+            health.base_url: health for health in
+            RouteHealth.objects.filter(base_url__in=endpoints.keys())
+        }
+        now = timezone.now()
+        ret_val = []
+        for base_url, result in zip(endpoints.keys(), results):
+            if isinstance(result, Exception):
+                result = (False, 0)
+            ok, latency = result
+            health = existing.get(base_url) or RouteHealth(base_url=base_url)
+            window = self.windows.get(base_url)
+            if window is None:
+                if health.pk is None:
+                    window = LatencyWindow(self.window)
+                else:
+                    window = LatencyWindow.from_health(health, self.window)
+                self.windows[base_url] = window
+            window.add(ok, latency)
+            health.consecutive_failures = \
+                0 if ok else health.consecutive_failures + 1
+            health.healthy = \
+                health.consecutive_failures < self.unhealthy_after
+            health.availability = window.availability
+            health.latency_p50 = window.percentile(50)
+            health.latency_p90 = window.percentile(90)
+            health.latency_p99 = window.percentile(99)
+            health.last_checked = now
+            if ok:
+                health.last_success = now
+            health.save()
+            ret_val.append(health)
+        return ret_val
+
+
+_loaded = None
+
+
+def refresh_route_health():
+    """
+    Reloads the unhealthy endpoints used to order route endpoints when
+    they are older than VRS_ROUTE_HEALTH_TTL seconds.  Called from the
+    request thread so that endpoint selection itself makes no queries.
+    """
+    global _loaded
+    ttl = getattr(settings, 'VRS_ROUTE_HEALTH_TTL', 15)
+    if _loaded is not None and time.monotonic() - _loaded < ttl:
+        return
+    _loaded = time.monotonic()
+    external.set_unhealthy(
+        RouteHealth.objects.filter(healthy=False).values_list('base_url',
+                                                              flat=True))
+
+
+def invalidate_route_health():
+    global _loaded
+    _loaded = None
@@ -0,0 +1,202 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import logging
+
+from django.db.models import Q
+
+from quartet_epcis.models.entries import EntryEvent
+from quartet_epcis.models.events import Event, InstanceLotMasterData
+from quartet_vrs.bloom import add_to_bloom_filter
+from quartet_vrs.cache import negative_cache
+from quartet_vrs.dates import format_exp_date
+from quartet_vrs.models import ProductInstance, Lot
+from quartet_vrs.verification import Verification, _chunked
+
+logger = logging.getLogger(__name__)
+
+SGTIN_PREFIX = 'urn:epc:id:sgtin:'
+
+
+def parse_sgtin(epc: str):
+    """
+    Converts an SGTIN EPC URN into its GTIN-14 and serial number.
+    :param epc: An SGTIN URN, e.g. urn:epc:id:sgtin:305555.0555555.1
+    :return: A (gtin, serial_number) tuple.
+    """
+    company_prefix, item_ref, serial_number = epc[len(SGTIN_PREFIX):].split(
+        '.', 2)
+    gtin = item_ref[0] + company_prefix + item_ref[1:]
+    return gtin + _check_digit(gtin), serial_number
+
+
+def _check_digit(digits: str):
+    total = sum(
+        int(digit) * (3 if i % 2 == 0 else 1)
+        for i, digit in enumerate(reversed(digits))
+    )
+    return str((10 - total % 10) % 10)
+
+
+def commissioning_events():
+    """
+    :return: A QuerySet of the events that commission product instances,
+    either by business step or by carrying lot/expiry ILMD.
+    """
+    commissioning = Q(biz_step__endswith='commissioning')
+    ilmd = Q(instancelotmasterdata__name__in=Verification.ILMD_NAMES)
+    return Event.objects.filter(commissioning | ilmd).distinct()
+
+
+def is_commissioning(event) -> bool:
+    """
+    :return: True if an event commissions product instances by business
+    step.  Used while an event is being parsed, before its ILMD is saved.
+    """
+    return bool(event.biz_step) and event.biz_step.endswith('commissioning')
+
+
+def commissioned_sgtins():
+    """
+    :return: A QuerySet of the EntryEvent rows of the SGTINs in
+    commissioning events.
+    """
+    return EntryEvent.objects.filter(
+        identifier__startswith=SGTIN_PREFIX,
+        event_id__in=commissioning_events().values('pk')
+    )
+
+
+def index_message(message_id) -> int:
+    """
+    Indexes the product instances commissioned by the events in an
+    inbound EPCIS message.
+    :param message_id: The quartet_epcis Message id of the parsed message.
+    :return: The number of product instances indexed.
+    """
+    return index_events(
+        commissioning_events().filter(message_id=message_id).values_list(
+            'id', flat=True)
+    )
+
+
+def index_events(event_ids, chunk_size: int = 1000) -> int:
+    """
+    Creates or updates the ProductInstance rows for every SGTIN in the
+    given commissioning events using the lot and expiry in their ILMD, along
+    with the Lot rows for their lots.  Also adds their EPCs to the bloom
+    filter and evicts any cached results for them.
+    :param event_ids: The primary keys of the events to index.
+    :param chunk_size: The number of events to handle per query.
+    :return: The number of product instances indexed.
+    """
+    count = 0
+    for chunk in _chunked(event_ids, chunk_size):
+        ilmd = {}
+        for event_id, name, value in InstanceLotMasterData.objects.filter(
+            event_id__in=chunk, name__in=Verification.ILMD_NAMES
+        ).values_list('event_id', 'name', 'value'):
+            if name == 'itemExpirationDate':
+                try:
+                    value = format_exp_date(value)
+                except (ValueError, OverflowError):
+                    logger.warning('Could not normalize the expiry %s for '
+                                   'event %s.', value, event_id)
+                    value = None
+            ilmd.setdefault(event_id, {})[name] = value
+        instances = {}
+        lots = {}
+        epcs = set()
+        for event_id, identifier in EntryEvent.objects.filter(
+            event_id__in=chunk, identifier__startswith=SGTIN_PREFIX
+        ).order_by('event_time').values_list('event_id', 'identifier'):
+            md = ilmd.get(event_id, {})
+            lot, expiry = md.get('lotNumber'), md.get('itemExpirationDate')
+            gtin, serial_number = parse_sgtin(identifier)
+            instances[(gtin, serial_number)] = (lot, expiry)
+            if lot and expiry:
+                lots[(gtin, lot)] = expiry
+            epcs.add(identifier)
+        add_to_bloom_filter(epcs)
+        for key in instances:
+            negative_cache.invalidate(key)
+        _save_lots(lots)
+        count += _save_instances(instances)
+    return count
+
+
+def _save_instances(instances: dict) -> int:
+    """
+    Upserts ProductInstance rows.  Existing lot and expiry values are not
+    overwritten by events that do not carry them.
+    :param instances: A dict of (gtin, serial_number) to (lot, expiry).
+    :return: The number of rows created or updated.
+    """
+    keys = list(instances.keys())
+    updated = []
+    for chunk in _chunked(keys, 500):
+        existing = ProductInstance.objects.filter(
+            gtin__in={gtin for gtin, _ in chunk},
+            serial_number__in={serial_number for _, serial_number in chunk}
+        )
+        for instance in existing:
+            key = (instance.gtin, instance.serial_number)
+            if key not in instances:
+                continue
+            lot, expiry = instances.pop(key)
+            lot = lot or instance.lot
+            expiry = expiry or instance.expiry
+            if (lot, expiry) != (instance.lot, instance.expiry):
+                instance.lot = lot
+                instance.expiry = expiry
+                updated.append(instance)
+    ProductInstance.objects.bulk_update(updated, ['lot', 'expiry'],
+                                        batch_size=500)
+    ProductInstance.objects.bulk_create(
+        [
+            ProductInstance(gtin=gtin, serial_number=serial_number, lot=lot,
+                            expiry=expiry)
+            for (gtin, serial_number), (lot, expiry) in instances.items()
+        ],
+        batch_size=500,
+        ignore_conflicts=True
+    )
+    return len(updated) + len(instances)
+
+
+def _save_lots(lots: dict):
+    """
+    Upserts Lot rows.
+    :param lots: A dict of (gtin, lot) to the normalized expiry.
+    """
+    updated = []
+    for chunk in _chunked(list(lots.keys()), 500):
+        for lot in Lot.objects.filter(gtin__in={gtin for gtin, _ in chunk},
+                                      lot__in={lot for _, lot in chunk}):
+            key = (lot.gtin, lot.lot)
+            if key not in lots:
+                continue
+            expiry = lots.pop(key)
+            if expiry != lot.expiry:
+                lot.expiry = expiry
+                updated.append(lot)
+    Lot.objects.bulk_update(updated, ['expiry'], batch_size=500)
+    Lot.objects.bulk_create(
+        [
+            Lot(gtin=gtin, lot=lot, expiry=expiry)
+            for (gtin, lot), expiry in lots.items()
+        ],
+        batch_size=500,
+        ignore_conflicts=True
+    )
@@ -0,0 +1,115 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from quartet_epcis.models.entries import EntryEvent
+from quartet_vrs.bloom import BloomFilter
+from quartet_vrs.indexing import commissioned_sgtins
+
+
+class Command(BaseCommand):
+    help = _('Builds the bloom filter of commissioned SGTINs used to answer '
+             'verification requests for unknown serial numbers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=getattr(settings, 'VRS_BLOOM_FILTER_PATH', None),
+            help=_('The bloom filter file.  Defaults to the '
+                   'VRS_BLOOM_FILTER_PATH setting.')
+        )
+        parser.add_argument(
+            '--capacity', type=int, default=None,
+            help=_('The number of SGTINs to size the filter for.  Defaults '
+                   'to twice the number of SGTINs in the database.')
+        )
+        parser.add_argument(
+            '--error-rate', type=float,
+            default=getattr(settings, 'VRS_BLOOM_FILTER_ERROR_RATE', 0.001),
+            help=_('The false positive rate at capacity.')
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help=_('The number of SGTINs to read from the database at once.')
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError(_('Please supply a --path or configure the '
+                                 'VRS_BLOOM_FILTER_PATH setting.'))
+        sgtins = commissioned_sgtins()
+        capacity = options['capacity'] or max(sgtins.count() * 2, 1000000)
+        # events captured after the high-water mark, or still being
+        # committed when it was taken, are replayed once the build is done
+        margin = getattr(settings, 'VRS_BLOOM_FILTER_REPLAY_MARGIN', 600)
+        high_water = EntryEvent.objects.filter(
+            created__lt=timezone.now() - datetime.timedelta(seconds=margin)
+        ).order_by('-id').values_list('id', flat=True).first() or 0
+        print(_('Building a bloom filter for %s SGTINs...') % capacity)
+        # build next to the live file and swap it in so that running
+        # workers never see a partially built filter
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=os.path.basename(path) + '.', suffix='.tmp'
+        )
+        os.close(fd)
+        try:
+            bloom_filter = BloomFilter.create(temp_path, capacity,
+                                              options['error_rate'])
+            try:
+                self._add(bloom_filter, sgtins.filter(id__lte=high_water),
+                          options['chunk_size'])
+                self._add(bloom_filter, sgtins.filter(id__gt=high_water),
+                          options['chunk_size'])
+            finally:
+                bloom_filter.close()
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        # SGTINs that were added to the old file while the new one was
+        # being swapped in
+        bloom_filter = BloomFilter(path, writable=True)
+        try:
+            self._add(bloom_filter, sgtins.filter(id__gt=high_water),
+                      options['chunk_size'])
+            count = bloom_filter.count
+        finally:
+            bloom_filter.close()
+        self.stdout.write(
+            self.style.SUCCESS(
+                _('Successfully added %s SGTINs to the bloom filter at %s.')
+                % (count, path)
+            )
+        )
+
+    def _add(self, bloom_filter, queryset, chunk_size):
+        batch = []
+        for identifier in queryset.values_list(
+            'identifier', flat=True
+        ).iterator(chunk_size=chunk_size):
+            batch.append(identifier)
+            if len(batch) >= chunk_size:
+                bloom_filter.update(batch)
+                batch = []
+        bloom_filter.update(batch)
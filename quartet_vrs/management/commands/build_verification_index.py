@@ -0,0 +1,57 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+
+from quartet_vrs.indexing import commissioning_events, index_events
+from quartet_vrs.models import ProductInstance
+
+
+class Command(BaseCommand):
+    help = _('Builds the VRS verification index from the commissioning '
+             'events already in the EPCIS database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help=_('The number of events to index per chunk.')
+        )
+        parser.add_argument(
+            '--clear', action='store_true', default=False,
+            help=_('Delete the existing index before building it.')
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if options['clear']:
+            print(_('Clearing the verification index...'))
+            ProductInstance.objects.all().delete()
+        events = commissioning_events().order_by('id').values_list(
+            'id', flat=True)
+        last_id = None
+        total = 0
+        while True:
+            chunk_events = events.filter(id__gt=last_id) if last_id else events
+            chunk = list(chunk_events[:chunk_size])
+            if not chunk:
+                break
+            total += index_events(chunk, chunk_size=chunk_size)
+            last_id = chunk[-1]
+            print(_('Indexed %s product instances...') % total)
+        self.stdout.write(
+            self.style.SUCCESS(
+                _('Successfully indexed %s product instances.') % total
+            )
+        )
@@ -0,0 +1,72 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext as _
+
+from quartet_vrs import export
+
+
+class Command(BaseCommand):
+    help = _('Streams the request log, optionally filtered by date range, '
+             'requestor GLN and GTIN, to a CSV or NDJSON file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start',
+            help=_('The earliest date or date and time to export.')
+        )
+        parser.add_argument(
+            '--end',
+            help=_('The date or date and time to export up to, exclusive.')
+        )
+        parser.add_argument('--request-gln', help=_('The requestor GLN.'))
+        parser.add_argument('--gtin', help=_('The GTIN.'))
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default=export.CSV,
+            help=_('The export format.')
+        )
+        parser.add_argument(
+            '--output',
+            help=_('The file to write, standard output if omitted.')
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help=_('The number of rows fetched from the database at a '
+                   'time.')
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = export.parse_time(options['start']) \
+                if options['start'] else None
+            end = export.parse_time(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        queryset = export.get_export_queryset(
+            start, end, options['request_gln'], options['gtin'])
+        output = open(options['output'], 'w', encoding='utf-8', newline='') \
+            if options['output'] else sys.stdout
+        try:
+            for line in export.export_rows(queryset, options['format'],
+                                           options['chunk_size']):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(
+                _('Exported the request log to %s.') % options['output']))
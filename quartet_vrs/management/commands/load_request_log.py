@@ -0,0 +1,48 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+
+from quartet_vrs.request_log import get_spool_directory, get_spool_files, \
+    load_spool_file, SpoolFileError
+
+
+class Command(BaseCommand):
+    help = _('Loads the closed request log spool files written by the '
+             'spool request log backend, and those left open by processes '
+             'that died, into the request log and deletes them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default=get_spool_directory(),
+            help=_('The spool directory.')
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help=_('The number of records per bulk insert.')
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for path in get_spool_files(options['directory']):
+            try:
+                count = load_spool_file(path, options['batch_size'])
+            except SpoolFileError as e:
+                print(str(e))
+                continue
+            print(_('Loaded %s requests from %s') % (count, path))
+            total += count
+        self.stdout.write(self.style.SUCCESS(
+            _('Loaded %s requests.') % total))
@@ -0,0 +1,42 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.translation import gettext as _
+
+from quartet_vrs import partitions
+
+
+class Command(BaseCommand):
+    help = _('Converts the request log into a PostgreSQL table partitioned '
+             'by month so that prune_request_log can drop whole months.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int,
+            default=getattr(settings, 'VRS_REQUEST_LOG_MONTHS_AHEAD', 3),
+            help=_('The number of future monthly partitions to create.')
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(_('Request log partitions require '
+                                 'PostgreSQL.'))
+        partitions.convert_to_partitioned(options['months_ahead'])
+        for month, name in partitions.get_partitions():
+            print(name)
+        self.stdout.write(self.style.SUCCESS(
+            _('The request log is partitioned by month.')))
@@ -0,0 +1,60 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+
+from quartet_vrs.health import HealthProber
+
+
+class Command(BaseCommand):
+    help = _('Periodically probes the checkConnectivity endpoint of every '
+             'external VRS route and records its availability and latency '
+             'so that unhealthy endpoints are tried last.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            default=getattr(settings, 'VRS_HEALTH_CHECK_INTERVAL', 30),
+            help=_('The number of seconds between probes.')
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help=_('Probe every endpoint once and exit.')
+        )
+
+    def handle(self, *args, **options):
+        prober = HealthProber()
+        while True:
+            start = time.monotonic()
+            for health in prober.probe_all():
+                print(_('%s: %s, availability %.2f, p50 %s ms, p99 %s ms') % (
+                    health.base_url,
+                    _('healthy') if health.healthy else _('unhealthy'),
+                    health.availability,
+                    _format_latency(health.latency_p50),
+                    _format_latency(health.latency_p99)
+                ))
+            if options['once']:
+                break
+            elapsed = time.monotonic() - start
+            time.sleep(max(options['interval'] - elapsed, 0))
+        self.stdout.write(self.style.SUCCESS(_('Probed the VRS routes.')))
+
+
+def _format_latency(latency):
+    return '-' if latency is None else '%.1f' % latency
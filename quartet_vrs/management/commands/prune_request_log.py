@@ -0,0 +1,67 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from quartet_vrs import partitions
+
+
+class Command(BaseCommand):
+    help = _('Removes request log entries older than the retention window. '
+             'A partitioned request log drops whole monthly partitions and '
+             'creates the partitions of the coming months, any other '
+             'request log is pruned with batched deletes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'VRS_REQUEST_LOG_RETENTION_DAYS', 90),
+            help=_('The number of days of requests to keep.')
+        )
+        parser.add_argument(
+            '--archive', action='store_true',
+            help=_('Detach expired partitions and keep them as standalone '
+                   'tables instead of dropping them.')
+        )
+        parser.add_argument(
+            '--months-ahead', type=int,
+            default=getattr(settings, 'VRS_REQUEST_LOG_MONTHS_AHEAD', 3),
+            help=_('The number of future monthly partitions to create.')
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help=_('The number of rows per delete without partitions.')
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = now - datetime.timedelta(days=options['days'])
+        if partitions.is_partitioned():
+            partitions.create_partitions(
+                now, partitions.add_months(partitions.month_start(now),
+                                           options['months_ahead']))
+            for name in partitions.drop_partitions(cutoff,
+                                                   options['archive']):
+                print(_('Detached %s') % name if options['archive']
+                      else _('Dropped %s') % name)
+        else:
+            print(_('Deleted %s requests') % partitions.delete_before(
+                cutoff, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(
+            _('Pruned the request log before %s.') % cutoff.isoformat()))
@@ -0,0 +1,34 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+
+from quartet_vrs.rollups import rollup_request_log
+
+
+class Command(BaseCommand):
+    help = _('Adds the request log entries logged since the last run to the '
+             'hourly request rollups.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help=_('The number of request log entries per transaction.')
+        )
+
+    def handle(self, *args, **options):
+        count = rollup_request_log(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            _('Rolled up %s requests.') % count))
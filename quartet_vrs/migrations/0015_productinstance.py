@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0014_auto_20200730_2129'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductInstance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gtin', models.CharField(help_text='The GTIN-14 of the product instance.', max_length=14, verbose_name='GTIN')),
+                ('serial_number', models.CharField(help_text='The serial number of the product instance.', max_length=50, verbose_name='Serial Number')),
+                ('lot', models.CharField(help_text='The lot number from the commissioning ILMD.', max_length=150, null=True, verbose_name='Lot/Batch')),
+                ('expiry', models.CharField(help_text='The item expiration date from the commissioning ILMD normalized to YYMMDD.', max_length=6, null=True, verbose_name='Expiry Date')),
+            ],
+            options={
+                'verbose_name': 'Product Instance',
+                'verbose_name_plural': 'Product Instances',
+                'db_table': 'quartet_vrs_product_instance',
+                'unique_together': {('gtin', 'serial_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0015_productinstance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gtin', models.CharField(help_text='The GTIN-14 of the lot.', max_length=14, verbose_name='GTIN')),
+                ('lot', models.CharField(help_text='The lot number from the commissioning ILMD.', max_length=150, verbose_name='Lot/Batch')),
+                ('expiry', models.CharField(help_text='The item expiration date from the commissioning ILMD normalized to YYMMDD.', max_length=6, verbose_name='Expiry Date')),
+            ],
+            options={
+                'verbose_name': 'Lot',
+                'verbose_name_plural': 'Lots',
+                'db_table': 'quartet_vrs_lot',
+                'unique_together': {('gtin', 'lot')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0016_lot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gtinmap',
+            name='connect_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for a connection to the VRS Router. Defaults to the VRS_EXTERNAL_CONNECT_TIMEOUT setting.', null=True, verbose_name='Connect Timeout'),
+        ),
+        migrations.AddField(
+            model_name='gtinmap',
+            name='read_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for a response from the VRS Router. Defaults to the VRS_EXTERNAL_READ_TIMEOUT setting.', null=True, verbose_name='Read Timeout'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0017_gtinmap_timeouts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gtinmap',
+            name='prefix',
+            field=models.CharField(blank=True, help_text='A GS1 Company Prefix, or a longer GTIN prefix, routed to this VRS. It is matched against the GTIN-14 without its indicator digit, the longest matching prefix wins and GTIN routes take precedence.', max_length=13, null=True, unique=True, verbose_name='Prefix'),
+        ),
+        migrations.AlterField(
+            model_name='gtinmap',
+            name='gtin',
+            field=models.CharField(blank=True, db_index=True, help_text='A GTIN that represents a Trade Item. Leave blank for a prefix route.', max_length=14, null=True, unique=True, verbose_name='GTIN'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0018_gtinmap_prefix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteEndpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(help_text='The Hostname of the VRS Router endpoint.', max_length=256, verbose_name='Hostname')),
+                ('port', models.CharField(blank=True, help_text='Port Number to use when calling the endpoint. NOTE: Port is NOT required when Port Number is 443 or 80', max_length=10, null=True, verbose_name='Port')),
+                ('use_ssl', models.BooleanField(default=True, help_text='True if the endpoint should be called over SSL.', verbose_name='Use SSL')),
+                ('weight', models.PositiveIntegerField(default=1, help_text='The relative share of requests sent to this endpoint.', verbose_name='Weight')),
+                ('route', models.ForeignKey(help_text='The route this endpoint serves.', on_delete=django.db.models.deletion.CASCADE, related_name='endpoints', to='quartet_vrs.GTINMap', verbose_name='Route')),
+            ],
+            options={
+                'verbose_name': 'Route Endpoint',
+                'verbose_name_plural': 'Route Endpoints',
+                'db_table': 'quartet_vrs_route_endpoint',
+            },
+        ),
+    ]
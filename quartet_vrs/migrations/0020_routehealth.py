@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0019_routeendpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteHealth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_url', models.CharField(help_text='The scheme, host and port of the external VRS.', max_length=300, unique=True, verbose_name='Endpoint')),
+                ('healthy', models.BooleanField(default=True, help_text='False while the endpoint is failing its probes. Unhealthy endpoints are tried last.', verbose_name='Healthy')),
+                ('availability', models.FloatField(default=1.0, help_text='The share of successful probes in the rolling window.', verbose_name='Availability')),
+                ('latency_p50', models.FloatField(help_text='The median probe latency in the rolling window.', null=True, verbose_name='Latency p50 (ms)')),
+                ('latency_p90', models.FloatField(help_text='The 90th percentile probe latency in the rolling window.', null=True, verbose_name='Latency p90 (ms)')),
+                ('latency_p99', models.FloatField(help_text='The 99th percentile probe latency in the rolling window.', null=True, verbose_name='Latency p99 (ms)')),
+                ('consecutive_failures', models.PositiveIntegerField(default=0, verbose_name='Consecutive Failures')),
+                ('last_checked', models.DateTimeField(null=True, verbose_name='Last Checked')),
+                ('last_success', models.DateTimeField(null=True, verbose_name='Last Success')),
+            ],
+            options={
+                'verbose_name': 'Route Health',
+                'verbose_name_plural': 'Route Health',
+                'db_table': 'quartet_vrs_route_health',
+            },
+        ),
+    ]
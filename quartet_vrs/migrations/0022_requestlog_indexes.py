@@ -0,0 +1,79 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+# A b-tree is read in either direction, so created is ascending in every
+# index and still serves the admin's newest-first ordering.
+INDEXES = [
+    models.Index(fields=['created'], name='vrs_reqlog_created_idx'),
+    models.Index(fields=['success', 'created'], name='vrs_reqlog_success_idx'),
+    models.Index(fields=['operation', 'created'], name='vrs_reqlog_operation_idx'),
+    models.Index(fields=['gtin', 'serial_number'], name='vrs_reqlog_gtin_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+    models.Index(fields=['serial_number'], name='vrs_reqlog_serial_idx', opclasses=['varchar_pattern_ops']),
+    models.Index(fields=['lot'], name='vrs_reqlog_lot_idx', opclasses=['varchar_pattern_ops']),
+    models.Index(fields=['request_gln', 'created'], name='vrs_reqlog_request_gln_idx'),
+    models.Index(fields=['corr_uuid'], name='vrs_reqlog_corr_uuid_idx'),
+]
+
+
+def is_partitioned(schema_editor, model):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p '
+            'JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s', [model._meta.db_table]
+        )
+        return cursor.fetchone() is not None
+
+
+def create_indexes(apps, schema_editor):
+    """
+    Builds the indexes without locking the request log against writes on
+    PostgreSQL, which is why this migration is not atomic.  PostgreSQL
+    cannot build the index of a partitioned table concurrently, so one
+    converted by partition_request_log, which builds these indexes itself,
+    gets a plain CREATE INDEX for any that are missing.
+    """
+    model = apps.get_model('quartet_vrs', 'RequestLog')
+    if schema_editor.connection.vendor != 'postgresql':
+        for index in INDEXES:
+            schema_editor.add_index(model, index)
+        return
+    create = 'CREATE INDEX IF NOT EXISTS' if is_partitioned(
+        schema_editor, model) else 'CREATE INDEX CONCURRENTLY IF NOT EXISTS'
+    for index in INDEXES:
+        schema_editor.execute(str(index.create_sql(model, schema_editor)).replace(
+            'CREATE INDEX', create, 1))
+
+
+def drop_indexes(apps, schema_editor):
+    model = apps.get_model('quartet_vrs', 'RequestLog')
+    if schema_editor.connection.vendor != 'postgresql':
+        for index in INDEXES:
+            schema_editor.remove_index(model, index)
+        return
+    drop = 'DROP INDEX IF EXISTS' if is_partitioned(
+        schema_editor, model) else 'DROP INDEX CONCURRENTLY IF EXISTS'
+    for index in INDEXES:
+        schema_editor.execute('%s %s' % (
+            drop, schema_editor.quote_name(index.name)))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('quartet_vrs', '0021_requestlog_created'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name='requestlog', index=index)
+                for index in INDEXES
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0022_requestlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestLogRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='The start of the hour, in UTC.', verbose_name='Hour')),
+                ('operation', models.CharField(blank=True, default='', max_length=50, verbose_name='Operation')),
+                ('request_gln', models.CharField(blank=True, default='', max_length=13, verbose_name='Requestor GLN')),
+                ('gtin', models.CharField(blank=True, default='', max_length=14, verbose_name='GTIN')),
+                ('success', models.BooleanField(default=False, verbose_name='Success')),
+                ('failure_reason', models.CharField(blank=True, default='', help_text='The verificationFailureReason of failed verifications.', max_length=50, verbose_name='Failure Reason')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+            ],
+            options={
+                'verbose_name': 'Verification Request Rollup',
+                'verbose_name_plural': 'Verification Request Rollups',
+                'db_table': 'quartet_vrs_request_log_rollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Name')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Last Id')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+            ],
+            options={
+                'verbose_name': 'Rollup Watermark',
+                'verbose_name_plural': 'Rollup Watermarks',
+                'db_table': 'quartet_vrs_rollup_watermark',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='requestlogrollup',
+            index=models.Index(fields=['request_gln', 'hour'], name='vrs_rollup_request_gln_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlogrollup',
+            index=models.Index(fields=['gtin', 'hour'], name='vrs_rollup_gtin_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='requestlogrollup',
+            unique_together={('hour', 'operation', 'request_gln', 'gtin', 'success', 'failure_reason')},
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0023_requestlogrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='failure_reason',
+            field=models.CharField(help_text='The verificationFailureReason of the response, if any.', max_length=50, null=True, verbose_name='Failure Reason'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='location',
+            field=models.CharField(help_text='The external VRS that answered, if any.', max_length=300, null=True, verbose_name='Location'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='payload',
+            field=models.BinaryField(help_text="The zlib compressed response when VRS_REQUEST_LOG_PAYLOAD is 'compressed'.", null=True, verbose_name='Compressed Response'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='responder_gln',
+            field=models.CharField(help_text='The responderGLN of the response, if any.', max_length=13, null=True, verbose_name='Responder GLN'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='verified',
+            field=models.NullBooleanField(help_text='The verified flag of the response, if any.', verbose_name='Verified'),
+        ),
+    ]
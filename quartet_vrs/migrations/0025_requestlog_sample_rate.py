@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0024_requestlog_outcome'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='sample_rate',
+            field=models.FloatField(default=1.0, help_text='The share of requests like this one that were logged when it was, each entry stands for 1 / sample rate requests.', verbose_name='Sample Rate'),
+        ),
+        migrations.AlterField(
+            model_name='requestlogrollup',
+            name='count',
+            field=models.PositiveIntegerField(default=0, help_text='The number of requests, with each sampled entry counted as 1 / its sample rate requests.', verbose_name='Count'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:32
+
+from django.db import migrations, models
+import django.db.models.functions.datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0025_requestlog_sample_rate'),
+    ]
+
+    # Now() is sent with every insert rather than kept as a column default,
+    # which AddField cannot set from an expression, and existing rows are
+    # left null since they have long settled.
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='inserted',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='requestlog',
+                    name='inserted',
+                    field=models.DateTimeField(default=django.db.models.functions.datetime.Now, editable=False, null=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+def copy_counts(apps, schema_editor):
+    RequestLogRollup = apps.get_model('quartet_vrs', 'RequestLogRollup')
+    RequestLogRollup.objects.update(weight=models.F('count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_vrs', '0026_requestlog_inserted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlogrollup',
+            name='weight',
+            field=models.FloatField(default=0, help_text='The unrounded count, kept so that rounding does not add up across rollup runs.', verbose_name='Weight'),
+        ),
+        migrations.AlterField(
+            model_name='requestlogrollup',
+            name='count',
+            field=models.PositiveIntegerField(default=0, help_text='The number of requests, with each sampled entry counted as 1 / its sample rate requests, rounded.', verbose_name='Count'),
+        ),
+        migrations.RunPython(copy_counts, migrations.RunPython.noop),
+    ]
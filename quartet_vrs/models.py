@@ -1,17 +1,35 @@
+import json
+
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Now
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from quartet_masterdata.models import TradeItem, Company
+from quartet_vrs.payloads import decompress_payload
 
 class GTINMap(models.Model):
     gtin = models.CharField(
         max_length=14,
         verbose_name=_("GTIN"),
         help_text=_("A GTIN that represents a "
-                    "Trade Item"
+                    "Trade Item. Leave blank for a prefix route."
                     ),
         unique=True,
         db_index=True,
-        null=False
+        null=True,
+        blank=True
+    )
+    prefix = models.CharField(
+        max_length=13,
+        verbose_name=_("Prefix"),
+        help_text=_("A GS1 Company Prefix, or a longer GTIN prefix, routed "
+                    "to this VRS. It is matched against the GTIN-14 without "
+                    "its indicator digit, the longest matching prefix wins "
+                    "and GTIN routes take precedence."),
+        unique=True,
+        null=True,
+        blank=True
     )
     path = models.CharField(
         max_length=256,
@@ -61,6 +79,32 @@ class GTINMap(models.Model):
         verbose_name=_("Use SSL"),
         help_text=_("True if the VRS Router should use SSL when connecting to the host and path.")
     )
+    connect_timeout = models.FloatField(
+        verbose_name=_("Connect Timeout"),
+        help_text=_("Seconds to wait for a connection to the VRS Router. "
+                    "Defaults to the VRS_EXTERNAL_CONNECT_TIMEOUT setting."),
+        null=True,
+        blank=True
+    )
+    read_timeout = models.FloatField(
+        verbose_name=_("Read Timeout"),
+        help_text=_("Seconds to wait for a response from the VRS Router. "
+                    "Defaults to the VRS_EXTERNAL_READ_TIMEOUT setting."),
+        null=True,
+        blank=True
+    )
+
+    def clean(self):
+        if not self.gtin and not self.prefix:
+            raise ValidationError(_('A route needs either a GTIN or a '
+                                    'prefix.'))
+
+    def save(self, *args, **kwargs):
+        # blank values are stored as NULL to keep them out of the unique
+        # constraints
+        self.gtin = self.gtin or None
+        self.prefix = self.prefix or None
+        super().save(*args, **kwargs)
 
     class Meta:
         db_table = 'quartet_vrs_gtin_map'
@@ -68,6 +112,106 @@ class GTINMap(models.Model):
         verbose_name_plural='Routing Maps'
 
 
+class RouteEndpoint(models.Model):
+    """
+    One of several hosts serving a route.  When a route has endpoints they
+    replace its own host, port and protocol; its path and credentials
+    apply to every endpoint.
+    """
+    route = models.ForeignKey(
+        GTINMap, on_delete=models.CASCADE,
+        related_name='endpoints',
+        verbose_name=_("Route"),
+        help_text=_("The route this endpoint serves.")
+    )
+    host = models.CharField(
+        max_length=256,
+        verbose_name=_("Hostname"),
+        help_text=_("The Hostname of the VRS Router endpoint.")
+    )
+    port = models.CharField(
+        max_length=10,
+        verbose_name=_("Port"),
+        help_text=_("Port Number to use when calling the endpoint. NOTE: "
+                    "Port is NOT required when Port Number is 443 or 80"),
+        null=True,
+        blank=True
+    )
+    use_ssl = models.BooleanField(
+        default=True,
+        verbose_name=_("Use SSL"),
+        help_text=_("True if the endpoint should be called over SSL.")
+    )
+    weight = models.PositiveIntegerField(
+        default=1,
+        verbose_name=_("Weight"),
+        help_text=_("The relative share of requests sent to this endpoint.")
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_route_endpoint'
+        verbose_name = 'Route Endpoint'
+        verbose_name_plural = 'Route Endpoints'
+
+
+class RouteHealth(models.Model):
+    """
+    The most recent health of an external VRS endpoint as measured by the
+    probe_routes command.
+    """
+    base_url = models.CharField(
+        max_length=300,
+        unique=True,
+        verbose_name=_("Endpoint"),
+        help_text=_("The scheme, host and port of the external VRS.")
+    )
+    healthy = models.BooleanField(
+        default=True,
+        verbose_name=_("Healthy"),
+        help_text=_("False while the endpoint is failing its probes. "
+                    "Unhealthy endpoints are tried last.")
+    )
+    availability = models.FloatField(
+        default=1.0,
+        verbose_name=_("Availability"),
+        help_text=_("The share of successful probes in the rolling window.")
+    )
+    latency_p50 = models.FloatField(
+        null=True,
+        verbose_name=_("Latency p50 (ms)"),
+        help_text=_("The median probe latency in the rolling window.")
+    )
+    latency_p90 = models.FloatField(
+        null=True,
+        verbose_name=_("Latency p90 (ms)"),
+        help_text=_("The 90th percentile probe latency in the rolling "
+                    "window.")
+    )
+    latency_p99 = models.FloatField(
+        null=True,
+        verbose_name=_("Latency p99 (ms)"),
+        help_text=_("The 99th percentile probe latency in the rolling "
+                    "window.")
+    )
+    consecutive_failures = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Consecutive Failures")
+    )
+    last_checked = models.DateTimeField(
+        null=True,
+        verbose_name=_("Last Checked")
+    )
+    last_success = models.DateTimeField(
+        null=True,
+        verbose_name=_("Last Success")
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_route_health'
+        verbose_name = 'Route Health'
+        verbose_name_plural = 'Route Health'
+
+
 class RequestLog(models.Model):
     remote_address = models.CharField(
         max_length=14,
@@ -144,12 +288,189 @@ class RequestLog(models.Model):
         help_text=_("True if request resulted in a verification or a returned Requestor GLN, False if not."
                     ),
     )
-    created = models.DateTimeField(auto_now_add=True)
+    verified = models.NullBooleanField(
+        verbose_name=_("Verified"),
+        help_text=_("The verified flag of the response, if any.")
+    )
+    failure_reason = models.CharField(
+        max_length=50,
+        null=True,
+        verbose_name=_("Failure Reason"),
+        help_text=_("The verificationFailureReason of the response, if any.")
+    )
+    responder_gln = models.CharField(
+        max_length=13,
+        null=True,
+        verbose_name=_("Responder GLN"),
+        help_text=_("The responderGLN of the response, if any.")
+    )
+    location = models.CharField(
+        max_length=300,
+        null=True,
+        verbose_name=_("Location"),
+        help_text=_("The external VRS that answered, if any.")
+    )
+    sample_rate = models.FloatField(
+        default=1.0,
+        verbose_name=_("Sample Rate"),
+        help_text=_("The share of requests like this one that were logged "
+                    "when it was, each entry stands for 1 / sample rate "
+                    "requests.")
+    )
+    payload = models.BinaryField(
+        null=True,
+        verbose_name=_("Compressed Response"),
+        help_text=_("The zlib compressed response when "
+                    "VRS_REQUEST_LOG_PAYLOAD is 'compressed'.")
+    )
+    # set when the request is logged rather than when a buffered record
+    # is written
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    # the database's clock when the row is inserted, which is what the
+    # rollups wait on, since spooled and buffered records are written well
+    # after they were created
+    inserted = models.DateTimeField(default=Now, null=True, editable=False)
+
+    def get_response(self):
+        """
+        :return: The logged response, decompressed or, when no payload was
+        kept, rebuilt from the outcome columns.  None if nothing is known.
+        """
+        if self.response is not None:
+            return self.response
+        if self.payload is not None:
+            return decompress_payload(self.payload)
+        if self.operation == 'checkConnectivity':
+            return json.dumps({"responderGLN": self.responder_gln})
+        if self.verified is None and self.responder_gln is None:
+            return None
+        ret_val = {
+            "verificationTimestamp": self.created.isoformat(),
+            "responderGLN": self.responder_gln,
+            "data": {"verified": self.verified},
+            "corrUUID": self.corr_uuid or ''
+        }
+        if self.failure_reason:
+            ret_val['data']['verificationFailureReason'] = self.failure_reason
+        if self.location:
+            ret_val['location'] = self.location
+        return json.dumps(ret_val)
 
     class Meta:
         db_table = 'quartet_vrs_request_log'
         verbose_name='Verification Request'
         verbose_name_plural='Verification Requests'
+        # match the admin's ordering, filters and prefix searches, the
+        # pattern operator classes let PostgreSQL use them for LIKE 'x%'
+        indexes = [
+            models.Index(fields=['created'], name='vrs_reqlog_created_idx'),
+            models.Index(fields=['success', 'created'],
+                         name='vrs_reqlog_success_idx'),
+            models.Index(fields=['operation', 'created'],
+                         name='vrs_reqlog_operation_idx'),
+            models.Index(fields=['gtin', 'serial_number'],
+                         name='vrs_reqlog_gtin_idx',
+                         opclasses=['varchar_pattern_ops',
+                                    'varchar_pattern_ops']),
+            models.Index(fields=['serial_number'], name='vrs_reqlog_serial_idx',
+                         opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['lot'], name='vrs_reqlog_lot_idx',
+                         opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['request_gln', 'created'],
+                         name='vrs_reqlog_request_gln_idx'),
+            models.Index(fields=['corr_uuid'], name='vrs_reqlog_corr_uuid_idx'),
+        ]
+
+class RequestLogRollup(models.Model):
+    """
+    The number of requests per hour, operation, requestor GLN, GTIN and
+    outcome, maintained from the request log by the rollup_request_log
+    command.
+    """
+    hour = models.DateTimeField(
+        verbose_name=_("Hour"),
+        help_text=_("The start of the hour, in UTC.")
+    )
+    operation = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name=_("Operation")
+    )
+    request_gln = models.CharField(
+        max_length=13,
+        blank=True,
+        default='',
+        verbose_name=_("Requestor GLN")
+    )
+    gtin = models.CharField(
+        max_length=14,
+        blank=True,
+        default='',
+        verbose_name=_("GTIN")
+    )
+    success = models.BooleanField(
+        default=False,
+        verbose_name=_("Success")
+    )
+    failure_reason = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name=_("Failure Reason"),
+        help_text=_("The verificationFailureReason of failed verifications.")
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Count"),
+        help_text=_("The number of requests, with each sampled entry "
+                    "counted as 1 / its sample rate requests, rounded.")
+    )
+    weight = models.FloatField(
+        default=0,
+        verbose_name=_("Weight"),
+        help_text=_("The unrounded count, kept so that rounding does not "
+                    "add up across rollup runs.")
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_request_log_rollup'
+        verbose_name = 'Verification Request Rollup'
+        verbose_name_plural = 'Verification Request Rollups'
+        unique_together = ('hour', 'operation', 'request_gln', 'gtin',
+                           'success', 'failure_reason')
+        indexes = [
+            models.Index(fields=['request_gln', 'hour'],
+                         name='vrs_rollup_request_gln_idx'),
+            models.Index(fields=['gtin', 'hour'], name='vrs_rollup_gtin_idx'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """
+    The id of the last request log entry counted by a rollup.  Ids rather
+    than creation times are used so that entries written late by the
+    buffered and spool request log backends are still counted.
+    """
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name=_("Name")
+    )
+    last_id = models.BigIntegerField(
+        default=0,
+        verbose_name=_("Last Id")
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Updated")
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_rollup_watermark'
+        verbose_name = 'Rollup Watermark'
+        verbose_name_plural = 'Rollup Watermarks'
+
 
 class CompanyAccess(models.Model):
     """
@@ -177,3 +498,75 @@ class CompanyAccess(models.Model):
     class Meta:
         verbose_name='Query Access'
         verbose_name_plural='Query Access'
+
+
+class ProductInstance(models.Model):
+    """
+    A commissioned SGTIN along with the lot and normalized expiry from its
+    commissioning ILMD.  Maintained from the EPCIS event store so that
+    verification can be answered with a single indexed lookup.
+    """
+    gtin = models.CharField(
+        max_length=14,
+        verbose_name=_("GTIN"),
+        help_text=_("The GTIN-14 of the product instance."),
+        null=False
+    )
+    serial_number = models.CharField(
+        max_length=50,
+        verbose_name=_("Serial Number"),
+        help_text=_("The serial number of the product instance."),
+        null=False
+    )
+    lot = models.CharField(
+        max_length=150,
+        verbose_name=_("Lot/Batch"),
+        help_text=_("The lot number from the commissioning ILMD."),
+        null=True
+    )
+    expiry = models.CharField(
+        max_length=6,
+        verbose_name=_("Expiry Date"),
+        help_text=_("The item expiration date from the commissioning ILMD "
+                    "normalized to YYMMDD."),
+        null=True
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_product_instance'
+        verbose_name = 'Product Instance'
+        verbose_name_plural = 'Product Instances'
+        unique_together = ('gtin', 'serial_number')
+
+
+class Lot(models.Model):
+    """
+    The normalized expiry of a lot of a GTIN, taken from the commissioning
+    ILMD.  Lot and expiry are properties of the batch, so this is used to
+    resolve the expiry without parsing it for every serial number.
+    """
+    gtin = models.CharField(
+        max_length=14,
+        verbose_name=_("GTIN"),
+        help_text=_("The GTIN-14 of the lot."),
+        null=False
+    )
+    lot = models.CharField(
+        max_length=150,
+        verbose_name=_("Lot/Batch"),
+        help_text=_("The lot number from the commissioning ILMD."),
+        null=False
+    )
+    expiry = models.CharField(
+        max_length=6,
+        verbose_name=_("Expiry Date"),
+        help_text=_("The item expiration date from the commissioning ILMD "
+                    "normalized to YYMMDD."),
+        null=False
+    )
+
+    class Meta:
+        db_table = 'quartet_vrs_lot'
+        verbose_name = 'Lot'
+        verbose_name_plural = 'Lots'
+        unique_together = ('gtin', 'lot')
@@ -0,0 +1,58 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Avoids an exact COUNT(*) of very large tables.  An unfiltered
+    PostgreSQL table is counted with the planner's row estimate once that
+    estimate reaches VRS_ESTIMATED_COUNT_THRESHOLD rows, partitions
+    included.  Any other count stops at VRS_ESTIMATED_COUNT_LIMIT rows, so
+    the page links cover that many rows of the filtered results.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        if not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate >= getattr(
+                    settings, 'VRS_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return estimate
+        limit = getattr(settings, 'VRS_ESTIMATED_COUNT_LIMIT', 100000)
+        return queryset.order_by()[:limit].count()
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            # reltuples is -1 for tables that were never analyzed
+            cursor.execute(
+                'SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_class c '
+                'WHERE c.relname = %s OR c.oid IN ('
+                'SELECT i.inhrelid FROM pg_inherits i '
+                'JOIN pg_class p ON p.oid = i.inhparent '
+                'WHERE p.relname = %s)',
+                [queryset.model._meta.db_table] * 2
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
@@ -0,0 +1,239 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import itertools
+import logging
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from quartet_vrs.models import RequestLog
+
+logger = logging.getLogger(__name__)
+
+TABLE = RequestLog._meta.db_table
+# Catches the rows of months that have no partition yet.
+DEFAULT_PARTITION = '%s_default' % TABLE
+_PARTITION = re.compile(r'^%s_p(\d{4})(\d{2})$' % TABLE)
+
+
+def month_start(value) -> datetime.datetime:
+    """
+    :return: Midnight UTC on the first day of the month of a date or
+    datetime.
+    """
+    if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+        value = value.astimezone(datetime.timezone.utc)
+    return datetime.datetime(value.year, value.month, 1,
+                             tzinfo=datetime.timezone.utc)
+
+
+def add_months(month: datetime.datetime, months: int) -> datetime.datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return '%s_p%04d%02d' % (TABLE, month.year, month.month)
+
+
+def is_partitioned() -> bool:
+    """
+    :return: True if the request log is a partitioned PostgreSQL table.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p '
+            'JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s', [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partitions() -> list:
+    """
+    :return: A sorted list of (month, table name) tuples of the monthly
+    partitions of the request log.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s', [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    ret_val = []
+    for name in names:
+        match = _PARTITION.match(name)
+        if match:
+            ret_val.append((datetime.datetime(
+                int(match.group(1)), int(match.group(2)), 1,
+                tzinfo=datetime.timezone.utc), name))
+    return sorted(ret_val)
+
+
+def has_default_partition() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_class WHERE relname = %s',
+                       [DEFAULT_PARTITION])
+        return cursor.fetchone() is not None
+
+
+def create_indexes(cursor):
+    """
+    Creates the indexes of RequestLog on the partitioned request log.
+    PostgreSQL adds them to every partition, including the ones attached
+    later.
+    """
+    quote = connection.ops.quote_name
+    for index in RequestLog._meta.indexes:
+        columns = []
+        for (field, order), opclass in itertools.zip_longest(
+                index.fields_orders, index.opclasses):
+            column = RequestLog._meta.get_field(field).column
+            columns.append(' '.join(filter(None, [quote(column), opclass,
+                                                  order])))
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+            quote(index.name), quote(TABLE), ', '.join(columns)))
+
+
+def create_partitions(start, end) -> list:
+    """
+    Creates the missing monthly partitions from the month of start through
+    the month of end.  Rows of a new month that already landed in the
+    default partition are moved into the month's partition, since
+    PostgreSQL refuses to add a partition whose rows are in the default.
+    Attaching a partition builds the indexes of the partitioned table on
+    it.
+    :return: The names of the partitions.
+    """
+    quote = connection.ops.quote_name
+    month = month_start(start)
+    end = month_start(end)
+    existing = {name for _, name in get_partitions()}
+    default = has_default_partition()
+    ret_val = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        while month <= end:
+            name = partition_name(month)
+            bounds = [month, add_months(month, 1)]
+            if name not in existing and not default:
+                cursor.execute(
+                    'CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%%s) '
+                    'TO (%%s)' % (quote(name), quote(TABLE)), bounds)
+            elif name not in existing:
+                cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)'
+                               % (quote(name), quote(TABLE)))
+                cursor.execute(
+                    'WITH moved AS (DELETE FROM %s WHERE created >= %%s '
+                    'AND created < %%s RETURNING *) INSERT INTO %s '
+                    'SELECT * FROM moved' % (quote(DEFAULT_PARTITION),
+                                             quote(name)), bounds)
+                if cursor.rowcount:
+                    logger.warning('Moved %s request log rows from %s to %s.',
+                                   cursor.rowcount, DEFAULT_PARTITION, name)
+                cursor.execute(
+                    'ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%%s) '
+                    'TO (%%s)' % (quote(TABLE), quote(name)), bounds)
+            ret_val.append(name)
+            month = add_months(month, 1)
+    return ret_val
+
+
+def convert_to_partitioned(months_ahead: int = 3):
+    """
+    Converts the request log into a table partitioned by month, creating
+    partitions for every month of the existing rows through months_ahead
+    months from now, and a default partition that keeps inserts working
+    should prune_request_log not create a month in time.  The rows are
+    copied, so run it during a quiet period.  The primary key becomes
+    (id, created) since PostgreSQL requires the partition key in it; ids
+    still come from the same sequence.  The indexes of the old table are
+    dropped with it and built again on the partitioned table.
+    """
+    if connection.vendor != 'postgresql':
+        raise ValueError('Request log partitions require PostgreSQL.')
+    if is_partitioned():
+        return
+    quote = connection.ops.quote_name
+    old = '%s_unpartitioned' % TABLE
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (quote(TABLE),
+                                                        quote(old)))
+        cursor.execute(
+            'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (created)' % (quote(TABLE), quote(old))
+        )
+        # keep the id sequence when the old table is dropped
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [old])
+        cursor.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (
+            cursor.fetchone()[0], quote(TABLE)))
+        cursor.execute('SELECT MIN(created) FROM %s' % quote(old))
+        now = timezone.now()
+        create_partitions(cursor.fetchone()[0] or now,
+                          add_months(month_start(now), months_ahead))
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (
+            quote(DEFAULT_PARTITION), quote(TABLE)))
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' % (quote(TABLE),
+                                                            quote(old)))
+        cursor.execute('DROP TABLE %s' % quote(old))
+        cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (id, created)' %
+                       quote(TABLE))
+        create_indexes(cursor)
+
+
+def drop_partitions(before, archive: bool = False) -> list:
+    """
+    Removes the monthly partitions that end on or before a point in time.
+    Rows of the month that contains it are kept until that whole month
+    falls outside of the retention window.
+    :param before: The oldest point in time to keep.
+    :param archive: Detach the partitions and leave them as standalone
+    tables to be archived instead of dropping them.
+    :return: The names of the removed partitions.
+    """
+    quote = connection.ops.quote_name
+    cutoff = month_start(before)
+    ret_val = []
+    with connection.cursor() as cursor:
+        for month, name in get_partitions():
+            if add_months(month, 1) > cutoff:
+                break
+            cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (
+                quote(TABLE), quote(name)))
+            if not archive:
+                cursor.execute('DROP TABLE %s' % quote(name))
+            ret_val.append(name)
+    return ret_val
+
+
+def delete_before(before, batch_size: int = 10000) -> int:
+    """
+    Deletes the request log rows created before a point in time in
+    batches, which keeps each transaction short on databases without
+    partitions.
+    :return: The number of deleted rows.
+    """
+    ret_val = 0
+    while True:
+        ids = list(RequestLog.objects.filter(created__lt=before).values_list(
+            'pk', flat=True)[:batch_size])
+        if not ids:
+            return ret_val
+        ret_val += RequestLog.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,98 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import json
+import zlib
+
+from django.conf import settings
+
+RAW = 'raw'
+COMPRESSED = 'compressed'
+NONE = 'none'
+
+
+def compress_payload(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress_payload(payload) -> str:
+    """
+    :param payload: bytes or the memoryview PostgreSQL returns.
+    """
+    return zlib.decompress(bytes(payload)).decode('utf-8')
+
+
+# The max_length of the outcome columns of RequestLog, longer values
+# would fail the insert and with it the whole buffered batch.
+OUTCOME_LENGTHS = dict(failure_reason=50, responder_gln=13, location=300)
+
+
+def _truncate(value, field):
+    if value is None:
+        return None
+    return str(value)[:OUTCOME_LENGTHS[field]]
+
+
+def get_outcome(data) -> dict:
+    """
+    :param data: The data of a logged response.
+    :return: The verified flag, failure reason, responder GLN and location
+    of a verification or connectivity message, which are None for any other
+    response.  A batch is verified only if every message in it is, and
+    takes the rest of its outcome from its first unverified message, or
+    its first message if all of them are verified.
+    """
+    ret_val = dict(verified=None, failure_reason=None, responder_gln=None,
+                   location=None)
+    if isinstance(data, list):
+        messages = [message for message in data if isinstance(message, dict)]
+        if not messages:
+            return ret_val
+        verified = [(message.get('data') or {}).get('verified') is True
+                    for message in messages]
+        ret_val = get_outcome(messages[verified.index(False)]
+                              if False in verified else messages[0])
+        ret_val['verified'] = all(verified)
+    elif isinstance(data, dict):
+        ret_val['responder_gln'] = _truncate(data.get('responderGLN'),
+                                             'responder_gln')
+        ret_val['location'] = _truncate(data.get('location') or None,
+                                        'location')
+        message = data.get('data')
+        if isinstance(message, dict):
+            ret_val['verified'] = message.get('verified')
+            ret_val['failure_reason'] = _truncate(
+                message.get('verificationFailureReason'), 'failure_reason')
+    return ret_val
+
+
+def get_payload_fields(data) -> dict:
+    """
+    :param data: The data of a logged response.
+    :return: The RequestLog values of a response: its outcome columns and,
+    as configured by VRS_REQUEST_LOG_PAYLOAD, the raw JSON in response,
+    the compressed JSON in payload or neither.  A batch cannot be rebuilt
+    from its outcome columns so it is kept compressed instead of dropped.
+    """
+    ret_val = get_outcome(data)
+    policy = getattr(settings, 'VRS_REQUEST_LOG_PAYLOAD', COMPRESSED)
+    if policy == NONE and isinstance(data, list):
+        policy = COMPRESSED
+    if policy == RAW:
+        ret_val['response'] = json.dumps(data)
+    elif policy == COMPRESSED:
+        ret_val['payload'] = compress_payload(json.dumps(data))
+    elif policy != NONE:
+        raise ValueError('Unknown VRS_REQUEST_LOG_PAYLOAD %s.' % policy)
+    return ret_val
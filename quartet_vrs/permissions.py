@@ -0,0 +1,31 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from rest_framework.permissions import DjangoModelPermissions
+
+
+class VerificationPermissions(DjangoModelPermissions):
+    """
+    Batch verification is submitted as a POST but is a read-only query,
+    so it requires the same (empty) model permissions as a GET.
+    """
+    perms_map = dict(DjangoModelPermissions.perms_map, POST=[])
+
+
+class RequestLogExportPermissions(DjangoModelPermissions):
+    """
+    Exporting the request log requires the view permission of the model.
+    """
+    perms_map = dict(DjangoModelPermissions.perms_map,
+                     GET=['%(app_label)s.view_%(model_name)s'])
@@ -0,0 +1,543 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import atexit
+import base64
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from quartet_vrs.models import RequestLog
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.jsonl'
+SPOOL_PART_SUFFIX = SPOOL_SUFFIX + '.part'
+SPOOL_LOADING_SUFFIX = '.loading'
+SPOOL_BAD_SUFFIX = SPOOL_SUFFIX + '.bad'
+# requests-<writer pid>-<ms>-<sequence>.jsonl, with .part while it is
+# written and .<loader pid>.loading while it is loaded.
+_SPOOL_FILE = re.compile(
+    r'^(?P<base>requests-(?P<pid>\d+)-\d+-\d+)\.jsonl'
+    r'(?:(?P<part>\.part)|\.(?P<loader>\d+)\.loading)?$'
+)
+
+
+class SpoolFileError(Exception):
+    """
+    Raised when a spool file cannot be loaded.  The file has been moved
+    aside with a .jsonl.bad suffix.
+    """
+    pass
+
+
+class DatabaseWriter:
+    """
+    Writes each request log record to the database as it is logged.
+    """
+
+    def write(self, record: dict):
+        """
+        :param record: The RequestLog field values.
+        """
+        try:
+            RequestLog.objects.update_or_create(**record)
+        except Exception:
+            # will not throw, just log
+            logger.error(traceback.format_exc())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedWriter:
+    """
+    Appends request log records to a bounded in-process queue that a
+    background thread flushes to the database with bulk_create once
+    batch_size records are waiting or flush_interval seconds have passed.
+    When the queue is full, the 'drop' policy discards the new record
+    and the 'block' policy waits up to block_timeout seconds for room
+    before discarding it.  Whatever is queued is flushed when the
+    process exits.
+    """
+    DROP = 'drop'
+    BLOCK = 'block'
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, policy: str = DROP,
+                 block_timeout: float = 0.1):
+        """
+        :param max_queue: The maximum number of records waiting to be
+        flushed.
+        :param batch_size: The number of records that triggers a flush.
+        :param flush_interval: The maximum number of seconds a record
+        waits to be flushed.
+        :param policy: What to do when the queue is full, 'drop' or
+        'block'.
+        :param block_timeout: The longest the 'block' policy waits.
+        """
+        if policy not in (self.DROP, self.BLOCK):
+            raise ValueError('Unknown request log queue policy %s.' % policy)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._records = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = None
+
+    def write(self, record: dict):
+        """
+        Queues a record without touching the database.
+        :param record: The RequestLog field values.
+        """
+        with self._lock:
+            if len(self._records) >= self.max_queue and \
+                    self.policy == self.BLOCK:
+                self._not_full.wait(self.block_timeout)
+            if len(self._records) >= self.max_queue or self._closed:
+                self.dropped += 1
+                return
+            self._records.append(record)
+            self.queued += 1
+            if len(self._records) >= self.batch_size:
+                self._not_empty.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='vrs-request-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._records) < self.batch_size and \
+                        not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                closed = self._closed
+            close_old_connections()
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """
+        Writes every queued record to the database in bulk.  A batch that
+        fails is retried one record at a time, so a single bad record does
+        not lose the rest of its batch.
+        """
+        with self._flush_lock:
+            with self._lock:
+                records = list(self._records)
+                self._records.clear()
+                self._not_full.notify_all()
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                try:
+                    with transaction.atomic():
+                        RequestLog.objects.bulk_create(
+                            [RequestLog(**record) for record in batch])
+                    with self._lock:
+                        self.flushed += len(batch)
+                except Exception:
+                    self._write_each(batch)
+
+    def _write_each(self, records: list):
+        for record in records:
+            try:
+                with transaction.atomic():
+                    RequestLog.objects.create(**record)
+                with self._lock:
+                    self.flushed += 1
+            except Exception:
+                # will not throw, just log
+                with self._lock:
+                    self.failed += 1
+                logger.error(traceback.format_exc())
+
+    def close(self, timeout: float = 5.0):
+        """
+        Stops the background thread after it has flushed the queue.
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            self.flush()
+
+    def stats(self):
+        """
+        :return: A dict of the queue length and the queued, flushed,
+        dropped and failed record counters.
+        """
+        with self._lock:
+            return {
+                'pending': len(self._records),
+                'queued': self.queued,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+class SpoolWriter:
+    """
+    Appends each request log record as a compact JSON line to a local
+    spool file so that logging never touches the database.  Every process
+    writes its own file, which is closed and renamed from .jsonl.part to
+    .jsonl once it reaches max_bytes or is rotate_interval seconds old,
+    and when the process exits.  A background thread rotates the file of
+    an idle process.  The load_request_log command loads the closed
+    files.  The fsync policy is 'always', after every record,
+    'interval', at most every fsync_interval seconds, or 'never', leaving
+    it to the operating system.
+    """
+    ALWAYS = 'always'
+    INTERVAL = 'interval'
+    NEVER = 'never'
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024,
+                 rotate_interval: float = 60.0, fsync: str = INTERVAL,
+                 fsync_interval: float = 1.0):
+        """
+        :param directory: The spool directory, which is created if needed.
+        :param max_bytes: The size at which a spool file is rotated.
+        :param rotate_interval: The age in seconds at which a spool file
+        is rotated.
+        :param fsync: The fsync policy, 'always', 'interval' or 'never'.
+        :param fsync_interval: The seconds between fsyncs of the 'interval'
+        policy.
+        """
+        if fsync not in (self.ALWAYS, self.INTERVAL, self.NEVER):
+            raise ValueError('Unknown request log fsync policy %s.' % fsync)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.written = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened = 0
+        self._synced = 0
+        self._sequence = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict):
+        """
+        :param record: The RequestLog field values.
+        """
+        # isoformat keeps the microseconds DjangoJSONEncoder drops
+        record = dict(record, created=record['created'].isoformat())
+        if record.get('payload') is not None:
+            record['payload'] = base64.b64encode(
+                record['payload']).decode('ascii')
+        line = json.dumps(record, cls=DjangoJSONEncoder,
+                          separators=(',', ':')) + '\n'
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                self._file.write(line)
+                self.written += 1
+                now = time.monotonic()
+                if self.fsync == self.ALWAYS:
+                    self._sync(now)
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+                else:
+                    self._maintain(now)
+            except Exception:
+                # will not throw, just log
+                self.failed += 1
+                logger.error(traceback.format_exc())
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='vrs-request-log-spool',
+                    daemon=True)
+                self._thread.start()
+
+    def _maintain(self, now: float):
+        """
+        Rotates an old file and syncs it when the interval has passed.
+        Called with the lock held.
+        """
+        if now - self._opened >= self.rotate_interval:
+            self._rotate()
+        elif self.fsync == self.INTERVAL and \
+                now - self._synced >= self.fsync_interval:
+            self._sync(now)
+
+    def _run(self):
+        period = self.rotate_interval
+        if self.fsync == self.INTERVAL:
+            period = min(period, self.fsync_interval)
+        while not self._stopped.wait(period):
+            with self._lock:
+                try:
+                    if self._file is not None:
+                        self._maintain(time.monotonic())
+                except Exception:
+                    logger.error(traceback.format_exc())
+
+    def _open(self):
+        self._sequence += 1
+        self._path = os.path.join(self.directory, 'requests-%d-%d-%d' % (
+            os.getpid(), int(time.time() * 1000), self._sequence))
+        self._file = open(self._path + SPOOL_PART_SUFFIX, 'a',
+                          encoding='utf-8')
+        self._opened = self._synced = time.monotonic()
+
+    def _sync(self, now: float):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = now
+
+    def _rotate(self):
+        if self.fsync != self.NEVER:
+            self._sync(time.monotonic())
+        self._file.close()
+        os.rename(self._path + SPOOL_PART_SUFFIX, self._path + SPOOL_SUFFIX)
+        self._file = None
+        self._path = None
+
+    def flush(self):
+        """
+        Closes the current spool file so that it can be loaded.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._rotate()
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def stats(self):
+        """
+        :return: A dict of the written and failed record counters.
+        """
+        with self._lock:
+            return {'written': self.written, 'failed': self.failed}
+
+
+def get_spool_directory() -> str:
+    return getattr(settings, 'VRS_REQUEST_LOG_SPOOL_DIR',
+                   os.path.join(tempfile.gettempdir(), 'quartet_vrs_spool'))
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_spool_files(directory: str) -> list:
+    """
+    :return: The paths of the spool files that are ready to be loaded,
+    oldest first: closed files, files left open by a process that has
+    died and files claimed by a loader that has died.
+    """
+    ret_val = []
+    for name in os.listdir(directory):
+        match = _SPOOL_FILE.match(name)
+        if match is None:
+            continue
+        if match.group('part') and _is_running(int(match.group('pid'))):
+            continue
+        loader = match.group('loader')
+        if loader and _is_running(int(loader)):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            ret_val.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            # loaded or rotated in the meantime
+            pass
+    return [path for _, path in sorted(ret_val)]
+
+
+def claim_spool_file(path: str):
+    """
+    Claims a spool file for this process by renaming it, which succeeds
+    for only one of several loaders running at once.
+    :return: The path of the claimed file or None if another loader
+    claimed it first.
+    """
+    directory, name = os.path.split(path)
+    base = os.path.join(directory, _SPOOL_FILE.match(name).group('base'))
+    claimed = '%s%s.%d%s' % (base, SPOOL_SUFFIX, os.getpid(),
+                             SPOOL_LOADING_SUFFIX)
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def load_spool_file(path: str, batch_size: int = 5000) -> int:
+    """
+    Claims a spool file and streams it into RequestLog with bulk_create in
+    a single transaction, deleting the file once it is loaded.  Lines that
+    are not valid JSON, such as a line cut short when a process died, are
+    logged and skipped.
+    :return: The number of loaded records, 0 if another loader claimed
+    the file first.
+    :raises SpoolFileError: if the records cannot be loaded.  The file is
+    moved aside so that it does not hold up later runs.
+    """
+    claimed = claim_spool_file(path)
+    if claimed is None:
+        return 0
+    ret_val = 0
+    batch = []
+    try:
+        with transaction.atomic(), open(claimed, encoding='utf-8') as spool:
+            for number, line in enumerate(spool, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning('Skipping line %s of the request log '
+                                   'spool file %s.', number, path)
+                    continue
+                record['created'] = parse_datetime(record['created'])
+                if record.get('payload') is not None:
+                    record['payload'] = base64.b64decode(record['payload'])
+                batch.append(RequestLog(**record))
+                if len(batch) >= batch_size:
+                    RequestLog.objects.bulk_create(batch)
+                    ret_val += len(batch)
+                    batch = []
+            RequestLog.objects.bulk_create(batch)
+            ret_val += len(batch)
+    except Exception as e:
+        directory, name = os.path.split(claimed)
+        bad = os.path.join(directory, _SPOOL_FILE.match(name).group(
+            'base') + SPOOL_BAD_SUFFIX)
+        os.rename(claimed, bad)
+        logger.error(traceback.format_exc())
+        raise SpoolFileError('Unable to load the request log spool file %s, '
+                             'it was moved to %s: %s' % (path, bad, e))
+    os.remove(claimed)
+    return ret_val
+
+
+def should_log(operation: str, success: bool,
+               request_gln: str = None) -> float:
+    """
+    Decides whether a request is logged before any of it is serialized.
+    Failures and the requests of the GLNs in VRS_REQUEST_LOG_ALWAYS_GLNS
+    are always logged.  Successes are sampled at the rate of their
+    operation in VRS_REQUEST_LOG_SAMPLE_RATES, or else at
+    VRS_REQUEST_LOG_SUCCESS_SAMPLE_RATE, from 0.0 to 1.0.
+    :return: The rate the request was sampled at, which is stored with it
+    so that the rollups can count the requests that were sampled out, or
+    0.0 if it is not logged.
+    """
+    if not success or request_gln in getattr(
+            settings, 'VRS_REQUEST_LOG_ALWAYS_GLNS', ()):
+        return 1.0
+    rate = getattr(settings, 'VRS_REQUEST_LOG_SAMPLE_RATES', {}).get(
+        operation, getattr(settings, 'VRS_REQUEST_LOG_SUCCESS_SAMPLE_RATE',
+                           1.0))
+    if rate >= 1:
+        return 1.0
+    return float(rate) if random.random() < rate else 0.0
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_request_log_writer():
+    """
+    :return: The process wide request log writer selected by the
+    VRS_REQUEST_LOG_BACKEND setting, 'database', 'buffered' or 'spool'.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            backend = getattr(settings, 'VRS_REQUEST_LOG_BACKEND', 'database')
+            if backend == 'buffered':
+                _writer = BufferedWriter(
+                    max_queue=getattr(settings, 'VRS_REQUEST_LOG_QUEUE_SIZE',
+                                      10000),
+                    batch_size=getattr(settings, 'VRS_REQUEST_LOG_BATCH_SIZE',
+                                       500),
+                    flush_interval=getattr(
+                        settings, 'VRS_REQUEST_LOG_FLUSH_INTERVAL', 1.0),
+                    policy=getattr(settings, 'VRS_REQUEST_LOG_QUEUE_POLICY',
+                                   BufferedWriter.DROP),
+                    block_timeout=getattr(
+                        settings, 'VRS_REQUEST_LOG_BLOCK_TIMEOUT', 0.1)
+                )
+                atexit.register(_writer.close)
+            elif backend == 'spool':
+                _writer = SpoolWriter(
+                    get_spool_directory(),
+                    max_bytes=getattr(settings,
+                                      'VRS_REQUEST_LOG_SPOOL_MAX_BYTES',
+                                      64 * 1024 * 1024),
+                    rotate_interval=getattr(
+                        settings, 'VRS_REQUEST_LOG_SPOOL_ROTATE_INTERVAL', 60),
+                    fsync=getattr(settings, 'VRS_REQUEST_LOG_SPOOL_FSYNC',
+                                  SpoolWriter.INTERVAL),
+                    fsync_interval=getattr(
+                        settings, 'VRS_REQUEST_LOG_SPOOL_FSYNC_INTERVAL', 1.0)
+                )
+                atexit.register(_writer.close)
+            elif backend == 'database':
+                _writer = DatabaseWriter()
+            else:
+                raise ValueError('Unknown VRS_REQUEST_LOG_BACKEND %s.' %
+                                 backend)
+        return _writer
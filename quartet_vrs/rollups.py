@@ -0,0 +1,126 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from quartet_vrs.models import RequestLog, RequestLogRollup, RollupWatermark
+
+WATERMARK = 'request_log_hourly'
+
+
+def get_failure_reason(success: bool, response: str) -> str:
+    """
+    :return: The verificationFailureReason of a logged response or an empty
+    string.
+    """
+    if success or not response:
+        return ''
+    try:
+        data = json.loads(response)
+    except ValueError:
+        return ''
+    if isinstance(data, dict) and isinstance(data.get('data'), dict):
+        return str(data['data'].get('verificationFailureReason') or '')[:50]
+    return ''
+
+
+def get_hour(created: datetime.datetime) -> datetime.datetime:
+    return created.astimezone(datetime.timezone.utc).replace(
+        minute=0, second=0, microsecond=0)
+
+
+def _merge(counts: Counter):
+    existing = {
+        (rollup.hour, rollup.operation, rollup.request_gln, rollup.gtin,
+         rollup.success, rollup.failure_reason): rollup
+        for rollup in RequestLogRollup.objects.filter(
+            hour__in={key[0] for key in counts})
+    }
+    updated = []
+    created = []
+    for key, weight in counts.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            hour, operation, request_gln, gtin, success, reason = key
+            rollup = RequestLogRollup(
+                hour=hour, operation=operation, request_gln=request_gln,
+                gtin=gtin, success=success, failure_reason=reason)
+            created.append(rollup)
+        else:
+            updated.append(rollup)
+        # only the total is rounded
+        rollup.weight += weight
+        rollup.count = round(rollup.weight)
+    RequestLogRollup.objects.bulk_update(updated, ['count', 'weight'])
+    RequestLogRollup.objects.bulk_create(created)
+
+
+def rollup_request_log(batch_size: int = 10000) -> int:
+    """
+    Adds the request log entries after the watermark to the hourly
+    rollups.  Each batch and the watermark are saved in one transaction, so
+    every entry is counted once even if the command is interrupted, and the
+    watermark row is locked so that concurrent runs wait for each other.
+    Ids are handed out before the inserts commit, so a newer entry can be
+    visible while an older id is still being written.  The watermark
+    therefore stops at the first entry inserted less than VRS_ROLLUP_LAG
+    seconds ago, which has to exceed the longest request log insert.  The
+    insert time is used rather than created, which for spooled and
+    buffered entries can be long before they are written.
+    Sampled entries are weighted by their sample rate, so the rollups
+    estimate every request rather than only the logged ones.
+    :return: The number of counted request log entries.
+    """
+    ret_val = 0
+    settled = timezone.now() - datetime.timedelta(
+        seconds=getattr(settings, 'VRS_ROLLUP_LAG', 300))
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update(
+            ).get_or_create(name=WATERMARK)
+            rows = list(RequestLog.objects.filter(
+                pk__gt=watermark.last_id).order_by('pk').values_list(
+                'pk', 'inserted', 'created', 'operation', 'request_gln', 'gtin',
+                'success', 'failure_reason', 'response',
+                'sample_rate')[:batch_size])
+            unsettled = next((i for i, row in enumerate(rows)
+                              if row[1] is not None and row[1] >= settled),
+                             None)
+            if unsettled is not None:
+                rows = rows[:unsettled]
+            if not rows:
+                return ret_val
+            counts = Counter()
+            for pk, inserted, created, operation, request_gln, gtin, success, \
+                    reason, response, sample_rate in rows:
+                # entries logged before the outcome columns only have the
+                # response
+                if not success and reason is None:
+                    reason = get_failure_reason(success, response)
+                counts[(get_hour(created), operation or '',
+                        (request_gln or '')[:13], (gtin or '')[:14], success,
+                        '' if success else (reason or '')[:50])] += \
+                    1 / sample_rate if sample_rate else 1
+            _merge(counts)
+            watermark.last_id = rows[-1][0]
+            watermark.save()
+        ret_val += len(rows)
+        if unsettled is not None:
+            return ret_val
@@ -0,0 +1,116 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import threading
+import time
+
+from django.conf import settings
+
+from quartet_vrs.health import refresh_route_health
+from quartet_vrs.models import GTINMap
+
+
+class PrefixTrie:
+    """
+    A digit trie of prefix routes supporting longest-prefix-match lookups.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix: str, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def longest_match(self, key: str):
+        """
+        :return: The value of the longest prefix of key or None.
+        """
+        node = self._root
+        ret_val = node.get(None)
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            ret_val = node.get(None, ret_val)
+        return ret_val
+
+
+class RoutingTable:
+    """
+    An in-memory snapshot of every GTINMap: a dict of the exact GTIN routes
+    and a trie of the prefix routes.
+    """
+
+    def __init__(self, routes):
+        self.gtins = {}
+        self.prefixes = PrefixTrie()
+        for route in routes:
+            if route.gtin:
+                self.gtins[route.gtin] = route
+            if route.prefix:
+                self.prefixes.insert(route.prefix, route)
+
+    def get_route(self, gtin: str):
+        """
+        Resolves the route of a GTIN.  An exact GTIN route overrides any
+        prefix route.  Prefixes are matched against the GTIN-14 without
+        its indicator digit, which is where the GS1 company prefix starts.
+        :return: A GTINMap or None if the GTIN is not routed.
+        """
+        route = self.gtins.get(gtin)
+        if route is None:
+            route = self.prefixes.longest_match(gtin[1:])
+        return route
+
+
+_lock = threading.Lock()
+_table = None
+_loaded = 0
+
+
+def get_routing_table() -> RoutingTable:
+    """
+    Returns the routing table of this process, loading it from the
+    database when it has been invalidated or is older than
+    VRS_ROUTING_TABLE_TTL seconds, which picks up route changes made by
+    other processes.  Also refreshes the endpoint health snapshot.
+    """
+    global _table, _loaded
+    refresh_route_health()
+    ttl = getattr(settings, 'VRS_ROUTING_TABLE_TTL', 60)
+    table = _table
+    if table is not None and time.monotonic() - _loaded < ttl:
+        return table
+    with _lock:
+        if _table is None or time.monotonic() - _loaded >= ttl:
+            _table = RoutingTable(
+                GTINMap.objects.prefetch_related('endpoints'))
+            _loaded = time.monotonic()
+        return _table
+
+
+def invalidate_routing_table():
+    global _table
+    with _lock:
+        _table = None
+
+
+def get_route(gtin: str):
+    """
+    :return: The GTINMap that routes a GTIN or None.
+    """
+    return get_routing_table().get_route(gtin)
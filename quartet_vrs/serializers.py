@@ -1,8 +1,53 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import GTINMap
+from .models import GTINMap, RequestLogRollup
 
 class GTINMapSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = GTINMap
-        fields = ['gtin', 'host', 'path', 'gs1_compliant', 'use_ssl']
+        fields = ['gtin', 'prefix', 'host', 'path', 'gs1_compliant',
+                  'use_ssl']
 
+
+class VerificationItemSerializer(serializers.Serializer):
+    """
+    A single GTIN, Lot, Serial Number and Expiry tuple within a batch
+    verification request.
+    """
+    gtin = serializers.RegexField(r'^[0-9]{14}$')
+    lot = serializers.CharField(max_length=150, allow_blank=True)
+    ser = serializers.CharField(max_length=20, allow_blank=True)
+    exp = serializers.CharField(max_length=35, required=False,
+                                allow_blank=True, default='')
+    corrUUID = serializers.CharField(max_length=40, required=False,
+                                     allow_blank=True, default='')
+
+
+class BatchVerificationSerializer(serializers.Serializer):
+    """
+    A batch verification request.  The reqGLN, linkType and context are
+    shared by every item in the batch.
+    """
+    reqGLN = serializers.CharField(max_length=13, required=False,
+                                   allow_null=True, default=None)
+    linkType = serializers.ChoiceField(choices=['verificationService'],
+                                       required=False, allow_null=True,
+                                       default=None)
+    context = serializers.ChoiceField(choices=['dscsaSaleableReturn'],
+                                      required=False, allow_null=True,
+                                      default=None)
+    items = VerificationItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, value):
+        max_items = getattr(settings, 'VRS_BATCH_MAX_ITEMS', 5000)
+        if len(value) > max_items:
+            raise serializers.ValidationError(
+                'A batch can verify at most %s items.' % max_items)
+        return value
+
+
+class RequestLogRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestLogRollup
+        fields = ('hour', 'operation', 'request_gln', 'gtin', 'success',
+                  'failure_reason', 'count')
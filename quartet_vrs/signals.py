@@ -0,0 +1,135 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from quartet_epcis.models.entries import Entry
+from quartet_masterdata.models import Company, TradeItem
+from quartet_vrs.bloom import add_to_bloom_filter
+from quartet_vrs.cache import trade_item_cache, company_access_cache
+from quartet_vrs.cache import negative_cache, external_response_cache
+from quartet_vrs.external import close_session
+from quartet_vrs.indexing import SGTIN_PREFIX, parse_sgtin, is_commissioning
+from quartet_vrs.routing import invalidate_routing_table
+from quartet_vrs.models import CompanyAccess, GTINMap, RouteEndpoint
+
+
+@receiver(post_save, sender=TradeItem)
+@receiver(post_delete, sender=TradeItem)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_trade_item_cache(sender, **kwargs):
+    """
+    Master data changes rarely, and a GTIN or company prefix change can
+    affect any number of cached GTINs, so the whole cache is dropped.
+    """
+    trade_item_cache.clear()
+
+
+@receiver(post_save, sender=CompanyAccess)
+@receiver(post_delete, sender=CompanyAccess)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company_access_cache(sender, **kwargs):
+    """
+    A company's GLN is both a requestor and a responder key, so any access
+    or company change drops the whole authorization cache.
+    """
+    company_access_cache.clear()
+
+
+@receiver(post_save, sender=TradeItem)
+@receiver(post_delete, sender=TradeItem)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_negative_cache(sender, **kwargs):
+    """
+    New master data can make an unknown GTIN known or change the EPCs its
+    serial numbers map to, so every negative result is dropped.
+    """
+    negative_cache.clear()
+
+
+@receiver(post_save, sender=Entry)
+def invalidate_negative_serial(sender, instance, **kwargs):
+    """
+    The EPCIS parser saves the entry of every EPC it captures, so a newly
+    commissioned serial number is evicted whether or not the verification
+    index is maintained.
+    """
+    if instance.identifier.startswith(SGTIN_PREFIX):
+        try:
+            negative_cache.invalidate(parse_sgtin(instance.identifier))
+        except ValueError:
+            pass
+
+
+@receiver(post_save, sender=Entry)
+def add_commissioned_serial(sender, instance, **kwargs):
+    """
+    Adds SGTINs to the bloom filter as the EPCIS parser commissions them,
+    so the filter stays current without the VerificationIndexStep.
+    """
+    last_event = Entry._meta.get_field('last_event')
+    if instance.identifier.startswith(SGTIN_PREFIX) and \
+            last_event.is_cached(instance) and instance.last_event and \
+            is_commissioning(instance.last_event):
+        add_to_bloom_filter([instance.identifier])
+
+
+@receiver(post_save, sender=GTINMap)
+@receiver(post_delete, sender=GTINMap)
+def invalidate_negative_gtin(sender, instance, **kwargs):
+    if instance.gtin:
+        negative_cache.invalidate(instance.gtin)
+    else:
+        # a prefix route can map any number of unknown GTINs
+        negative_cache.clear()
+
+
+@receiver(post_save, sender=GTINMap)
+@receiver(post_delete, sender=GTINMap)
+def invalidate_external_response_cache(sender, **kwargs):
+    """
+    Responses are keyed by route, and a changed route may point at a
+    different partner, so all of them are dropped.
+    """
+    external_response_cache.clear()
+
+
+@receiver(post_save, sender=GTINMap)
+@receiver(post_delete, sender=GTINMap)
+def close_route_session(sender, instance, **kwargs):
+    """
+    Changed or deleted routes release their pooled connections, which
+    are recreated on next use.
+    """
+    close_session(instance.pk)
+
+
+@receiver(post_save, sender=RouteEndpoint)
+@receiver(post_delete, sender=RouteEndpoint)
+def invalidate_route_endpoints(sender, instance, **kwargs):
+    close_session(instance.route_id)
+    invalidate_routing_table()
+
+
+@receiver(post_save, sender=GTINMap)
+@receiver(post_delete, sender=GTINMap)
+def rebuild_routing_table(sender, **kwargs):
+    """
+    The routing table is reloaded from the database on its next use.
+    """
+    invalidate_routing_table()
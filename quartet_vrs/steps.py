@@ -0,0 +1,50 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from quartet_capture import models
+from quartet_capture.rules import Step as RuleStep
+from quartet_capture.rules import RuleContext
+from quartet_epcis.parsing.steps import ContextKeys
+from quartet_vrs.indexing import index_message
+
+
+class VerificationIndexStep(RuleStep):
+    '''
+    Adds the product instances commissioned in an inbound EPCIS message to
+    the VRS verification index.  Must follow the EPCISParsingStep in a
+    rule, since it uses the MESSAGE_ID that step places on the context.
+    '''
+
+    def __init__(self, db_task: models.Task, **kwargs):
+        super().__init__(db_task, **kwargs)
+
+    @property
+    def declared_parameters(self):
+        return {}
+
+    def execute(self, data, rule_context: RuleContext):
+        message_id = rule_context.context.get(
+            ContextKeys.EPCIS_MESSAGE_ID_KEY.value
+        )
+        if message_id is None:
+            self.warning('There was no EPCIS message id on the context. '
+                         'The verification index was not updated.')
+            return data
+        count = index_message(message_id)
+        self.info('Indexed %s product instances from message %s.', count,
+                  message_id)
+        return data
+
+    def on_failure(self):
+        pass
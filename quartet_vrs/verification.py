@@ -12,28 +12,74 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
+import copy
 import logging
 import posixpath
+import time
 import traceback
-import urllib.parse
 import uuid
 
-import requests
-from dateutil.parser import parser
 from django.conf import settings
-from requests.auth import HTTPBasicAuth
+from django.db.models import OuterRef, Subquery
 from rest_framework import exceptions
 from rest_framework import status
 
 from EPCPyYes.core.v1_2 import helpers
-from quartet_epcis.db_api.queries import EPCISDBProxy
+from quartet_epcis.models.entries import EntryEvent
 from quartet_masterdata.models import TradeItem
+from quartet_vrs.bloom import get_bloom_filter
+from quartet_vrs.cache import CachedTradeItem, trade_item_cache
+from quartet_vrs.cache import CachedCompanyAccess, company_access_cache
+from quartet_vrs.cache import negative_cache
+from quartet_vrs.cache import external_response_cache
+from quartet_vrs import external
+from quartet_vrs.dates import format_exp_date
+from quartet_vrs.fanout import get_fanout_client
 from quartet_vrs.models import CompanyAccess
 from quartet_vrs.models import GTINMap
+from quartet_vrs.models import ProductInstance, Lot
+from quartet_vrs.routing import get_route, get_routing_table
 
 logger = logging.getLogger(__name__)
 
 
+def _load_company_access(req_gln: str):
+    company_access = CompanyAccess.objects.filter(
+        company__GLN13=req_gln
+    ).order_by('id').values_list('access_granted', 'responder__GLN13').first()
+    if company_access is None:
+        return CachedCompanyAccess(False, False, None)
+    return CachedCompanyAccess(True, *company_access)
+
+
+def _lot_expiry(gtin, lot):
+    """
+    :return: A subquery of the normalized expiry of a lot in the lot table,
+    which is NULL if the lot is not in the table yet.
+    """
+    return Subquery(Lot.objects.filter(gtin=gtin, lot=lot).values(
+        'expiry')[:1])
+
+
+def _load_trade_item(gtin: str):
+    try:
+        company_prefix, gln = TradeItem.objects.values_list(
+            'company__gs1_company_prefix', 'company__GLN13').get(GTIN14=gtin)
+        return CachedTradeItem(company_prefix, gln, True)
+    except TradeItem.DoesNotExist:
+        return CachedTradeItem(None, None, False)
+
+
+def _chunked(values, size: int):
+    """
+    Splits the values into lists of at most size elements so that large
+    IN clauses stay within the limits of the database backend.
+    """
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
 class Verification:
     VERIFICATION_CODE_GTIN_SERIAL = "No_match_GTIN_Serial"
     VERIFICATION_CODE_GTIN_SERIAL_LOT_EXPIRY = "No_match_GTIN_Serial_Lot_Expiry"
@@ -42,10 +88,8 @@ class Verification:
     VERIFICATION_CODE_NO_REASON = "No_reason_provided"
     VERIFICATION_CODE_GTIN_NOT_REGISTERED = "GTIN_not_registered"
     VERIFICATION_CODE_GTIN_NOT_FOUND = "GTIN_not_found"
-
-    def __init__(self) -> None:
-        super().__init__()
-        self.parser = parser()
+    ILMD_NAMES = ('lotNumber', 'itemExpirationDate')
+    BATCH_QUERY_CHUNK_SIZE = 500
 
     def check_connectivity(self, gtin: str, req_gln: str,
                            context: str = "dscsaSaleableReturn"):
@@ -59,50 +103,42 @@ class Verification:
                    :param gtin: GS1 GTIN 14
                    :param context: Default is dscsaSaleableReturn
             """
-        try:
-            company_access = CompanyAccess.objects.get(company__GLN13=req_gln)
-            gtin = TradeItem.objects.get(GTIN14=gtin)
-            if not company_access.access_granted:
-                raise exceptions.AuthenticationFailed(
-                    'The GLN %s does not have access to query this system.'
-                    % req_gln, 403)
-            if company_access.responder:
-                responder_gln = company_access.responder.GLN13
-            else:
-                responder_gln = getattr(settings, 'DEFAULT_VRS_RESPONDER_GLN',
-                                        None)
-                if not responder_gln:
-                    raise exceptions.APIException(
-                        'Please configure a default responder for '
-                        'the system and/or configure a responder '
-                        'GLN for the company with GLN %s.' %
-                        req_gln, status=500
-                    )
-            return responder_gln
-        except CompanyAccess.DoesNotExist:
+        company_access = self._get_company_access(req_gln)
+        if not company_access.exists:
             raise exceptions.NotAuthenticated(
                 'The GLN %s is not configured for access.' % req_gln, 401)
+        try:
+            self._get_trade_item(gtin)
         except TradeItem.DoesNotExist:
             raise exceptions.APIException(
                 'The GTIN %s is not available for query on '
                 'this system.' % gtin,
                 404
             )
+        if not company_access.access_granted:
+            raise exceptions.AuthenticationFailed(
+                'The GLN %s does not have access to query this system.'
+                % req_gln, 403)
+        if company_access.responder_gln:
+            responder_gln = company_access.responder_gln
+        else:
+            responder_gln = getattr(settings, 'DEFAULT_VRS_RESPONDER_GLN',
+                                    None)
+            if not responder_gln:
+                raise exceptions.APIException(
+                    'Please configure a default responder for '
+                    'the system and/or configure a responder '
+                    'GLN for the company with GLN %s.' %
+                    req_gln, status=500
+                )
+        return responder_gln
 
     def _check_connectivity_external(self, gtin: str, req_gln: str,
                                      context: str = "dscsaSaleableReturn"):
 
         try:
-            map = GTINMap.objects.get(gtin=gtin)
-            if map.use_ssl:
-                protocol = "https://"
-            else:
-                protocol = "http://"
-
-            if map.port is not None and map.port != "443" and map.port != "80":
-                host = "{0}{1}:{2}".format(protocol, map.host, map.port)
-            else:
-                host = "{0}{1}".format(protocol, map.host)
+            map = self._get_route(gtin)
+            host = external.get_base_url(map)
 
             path = posixpath.join(map.path,
                                   "checkConnectivity?gtin={0}&reqGLN={1}".format(
@@ -110,13 +146,7 @@ class Verification:
 
             logger.info(
                 'checkConnectivity using External VRS at {0}'.format(host))
-            url = urllib.parse.urljoin(host, path)
-
-            if map.user_name is not None:
-                response = requests.get(url, auth=HTTPBasicAuth(map.user_name,
-                                                                map.password))
-            else:
-                response = requests.get(url)
+            response = external.get(map, path)
             if response.status_code != status.HTTP_200_OK:
                 raise Exception(response.content)
 
@@ -134,8 +164,16 @@ class Verification:
                 reason=Verification.VERIFICATION_CODE_GTIN_NOT_FOUND,
                 description=desc
             )
+        except external.CircuitOpenError as e:
+            ret_val = self._verification_message(
+                response_gln="",
+                correlation_id="",
+                verified=False,
+                reason=Verification.VERIFICATION_CODE_GTIN_NOT_FOUND,
+                description=str(e)
+            )
         except Exception as e:
-            desc = 'Unable to verify GTIN: {0} using external VRS at {0}'.format(
+            desc = 'Unable to verify GTIN: {0} using external VRS at {1}'.format(
                 gtin, host)
             logger.error(desc)
             ret_val = self._verification_message(
@@ -162,36 +200,20 @@ class Verification:
 
         ret_val = None
         company_prefix = None
-        response_gln = None
         lot_matched = False
         exp_matched = False
 
-        if linkType and linkType != 'verificationService':
-            raise exceptions.APIException('An invalid linkType was specified '
-                                          'in the URl.',400)
-        if context and context != 'dscsaSaleableReturn':
-            raise exceptions.APIException('An invalid context was specified '
-                                          'in the URL', 400)
-
-        if not getattr(settings, 'VRS_ALLOW_ALL_REQ_GLNS', False):
-            ca = CompanyAccess.objects.filter(company__GLN13=reqGLN).exists()
-            if not ca:
-                raise exceptions.NotAuthenticated(
-                    'The reqGLN %s is not authorized to query this '
-                    'system.' % reqGLN, 401)
-            else:
-                ca = CompanyAccess.objects.get(company__GLN13 = reqGLN)
-                response_gln = ca.responder.GLN13 if ca.responder else \
-                    getattr(settings, 'DEFAULT_VRS_RESPONDER_GLN')
+        self._validate_request(linkType, context)
+        response_gln = self._get_response_gln(reqGLN)
 
 
         if correlation_id is None or len(correlation_id) == 0:
             correlation_id = str(uuid.uuid4())
         try:
-            trade_item = TradeItem.objects.select_related().get(GTIN14=gtin)
-            company_prefix = trade_item.company.gs1_company_prefix
+            trade_item = self._get_trade_item(gtin)
+            company_prefix = trade_item.company_prefix
             if not response_gln:
-                response_gln = trade_item.company.GLN13
+                response_gln = trade_item.gln
         except TradeItem.DoesNotExist:
             try:
                 # The TradeItem is not in master data. Send to a Remote VRS
@@ -222,30 +244,53 @@ class Verification:
                 reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
             )
 
-        if company_prefix is not None:
+        if company_prefix is not None and \
+                not self._may_exist(gtin, company_prefix, serial_number):
+            # A recent lookup or the bloom filter says that this serial
+            # number does not exist
+            ret_val = self._verification_message(
+                response_gln=response_gln,
+                correlation_id=correlation_id,
+                verified=False,
+                reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
+            )
+        elif company_prefix is not None and self._use_index():
+            # Answer from the verification index rather than the EPCIS events
+            instance = self._get_instance(gtin, serial_number)
+            if instance is None:
+                negative_cache.set((gtin, serial_number), True)
+                ret_val = self._verification_message(
+                    response_gln=response_gln,
+                    correlation_id=correlation_id,
+                    verified=False,
+                    reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
+                )
+            else:
+                lot_matched, exp_matched = self._match_instance(instance, lot,
+                                                                exp)
+                ret_val = self._match_message(response_gln, correlation_id,
+                                              lot_matched, exp_matched)
+        elif company_prefix is not None:
             # Transform the GTIN into an EPC URN Id
-            indicator_digit = gtin[0]
-            item_ref = gtin[len(company_prefix) + 1: -1]
-            epc = "urn:epc:id:sgtin:{0}.{1}{2}.{3}".format(company_prefix,
-                                                           indicator_digit,
-                                                           item_ref,
-                                                           serial_number)
+            epc = self._get_epc(gtin, company_prefix, serial_number)
 
             # Search Repo for EPC, Serial Number, Lot, Expiry
-            db_proxy = EPCISDBProxy()
             # If events are returned, consider GTIN and Serial Number Verified
             try:
-                events = db_proxy.get_events_by_entry_identifer(
-                    entry_identifier=epc)
+                ilmd = self._get_ilmd_by_epc(epc, gtin)
 
-                if len(events) == 0:
+                if ilmd is None:
                     # No events means GTIN & Serial Number could not be verified
+                    negative_cache.set((gtin, serial_number), True)
                     ret_val = self._verification_message(
                         response_gln=response_gln,
                         correlation_id=correlation_id,
                         verified=False,
                         reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
                     )
+                else:
+                    lot_matched, exp_matched = self._match_ilmd(ilmd, lot,
+                                                                exp)
             except Exception as e:
                 # Log Exception
                 tb = traceback.format_exc()
@@ -258,106 +303,517 @@ class Verification:
                     reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
                 )
 
-            for event in events:
-                # Get the Event and loop through the ilmd elements, if they exist.
-                evt = db_proxy.get_event_by_id(event_id=event.event_id)
-                if hasattr(evt, 'ilmd'):
-                    for md in evt.ilmd:
-                        if md.name == "lotNumber" and md.value == lot:
-                            lot_matched = True
-                        elif md.name == 'itemExpirationDate':
-                            exp_matched = exp == self._format_exp_date(md.value)
-                if exp_matched and lot_matched:
-                    break
-
             if ret_val is None:
                 # GTIN & SerialNumber have matched
-                if exp_matched and lot_matched:
-                    # GTIN, Serial, Lot, and Expiry all Verified.
-                    ret_val = self._verification_message(
-                        response_gln=response_gln,
-                        correlation_id=correlation_id
-                    )
+                ret_val = self._match_message(response_gln, correlation_id,
+                                              lot_matched, exp_matched)
+        # Return the Response
+        return ret_val
 
-                elif not exp_matched and not lot_matched:
-                    # The Lot and/or Expiry could not be verified.
-                    # The GTIN & Serial did not match the Lot and Expiry
-                    ret_val = self._verification_message(
-                        response_gln=response_gln,
-                        correlation_id=correlation_id,
-                        verified=False,
-                        reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT_EXPIRY
-                    )
 
-                elif not exp_matched and lot_matched:
-                    # The Expiry could not be verified.
-                    # The GTIN & Serial did not match the Expiry
-                    ret_val = self._verification_message(
-                        response_gln=response_gln,
-                        correlation_id=correlation_id,
-                        verified=False,
-                        reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_EXPIRY
-                    )
+    def verify_batch(self, items: list, linkType: str, context: str,
+                     reqGLN):
+        '''
+        Verifies a list of GTIN-14, Lot and Serial Number tuples that share
+        a single reqGLN, linkType and context.  The master data, EPCIS
+        entries and ILMD for the whole batch are resolved with set-based
+        queries rather than one verify() per item.
+        :param items: A list of dictionaries with gtin, lot, serial_number,
+        exp and (optionally) correlation_id keys.
+        :param linkType: The GS1 link type (verificationService).
+        :param context: The request context (dscsaSaleableReturn).
+        :param reqGLN: The Requestor GLN.
+        :return: A list of Verification Messages in the same order as the
+        inbound items.
+        '''
+        self._validate_request(linkType, context)
+        response_gln = self._get_response_gln(reqGLN)
+
+        # resolve the trade items and their company data in one pass
+        trade_items = self._get_trade_items({item['gtin'] for item in items})
+
+        local_items = {
+            index: item for index, item in enumerate(items)
+            if trade_items[item['gtin']].exists
+        }
+        # serial numbers known not to exist are not looked up again
+        lookups = {
+            index: item for index, item in local_items.items()
+            if self._may_exist(item['gtin'],
+                               trade_items[item['gtin']].company_prefix,
+                               item['serial_number'])
+        }
+        if self._use_index():
+            matches = self._match_batch_index(lookups)
+        else:
+            matches = self._match_batch_epcis(lookups, trade_items)
+        for index, item in lookups.items():
+            if index not in matches:
+                negative_cache.set((item['gtin'], item['serial_number']), True)
+
+        correlation_ids = [item.get('correlation_id') or str(uuid.uuid4())
+                           for item in items]
+        # The TradeItems not in master data are sent to remote VRSs at once
+        external_messages = self._verify_external_batch({
+            index: (item, correlation_ids[index])
+            for index, item in enumerate(items) if index not in local_items
+        })
+
+        ret_val = []
+        for index, item in enumerate(items):
+            correlation_id = correlation_ids[index]
+            if index not in local_items:
+                ret_val.append(external_messages[index])
+                continue
+            item_response_gln = response_gln or trade_items[item['gtin']].gln
+            if matches.get(index) is None:
+                # No events means GTIN & Serial Number could not be verified
+                ret_val.append(self._verification_message(
+                    response_gln=item_response_gln,
+                    correlation_id=correlation_id,
+                    verified=False,
+                    reason=Verification.VERIFICATION_CODE_GTIN_SERIAL
+                ))
+                continue
+            lot_matched, exp_matched = matches[index]
+            ret_val.append(
+                self._match_message(item_response_gln, correlation_id,
+                                    lot_matched, exp_matched)
+            )
+        return ret_val
 
-                elif exp_matched and not lot_matched:
-                    # The Lot could not be verified.
-                    # The GTIN & Serial did not match the Lot
-                    ret_val = self._verification_message(
-                        response_gln=response_gln,
-                        correlation_id=correlation_id,
-                        verified=False,
-                        reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT
-                    )
-        # Return the Response
+    def _match_batch_epcis(self, local_items: dict, trade_items: dict):
+        '''
+        Matches the lot and expiry of a batch against the EPCIS event store.
+        :param local_items: A dict of batch index to item for the items
+        whose GTIN is in local master data.
+        :param trade_items: A dict of GTIN to CachedTradeItem.
+        :return: A dict of batch index to (lot_matched, exp_matched) for
+        every item whose EPC has events, or None for an item whose ILMD
+        expiry could not be parsed.
+        '''
+        # build the EPC URNs for everything that is in local master data
+        epcs = {
+            index: self._get_epc(item['gtin'],
+                                 trade_items[item['gtin']].company_prefix,
+                                 item['serial_number'])
+            for index, item in local_items.items()
+        }
+
+        # find the ILMD of every event of every EPC, and then the expiry of
+        # their lots from the lot table
+        ilmd = {}
+        for chunk in _chunked(set(epcs.values()),
+                              self.BATCH_QUERY_CHUNK_SIZE):
+            for identifier, name, value in EntryEvent.objects.filter(
+                identifier__in=chunk
+            ).values_list('identifier', 'event__instancelotmasterdata__name',
+                          'event__instancelotmasterdata__value'):
+                values = ilmd.setdefault(identifier, [])
+                if name in self.ILMD_NAMES:
+                    values.append((name, value))
+        lots = {
+            (local_items[index]['gtin'], value)
+            for index, epc in epcs.items()
+            for name, value in ilmd.get(epc, []) if name == 'lotNumber'
+        }
+        lot_expiries = {}
+        for chunk in _chunked(lots, self.BATCH_QUERY_CHUNK_SIZE):
+            for gtin, lot, expiry in Lot.objects.filter(
+                gtin__in={gtin for gtin, _ in chunk},
+                lot__in={lot for _, lot in chunk}
+            ).values_list('gtin', 'lot', 'expiry'):
+                lot_expiries[(gtin, lot)] = expiry
+
+        ret_val = {}
+        for index, epc in epcs.items():
+            if epc not in ilmd:
+                continue
+            gtin = local_items[index]['gtin']
+            try:
+                ret_val[index] = self._match_ilmd(
+                    ((name, value, lot_expiries.get((gtin, value))
+                      if name == 'lotNumber' else None)
+                     for name, value in ilmd[epc]),
+                    local_items[index]['lot'], local_items[index]['exp']
+                )
+            except (ValueError, OverflowError):
+                # only this item fails, as it would in verify()
+                logger.error(traceback.format_exc())
+                ret_val[index] = None
         return ret_val
 
+    def _match_batch_index(self, local_items: dict):
+        '''
+        Matches the lot and expiry of a batch against the verification
+        index.
+        :param local_items: A dict of batch index to item for the items
+        whose GTIN is in local master data.
+        :return: A dict of batch index to (lot_matched, exp_matched) for
+        every item that is in the index.
+        '''
+        instances = {}
+        keys = {(item['gtin'], item['serial_number'])
+                for item in local_items.values()}
+        for chunk in _chunked(keys, self.BATCH_QUERY_CHUNK_SIZE):
+            for gtin, serial_number, lot, expiry, lot_expiry in \
+                ProductInstance.objects.filter(
+                    gtin__in={gtin for gtin, _ in chunk},
+                    serial_number__in={serial for _, serial in chunk}
+                ).annotate(
+                    lot_expiry=_lot_expiry(OuterRef('gtin'), OuterRef('lot'))
+                ).values_list('gtin', 'serial_number', 'lot', 'expiry',
+                              'lot_expiry'):
+                instances[(gtin, serial_number)] = (lot, expiry, lot_expiry)
+        ret_val = {}
+        for index, item in local_items.items():
+            instance = instances.get((item['gtin'], item['serial_number']))
+            if instance is not None:
+                ret_val[index] = self._match_instance(instance, item['lot'],
+                                                      item['exp'])
+        return ret_val
 
-    def _verify_external(self, gtin: str, lot: str, serial_number: str,
-                         correlation_id: str, exp: str):
+    def _validate_request(self, linkType: str, context: str):
+        if linkType and linkType != 'verificationService':
+            raise exceptions.APIException('An invalid linkType was specified '
+                                          'in the URl.',400)
+        if context and context != 'dscsaSaleableReturn':
+            raise exceptions.APIException('An invalid context was specified '
+                                          'in the URL', 400)
 
-        try:
-            map = GTINMap.objects.get(gtin=gtin)
-            if map.use_ssl:
-                protocol = "https://"
+    def _get_response_gln(self, reqGLN):
+        '''
+        Checks the reqGLN against the configured company access and returns
+        the responder GLN for the requestor, if one is configured.
+        :param reqGLN: The Requestor GLN.
+        :return: The responder GLN or None.
+        '''
+        response_gln = None
+        if not getattr(settings, 'VRS_ALLOW_ALL_REQ_GLNS', False):
+            ca = self._get_company_access(reqGLN)
+            if not ca.exists:
+                raise exceptions.NotAuthenticated(
+                    'The reqGLN %s is not authorized to query this '
+                    'system.' % reqGLN, 401)
             else:
-                protocol = "http://"
+                response_gln = ca.responder_gln or \
+                    getattr(settings, 'DEFAULT_VRS_RESPONDER_GLN')
+        return response_gln
 
-            if map.port is not None and map.port != "443" and map.port != "80":
-                host = "{0}{1}:{2}".format(protocol, map.host, map.port)
-            else:
-                host = "{0}{1}".format(protocol, map.host)
+    def _get_company_access(self, req_gln: str):
+        '''
+        Resolves the access and responder GLN for a requestor GLN through
+        the authorization cache.
+        :return: A CachedCompanyAccess.
+        '''
+        return company_access_cache.get_or_load(req_gln,
+                                                _load_company_access)
 
-            path = posixpath.join(map.path,
-                                  "verify/gtin/{0}/lot/{1}/ser/{2}?exp={3}".format(
-                                      gtin, lot, serial_number, exp))
+    def _get_trade_item(self, gtin: str):
+        '''
+        Resolves the company prefix and GLN of a GTIN through the trade
+        item cache.
+        :return: A CachedTradeItem.
+        :raises TradeItem.DoesNotExist: If the GTIN is not in master data.
+        '''
+        trade_item = trade_item_cache.get_or_load(gtin, _load_trade_item)
+        if not trade_item.exists:
+            raise TradeItem.DoesNotExist(
+                'The GTIN %s is not in master data.' % gtin)
+        return trade_item
 
-            logger.info('Verifing using External VRS at {0}'.format(host))
-            url = urllib.parse.urljoin(host, path)
+    def _get_trade_items(self, gtins: set):
+        '''
+        Resolves a set of GTINs through the trade item cache, loading all of
+        the misses with set-based queries.
+        :return: A dict of GTIN to CachedTradeItem.
+        '''
+        ret_val = {}
+        for gtin in gtins:
+            trade_item = trade_item_cache.get(gtin)
+            if trade_item is not None:
+                ret_val[gtin] = trade_item
+        misses = gtins - ret_val.keys()
+        for chunk in _chunked(misses, self.BATCH_QUERY_CHUNK_SIZE):
+            for gtin, company_prefix, gln in TradeItem.objects.filter(
+                GTIN14__in=chunk
+            ).values_list('GTIN14', 'company__gs1_company_prefix',
+                          'company__GLN13'):
+                ret_val[gtin] = CachedTradeItem(company_prefix, gln, True)
+        for gtin in misses:
+            if gtin not in ret_val:
+                ret_val[gtin] = CachedTradeItem(None, None, False)
+            trade_item_cache.set(gtin, ret_val[gtin])
+        return ret_val
 
-            if map.user_name is not None:
-                response = requests.get(url, auth=HTTPBasicAuth(map.user_name,
-                                                                map.password))
-            else:
-                response = requests.get(url)
-            if response.status_code != status.HTTP_200_OK:
-                raise Exception(response.content)
+    def _get_epc(self, gtin: str, company_prefix: str, serial_number: str):
+        indicator_digit = gtin[0]
+        item_ref = gtin[len(company_prefix) + 1: -1]
+        return "urn:epc:id:sgtin:{0}.{1}{2}.{3}".format(
+            company_prefix, indicator_digit, item_ref, serial_number)
 
-            ret_val = response.json()
-            # Add the external VRS host
-            ret_val['location'] = map.host
+    def _may_exist(self, gtin: str, company_prefix: str, serial_number: str):
+        '''
+        Checks the negative cache and the bloom filter of commissioned EPCs.
+        :return: False if the serial number definitely does not exist.
+        '''
+        if negative_cache.get((gtin, serial_number)):
+            return False
+        bloom_filter = get_bloom_filter()
+        return bloom_filter is None or \
+            self._get_epc(gtin, company_prefix, serial_number) in bloom_filter
+
+    def _use_index(self):
+        return getattr(settings, 'VRS_USE_VERIFICATION_INDEX', False)
+
+    def _get_instance(self, gtin: str, serial_number: str):
+        '''
+        Looks up a product instance in the verification index.
+        :return: A (lot, expiry, lot table expiry) tuple or None if the GTIN
+        and serial number were never commissioned.
+        '''
+        try:
+            return ProductInstance.objects.annotate(
+                lot_expiry=_lot_expiry(OuterRef('gtin'), OuterRef('lot'))
+            ).values_list('lot', 'expiry', 'lot_expiry').get(
+                gtin=gtin, serial_number=serial_number)
+        except ProductInstance.DoesNotExist:
+            return None
+
+    def _match_instance(self, instance: tuple, lot: str, exp: str):
+        '''
+        Compares an indexed (lot, expiry, lot table expiry) tuple against
+        the requested lot and expiry.  The lot table is authoritative for
+        the expiry of a lot that is in it.
+        :return: A (lot_matched, exp_matched) tuple.
+        '''
+        instance_lot, instance_expiry, lot_expiry = instance
+        instance_expiry = lot_expiry or instance_expiry
+        return (instance_lot is not None and instance_lot == lot,
+                instance_expiry is not None and instance_expiry == exp)
+
+    def _get_ilmd_by_epc(self, epc: str, gtin: str):
+        '''
+        Fetches the lot and expiry ILMD of every event an EPC took part in
+        along with the lot table expiry of its lots with a single query,
+        without reconstructing the EPCIS events.
+        :param epc: The EPC URN to look up.
+        :param gtin: The GTIN-14 of the EPC.
+        :return: A list of (name, value, lot table expiry) tuples or None if
+        the EPC has no events.
+        '''
+        rows = EntryEvent.objects.filter(identifier=epc).annotate(
+            lot_expiry=_lot_expiry(
+                gtin, OuterRef('event__instancelotmasterdata__value'))
+        ).values_list(
+            'event__instancelotmasterdata__name',
+            'event__instancelotmasterdata__value',
+            'lot_expiry'
+        )
+        ret_val = None
+        for name, value, lot_expiry in rows:
+            if ret_val is None:
+                ret_val = []
+            if name in self.ILMD_NAMES:
+                ret_val.append((name, value,
+                                lot_expiry if name == 'lotNumber' else None))
+        return ret_val
+
+    def _match_ilmd(self, ilmd, lot: str, exp: str):
+        '''
+        Compares ILMD name/value pairs against the requested lot and expiry.
+        The expiry is taken from the lot table when the serial number's
+        lot is known there and only parsed from the ILMD otherwise.
+        :param ilmd: An iterable of (name, value, lot table expiry) tuples.
+        :return: A (lot_matched, exp_matched) tuple.
+        '''
+        lots = set()
+        lot_expiries = set()
+        expiries = []
+        for name, value, lot_expiry in ilmd:
+            if name == "lotNumber":
+                lots.add(value)
+                if lot_expiry is not None:
+                    lot_expiries.add(lot_expiry)
+            elif name == 'itemExpirationDate':
+                expiries.append(value)
+        lot_matched = lot in lots
+        if lot_expiries:
+            exp_matched = exp in lot_expiries
+        else:
+            exp_matched = any(exp == self._format_exp_date(value)
+                              for value in expiries)
+        return lot_matched, exp_matched
+
+    def _match_message(self, response_gln: str, correlation_id: str,
+                       lot_matched: bool, exp_matched: bool):
+        '''
+        Builds the Verification Message for a GTIN and Serial Number that
+        matched, based on whether the lot and expiry matched as well.
+        '''
+        if exp_matched and lot_matched:
+            # GTIN, Serial, Lot, and Expiry all Verified.
+            ret_val = self._verification_message(
+                response_gln=response_gln,
+                correlation_id=correlation_id
+            )
 
+        elif not exp_matched and not lot_matched:
+            # The Lot and/or Expiry could not be verified.
+            # The GTIN & Serial did not match the Lot and Expiry
+            ret_val = self._verification_message(
+                response_gln=response_gln,
+                correlation_id=correlation_id,
+                verified=False,
+                reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT_EXPIRY
+            )
+
+        elif not exp_matched and lot_matched:
+            # The Expiry could not be verified.
+            # The GTIN & Serial did not match the Expiry
+            ret_val = self._verification_message(
+                response_gln=response_gln,
+                correlation_id=correlation_id,
+                verified=False,
+                reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_EXPIRY
+            )
+
+        else:
+            # The Lot could not be verified.
+            # The GTIN & Serial did not match the Lot
+            ret_val = self._verification_message(
+                response_gln=response_gln,
+                correlation_id=correlation_id,
+                verified=False,
+                reason=Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT
+            )
+        return ret_val
+
+    def _verify_external(self, gtin: str, lot: str, serial_number: str,
+                         correlation_id: str, exp: str):
+
+        if negative_cache.get(gtin):
+            # A recent lookup found that this GTIN is not mapped
+            return self._not_mapped_message(gtin, correlation_id)
+        try:
+            map = self._get_route(gtin)
         except GTINMap.DoesNotExist:
-            desc = 'GTIN: {0} is not mapped to an external VRS'.format(gtin)
-            logger.error(desc)
+            logger.error('GTIN: {0} is not mapped to an external '
+                         'VRS'.format(gtin))
+            negative_cache.set(gtin, True)
+            return self._not_mapped_message(gtin, correlation_id)
+        return self._forward_verify(map, gtin, lot, serial_number,
+                                    correlation_id, exp)
+
+    def _verify_external_batch(self, items: dict):
+        '''
+        Forwards the items of a batch whose GTINs are not in local master
+        data to their external VRS concurrently.  Routes are resolved from
+        the in-memory routing table.  The whole fan-out is bounded by
+        VRS_EXTERNAL_DEADLINE, and items whose call has not finished by
+        then are not verified.
+        :param items: A dict of batch index to (item, correlation_id).
+        :return: A dict of batch index to Verification Message.
+        '''
+        ret_val = {}
+        if not items:
+            return ret_val
+        deadline = time.monotonic() + getattr(settings,
+                                              'VRS_EXTERNAL_DEADLINE', 15)
+        routing_table = get_routing_table()
+        calls = {}
+        for index, (item, correlation_id) in items.items():
+            map = None
+            if not negative_cache.get(item['gtin']):
+                map = routing_table.get_route(item['gtin'])
+                if map is None:
+                    logger.error('GTIN: {0} is not mapped to an external '
+                                 'VRS'.format(item['gtin']))
+                    negative_cache.set(item['gtin'], True)
+            if map is None:
+                ret_val[index] = self._not_mapped_message(item['gtin'],
+                                                          correlation_id)
+                continue
+            # the endpoints are resolved here since the fan-out threads
+            # must not query the database
+            calls[index] = (
+                external.get_base_url(map), self._forward_verify,
+                (map, item['gtin'], item['lot'], item['serial_number'],
+                 correlation_id, item['exp'], external.get_endpoints(map))
+            )
+        if calls:
+            results = get_fanout_client().run(
+                calls.values(), timeout=deadline - time.monotonic())
+            for index, result in zip(calls.keys(), results):
+                if isinstance(result, BaseException):
+                    item, correlation_id = items[index]
+                    desc = 'Unable to verify GTIN: {0} using external VRS ' \
+                           'at {1} within the deadline'.format(
+                               item['gtin'], calls[index][0])
+                    logger.error(desc)
+                    result = self._verification_message(
+                        response_gln="",
+                        correlation_id=correlation_id,
+                        verified=False,
+                        reason=Verification.VERIFICATION_CODE_GTIN_NOT_FOUND,
+                        description=desc
+                    )
+                ret_val[index] = result
+        return ret_val
+
+    def _forward_verify(self, map: GTINMap, gtin: str, lot: str,
+                        serial_number: str, correlation_id: str, exp: str,
+                        endpoints: list = None):
+        '''
+        Forwards a verification to the external VRS of a route unless a
+        response for the same route and URL is cached or already in
+        flight.  Makes no database queries when given the route's
+        endpoints, so it is safe to run on the fan-out threads.
+        :param endpoints: The route's endpoints from
+        external.get_endpoints.
+        :return: The external VRS response or a GTIN_not_found message if
+        the external VRS could not be reached.
+        '''
+        host = external.get_base_url(map)
+        try:
+            path = posixpath.join(map.path,
+                                  "verify/gtin/{0}/lot/{1}/ser/{2}?exp={3}".format(
+                                      gtin, lot, serial_number, exp))
+
+            cache_key = (map.pk, external.get_url(map, path))
+            cached = external_response_cache.get(cache_key)
+            if cached is not None:
+                return self._stamp(copy.deepcopy(cached), correlation_id)
+
+            def fetch():
+                logger.info('Verifing using External VRS at {0}'.format(
+                    host))
+                response = external.get(map, path, endpoints)
+                if response.status_code != status.HTTP_200_OK:
+                    raise Exception(response.content)
+
+                result = response.json()
+                # Add the external VRS host
+                result['location'] = map.host
+                ttl = external.get_cache_ttl(response)
+                if ttl > 0:
+                    external_response_cache.set(cache_key, result, ttl=ttl)
+                return result
+
+            # concurrent identical requests share a single outbound call
+            ret_val = self._stamp(copy.deepcopy(
+                external.single_flight.do(cache_key, fetch)), correlation_id)
+
+        except external.CircuitOpenError as e:
             ret_val = self._verification_message(
                 response_gln="",
                 correlation_id=correlation_id,
                 verified=False,
                 reason=Verification.VERIFICATION_CODE_GTIN_NOT_FOUND,
-                description=desc
+                description=str(e)
             )
         except Exception as e:
-            desc = 'Unable to verify GTIN: {0} using external VRS at {0}'.format(
+            desc = 'Unable to verify GTIN: {0} using external VRS at {1}'.format(
                 gtin, host)
             logger.error(desc)
             ret_val = self._verification_message(
@@ -370,6 +826,40 @@ class Verification:
 
         return ret_val
 
+    def _stamp(self, response: dict, correlation_id: str):
+        '''
+        Sets the timestamp and correlation id of this request on a cached or
+        shared external VRS response, which otherwise carries those of the
+        request that fetched it.
+        '''
+        now, _ = helpers.get_current_utc_time_and_offset()
+        response['verificationTimestamp'] = now
+        response['corrUUID'] = correlation_id or str(uuid.uuid4())
+        return response
+
+    def _get_route(self, gtin: str):
+        '''
+        Resolves the route of a GTIN from the in-memory routing table.
+        :return: The GTINMap of the exact GTIN route or of the longest
+        matching prefix route.
+        :raises GTINMap.DoesNotExist: If the GTIN is not routed.
+        '''
+        route = get_route(gtin)
+        if route is None:
+            raise GTINMap.DoesNotExist(
+                'The GTIN %s is not mapped to an external VRS.' % gtin)
+        return route
+
+    def _not_mapped_message(self, gtin: str, correlation_id: str):
+        return self._verification_message(
+            response_gln="",
+            correlation_id=correlation_id,
+            verified=False,
+            reason=Verification.VERIFICATION_CODE_GTIN_NOT_FOUND,
+            description='GTIN: {0} is not mapped to an external '
+                        'VRS'.format(gtin)
+        )
+
     def _verification_message(self, response_gln: str,
                               correlation_id: str = "",
                               verified: bool = True,
@@ -436,5 +926,4 @@ class Verification:
         return ret_val
 
     def _format_exp_date(self, date):
-        dt = self.parser.parse(date)
-        return dt.strftime('%y%m%d')
+        return format_exp_date(date)
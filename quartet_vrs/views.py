@@ -13,8 +13,10 @@
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
 import traceback
-import json
 import logging
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -22,13 +24,18 @@ import coreapi, coreschema
 from rest_framework.schemas import ManualSchema
 from rest_framework import viewsets
 from rest_framework import exceptions
-from .serializers import GTINMapSerializer
+from .serializers import GTINMapSerializer, BatchVerificationSerializer
+from .serializers import RequestLogRollupSerializer
+from .permissions import VerificationPermissions, RequestLogExportPermissions
+from . import export
 from .verification import Verification
 from quartet_masterdata.models import Company
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from .models import GTINMap, RequestLog
+from .models import GTINMap, RequestLog, RequestLogRollup
+from .payloads import get_payload_fields
+from .request_log import get_request_log_writer, should_log
 
 logger = logging.getLogger(__name__)
 
@@ -74,15 +81,21 @@ class CheckConnectivityView(APIView):
         reqGLN = request.GET.get('reqGLN', '')
         context = request.GET.get('context', 'dscsaSaleableReturn')
 
-        responder_gln = Verification().check_connectivity(gtin=gtin, req_gln=reqGLN,
-                                                  context=context)
+        try:
+            responder_gln = Verification().check_connectivity(
+                gtin=gtin, req_gln=reqGLN, context=context)
+        except exceptions.APIException as e:
+            # denied calls are failures and are always logged
+            RequestLogger.log(request, response={'detail': e.detail},
+                              operation='checkConnectivity', success=False)
+            raise
         response_data = {'responderGLN': responder_gln}
         try:
             gln = responder_gln
             success = gln is not None
         except:
             pass
-        RequestLogger.log(request, response=str(response_data),
+        RequestLogger.log(request, response=response_data,
                           operation='checkConnectivity', success=success)
         return Response(data=response_data)
 
@@ -155,6 +168,78 @@ class VerifyView(APIView):
         return ret_val
 
 
+class BatchVerifyView(APIView):
+    queryset = Company.objects.none()
+    permission_classes = (VerificationPermissions,)
+
+    @swagger_auto_schema(request_body=BatchVerificationSerializer)
+    def post(self, request, *args, **kwargs):
+        """
+        Verifies a batch of product instances by GTIN, Lot, Serial Number,
+        and Expiration Date in a single request.  The reqGLN, linkType and
+        context are shared by every item.
+
+        usage:
+        POST http[s]://[host]:[port]/vrs/verify/batch
+
+        {
+            "reqGLN": "GLN13",
+            "context": "dscsaSaleableReturn",
+            "items": [
+                {"gtin": "GTIN14", "lot": "LOT", "ser": "SERIAL",
+                 "exp": "190401", "corrUUID": ""},
+                ...
+            ]
+        }
+
+        :param request: HTTP Request
+        :return: A list of verification messages in the same order as the
+        inbound items.
+        """
+        serializer = BatchVerificationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch = serializer.validated_data
+        success = False
+        ret_val = None
+        try:
+            items = [
+                {
+                    'gtin': item['gtin'],
+                    'lot': item['lot'],
+                    'serial_number': item['ser'],
+                    'exp': item['exp'],
+                    'correlation_id': item['corrUUID']
+                }
+                for item in batch['items']
+            ]
+            verification_messages = Verification().verify_batch(
+                items, linkType=batch['linkType'], context=batch['context'],
+                reqGLN=batch['reqGLN']
+            )
+            success = all(
+                (message.get('data') or {}).get('verified', False)
+                for message in verification_messages
+            )
+            ret_val = Response(
+                verification_messages,
+                status=status.HTTP_200_OK,
+                headers={'Cache-Control': 'private, no-cache'},
+                content_type="application/json"
+            )
+        except exceptions.APIException:
+            raise
+        except Exception:
+            # the traceback is logged but not returned to the caller
+            logger.exception('Unable to verify a batch of %s items.',
+                             len(batch['items']))
+            raise exceptions.APIException()
+        finally:
+            RequestLogger.log(request, response=ret_val,
+                              operation='verifyBatch', success=success,
+                              request_gln=batch['reqGLN'])
+        return ret_val
+
+
 class GTINMapView(viewsets.ModelViewSet):
     """
     API endpoint that allows GTIN Maps to be viewed or edited.
@@ -211,20 +296,103 @@ class GTINMapView(viewsets.ModelViewSet):
         return queryset
 
 
+class RequestLogRollupView(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that serves the hourly request counts per operation,
+    requestor GLN, GTIN and outcome.  Filter with the start and end
+    (ISO 8601) and the operation, request_gln, gtin, success and
+    failure_reason query parameters.
+    """
+    queryset = RequestLogRollup.objects.all()
+    serializer_class = RequestLogRollupSerializer
+
+    def get_queryset(self):
+        queryset = RequestLogRollup.objects.order_by('-hour', 'pk')
+        params = self.request.query_params
+        for name, lookup in (('start', 'hour__gte'), ('end', 'hour__lt')):
+            if params.get(name):
+                value = parse_datetime(params[name])
+                if value is None:
+                    raise exceptions.ValidationError(
+                        {name: 'Expected an ISO 8601 date and time.'})
+                queryset = queryset.filter(**{lookup: value})
+        for name in ('operation', 'request_gln', 'gtin', 'failure_reason'):
+            if params.get(name) is not None:
+                queryset = queryset.filter(**{name: params[name]})
+        if params.get('success') is not None:
+            queryset = queryset.filter(
+                success=params['success'].lower() in ('true', '1'))
+        return queryset
+
+
+class RequestLogExportView(APIView):
+    """
+    Streams the request log as CSV or NDJSON.
+    """
+    queryset = RequestLog.objects.none()
+    permission_classes = (RequestLogExportPermissions,)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Exports the request log, oldest first, without loading it into
+        memory.
+
+        usage:
+        http[s]://[host]:[port]/vrs/requestlog/export?type=ndjson&start=2019-06-01&end=2019-07-01&reqGLN={GLN}&gtin={GTIN14}
+
+        :param request: HTTP Request
+        :return: A StreamingHttpResponse of the rows.
+        """
+        params = request.query_params
+        # the format parameter is DRF's renderer override
+        format = params.get('type', export.CSV)
+        if format not in export.FORMATS:
+            raise exceptions.ValidationError(
+                {'type': 'Expected one of %s.' % ', '.join(export.FORMATS)})
+        bounds = {}
+        for name in ('start', 'end'):
+            try:
+                bounds[name] = export.parse_time(params[name]) \
+                    if params.get(name) else None
+            except ValueError as e:
+                raise exceptions.ValidationError({name: str(e)})
+        queryset = export.get_export_queryset(
+            bounds['start'], bounds['end'], params.get('reqGLN'),
+            params.get('gtin'))
+        ret_val = StreamingHttpResponse(
+            export.export_rows(queryset, format),
+            content_type=export.CONTENT_TYPES[format]
+        )
+        ret_val['Content-Disposition'] = \
+            'attachment; filename="request_log.%s"' % format
+        return ret_val
+
+
 class RequestLogger(object):
     """
     Class to log all requests
     """
 
     @staticmethod
-    def log(request, response, operation, success):
+    def log(request, response, operation, success, request_gln=None):
         """
         Static Method to log requests
         :param request: HTTP Request to log
+        :param request_gln: The Requestor GLN if it was not supplied on the
+        query string, e.g. in the body of a batch request.
         :return: None
         """
         # Use a try/except to capture request data
         logger.debug("Entering RequestLogger.log()")
+        if request_gln is None:
+            try:
+                request_gln = request.query_params['reqGLN']
+            except:
+                request_gln = None
+        # skip sampled out requests before any other work
+        sample_rate = should_log(operation, success, request_gln)
+        if not sample_rate:
+            return
         try:
             remote_address = get_client_ip(request)
         except:
@@ -233,10 +401,6 @@ class RequestLogger(object):
             expiry = request.query_params['exp']
         except:
             expiry = None
-        try:
-            request_gln = request.query_params['reqGLN']
-        except:
-            request_gln = None
         try:
             corr_uuid = request.query_params['corrUUID']
         except:
@@ -263,29 +427,26 @@ class RequestLogger(object):
             user_name = None
 
         if hasattr(response, 'data'):
-            resp = json.dumps(response.data)
+            data = response.data
         else:
-            resp = json.dumps(response)
+            data = response
 
-        # create log entry
-        try:
-            RequestLog.objects.update_or_create(
-                remote_address=remote_address,
-                expiry=expiry,
-                request_gln=request_gln,
-                corr_uuid=corr_uuid,
-                gtin=gtin,
-                lot=lot,
-                serial_number=serial_number,
-                user_name=user_name,
-                response=resp,
-                operation=operation,
-                success=success
-            )
-        except Exception as e:
-            # will not throw, just log
-            tb = traceback.format_exc()
-            logger.error(tb)
+        # create log entry, the writer will not throw
+        get_request_log_writer().write(dict(
+            remote_address=remote_address,
+            expiry=expiry,
+            request_gln=request_gln,
+            corr_uuid=corr_uuid,
+            gtin=gtin,
+            lot=lot,
+            serial_number=serial_number,
+            user_name=user_name,
+            operation=operation,
+            success=success,
+            sample_rate=sample_rate,
+            created=timezone.now(),
+            **get_payload_fields(data)
+        ))
 
 
 def get_client_ip(request):
@@ -0,0 +1,46 @@
+import timeit
+
+import click
+from dateutil.parser import parser
+
+from quartet_vrs.dates import format_exp_date
+
+VALUES = ['2015-12-31', '2015-12-31T00:00:00.000-05:00', '151231']
+
+
+@click.command()
+@click.option('--number', '-n', default=100000)
+@click.option('--distinct', '-d', default=100,
+              help='The number of distinct dates per format.')
+def main(number: int, distinct: int):
+    values = [
+        value.replace('31', '%02d' % (1 + i % 28))
+        for i in range(distinct) for value in VALUES
+    ]
+    dateutil_parser = parser()
+
+    def with_dateutil():
+        for value in values:
+            dateutil_parser.parse(value).strftime('%y%m%d')
+
+    def uncached():
+        for value in values:
+            format_exp_date.__wrapped__(value)
+
+    def cached():
+        for value in values:
+            format_exp_date(value)
+
+    repeat = max(1, number // len(values))
+    baseline = None
+    for name, func in (('dateutil', with_dateutil), ('fast path', uncached),
+                       ('memoized', cached)):
+        elapsed = timeit.timeit(func, number=repeat)
+        per_call = elapsed / (repeat * len(values)) * 1e6
+        baseline = baseline or per_call
+        click.echo('{0:<10} {1:8.2f} us/call {2:8.1f}x'.format(
+            name, per_call, baseline / per_call))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from mixer.backend.django import mixer
+from quartet_epcis.parsing.parser import QuartetParser
+from quartet_masterdata.models import TradeItem, Company
+
+from quartet_vrs.bloom import BloomFilter, get_bloom_filter
+from quartet_vrs.indexing import index_message
+from quartet_vrs.verification import Verification
+
+
+class BloomFilterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sgtins.bloom')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_membership(self):
+        bloom_filter = BloomFilter.create(self.path, 10000, 0.01)
+        epcs = ['urn:epc:id:sgtin:305555.0555555.%s' % i
+                for i in range(10000)]
+        bloom_filter.update(epcs)
+        bloom_filter.close()
+        # reopen read-only as a worker would
+        bloom_filter = BloomFilter(self.path)
+        # keys that are false positives when added are not counted
+        self.assertGreater(bloom_filter.count, 9800)
+        self.assertLessEqual(bloom_filter.count, 10000)
+        for epc in epcs:
+            self.assertIn(epc, bloom_filter)
+        false_positives = sum(
+            'urn:epc:id:sgtin:305555.0555555.X%s' % i in bloom_filter
+            for i in range(10000)
+        )
+        self.assertLess(false_positives, 200)
+        bloom_filter.close()
+
+    def test_shared_updates(self):
+        BloomFilter.create(self.path, 1000, 0.001).close()
+        reader = BloomFilter(self.path)
+        writer = BloomFilter(self.path, writable=True)
+        self.assertNotIn('urn:epc:id:sgtin:305555.0555555.1', reader)
+        writer.add('urn:epc:id:sgtin:305555.0555555.1')
+        writer.close()
+        self.assertIn('urn:epc:id:sgtin:305555.0555555.1', reader)
+        reader.close()
+
+    def test_readd(self):
+        bloom_filter = BloomFilter.create(self.path, 1000, 0.001)
+        bloom_filter.update(['urn:epc:id:sgtin:305555.0555555.1'] * 3)
+        bloom_filter.add('urn:epc:id:sgtin:305555.0555555.1')
+        self.assertEquals(bloom_filter.count, 1)
+        bloom_filter.close()
+
+    def test_reader_survives_swap(self):
+        BloomFilter.create(self.path, 1000, 0.001).close()
+        with override_settings(VRS_BLOOM_FILTER_PATH=self.path,
+                               VRS_BLOOM_FILTER_RELOAD_INTERVAL=0):
+            reader = get_bloom_filter()
+            replacement = os.path.join(self.dir, 'new.bloom')
+            BloomFilter.create(replacement, 1000, 0.001).close()
+            os.replace(replacement, self.path)
+            self.assertIsNot(get_bloom_filter(), reader)
+            # a request still holding the old filter can keep reading it
+            self.assertNotIn('urn:epc:id:sgtin:305555.0555555.1', reader)
+
+
+class BloomFilterVerificationTest(TestCase):
+
+    def setUp(self):
+        self.gtin = "03055555555557"
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sgtins.bloom')
+        company = mixer.blend(Company, gs1_company_prefix="305555",
+                              GLN13="3055551234562")
+        mixer.blend(TradeItem, company=company, GTIN14=self.gtin)
+        data = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'commission.xml')
+        with open(data, "rb") as epcis_doc:
+            self.epcis = epcis_doc.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _verify(self, serial_number):
+        return Verification().verify(gtin=self.gtin, lot="DL232",
+                                     serial_number=serial_number,
+                                     correlation_id=None, exp="151231",
+                                     linkType=None, context=None,
+                                     reqGLN=None)
+
+    def test_build_and_verify(self):
+        QuartetParser(stream=io.BytesIO(self.epcis)).parse()
+        with override_settings(VRS_BLOOM_FILTER_PATH=self.path,
+                               VRS_ALLOW_ALL_REQ_GLNS=True):
+            call_command('build_bloom_filter', capacity=1000)
+            self.assertEquals(get_bloom_filter().count, 12)
+            self.assertEquals(self._verify("1")["data"]["verified"], True)
+            # with the trade item cached, a serial that is not in the filter
+            # is answered without any queries
+            with self.assertNumQueries(0):
+                msg = self._verify("11")
+            self.assertEquals(msg["data"]["verificationFailureReason"],
+                              Verification.VERIFICATION_CODE_GTIN_SERIAL)
+
+    def test_incremental_update(self):
+        with override_settings(VRS_BLOOM_FILTER_PATH=self.path,
+                               VRS_ALLOW_ALL_REQ_GLNS=True):
+            call_command('build_bloom_filter', capacity=1000)
+            self.assertEquals(
+                self._verify("1")["data"]["verificationFailureReason"],
+                Verification.VERIFICATION_CODE_GTIN_SERIAL)
+            index_message(QuartetParser(stream=io.BytesIO(self.epcis)).parse())
+            self.assertEquals(get_bloom_filter().count, 12)
+            self.assertEquals(self._verify("1")["data"]["verified"], True)
+
+    def test_build_temp_file(self):
+        with override_settings(VRS_BLOOM_FILTER_PATH=self.path):
+            call_command('build_bloom_filter', capacity=1000)
+            call_command('build_bloom_filter', capacity=1000)
+        self.assertEquals(os.listdir(self.dir), ['sgtins.bloom'])
+
+    def test_legacy_update(self):
+        with override_settings(VRS_BLOOM_FILTER_PATH=self.path,
+                               VRS_ALLOW_ALL_REQ_GLNS=True):
+            call_command('build_bloom_filter', capacity=1000)
+            self.assertEquals(get_bloom_filter().count, 0)
+            # without the VerificationIndexStep
+            QuartetParser(stream=io.BytesIO(self.epcis)).parse()
+            self.assertEquals(get_bloom_filter().count, 12)
+            self.assertEquals(self._verify("1")["data"]["verified"], True)
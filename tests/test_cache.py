@@ -0,0 +1,209 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import io
+import os
+
+from django.test import TestCase, SimpleTestCase, override_settings
+from rest_framework import exceptions
+from mixer.backend.django import mixer
+from quartet_masterdata.models import TradeItem, Company
+
+from quartet_vrs.cache import TTLCache, trade_item_cache
+from quartet_vrs.cache import company_access_cache, negative_cache
+from quartet_vrs.health import invalidate_route_health
+from quartet_vrs.routing import invalidate_routing_table
+from quartet_vrs.indexing import index_message
+from quartet_vrs.models import CompanyAccess, GTINMap
+from quartet_epcis.parsing.parser import QuartetParser
+from quartet_vrs.verification import Verification
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTest(SimpleTestCase):
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=20)
+        self.assertEquals(cache.get('a'), 1)
+        timer.now = 6
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(cache.get('b'), 2)
+        self.assertEquals(cache.stats()['hits'], 2)
+        self.assertEquals(cache.stats()['misses'], 1)
+
+    def test_lru(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEquals(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals(len(cache), 2)
+
+    def test_disabled(self):
+        cache = TTLCache(maxsize=10, ttl=0)
+        self.assertEquals(cache.get_or_load('a', lambda key: key * 2), 'aa')
+        self.assertEquals(len(cache), 0)
+
+
+class TradeItemCacheTest(TestCase):
+
+    def setUp(self):
+        self.gtin = "03055555555557"
+        self.company = mixer.blend(Company, gs1_company_prefix="305555",
+                                   GLN13="3055551234562")
+        self.trade_item = mixer.blend(TradeItem, company=self.company,
+                                      GTIN14=self.gtin)
+
+    def test_cached_lookup(self):
+        verification = Verification()
+        with self.assertNumQueries(1):
+            verification._get_trade_item(self.gtin)
+        with self.assertNumQueries(0):
+            trade_item = verification._get_trade_item(self.gtin)
+        self.assertEquals(trade_item.company_prefix, "305555")
+        self.assertEquals(trade_item.gln, "3055551234562")
+        # unknown GTINs are cached as well
+        with self.assertNumQueries(1):
+            self.assertRaises(TradeItem.DoesNotExist,
+                              verification._get_trade_item, "00000000000014")
+        with self.assertNumQueries(0):
+            self.assertRaises(TradeItem.DoesNotExist,
+                              verification._get_trade_item, "00000000000014")
+        self.assertTrue(trade_item_cache.stats()['hits'] >= 2)
+
+    def test_invalidation(self):
+        verification = Verification()
+        verification._get_trade_item(self.gtin)
+        self.company.GLN13 = "3055550000008"
+        self.company.save()
+        self.assertEquals(len(trade_item_cache), 0)
+        self.assertEquals(verification._get_trade_item(self.gtin).gln,
+                          "3055550000008")
+        self.trade_item.delete()
+        self.assertRaises(TradeItem.DoesNotExist,
+                          verification._get_trade_item, self.gtin)
+
+
+class CompanyAccessCacheTest(TestCase):
+
+    def setUp(self):
+        self.gtin = "03055555555557"
+        self.req_gln = "0306666543210"
+        self.responder_gln = "3055551234562"
+        responder = mixer.blend(Company, gs1_company_prefix="305555",
+                                GLN13=self.responder_gln)
+        mixer.blend(TradeItem, company=responder, GTIN14=self.gtin)
+        requestor = mixer.blend(Company, GLN13=self.req_gln)
+        self.company_access = CompanyAccess.objects.create(
+            company=requestor, responder=responder)
+
+    def test_cached_authorization(self):
+        verification = Verification()
+        with self.assertNumQueries(1):
+            self.assertEquals(verification._get_response_gln(self.req_gln),
+                              self.responder_gln)
+        with self.assertNumQueries(0):
+            self.assertEquals(verification._get_response_gln(self.req_gln),
+                              self.responder_gln)
+        # checkConnectivity shares the cache with verify
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                verification.check_connectivity(self.gtin, self.req_gln),
+                self.responder_gln)
+
+    def test_invalidation(self):
+        verification = Verification()
+        verification.check_connectivity(self.gtin, self.req_gln)
+        self.company_access.access_granted = False
+        self.company_access.save()
+        self.assertEquals(len(company_access_cache), 0)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            verification.check_connectivity(self.gtin, self.req_gln)
+        self.company_access.delete()
+        with self.assertRaises(exceptions.NotAuthenticated):
+            verification.check_connectivity(self.gtin, self.req_gln)
+        with self.assertRaises(exceptions.NotAuthenticated):
+            verification._get_response_gln(self.req_gln)
+
+
+@override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+class NegativeCacheTest(TestCase):
+
+    def setUp(self):
+        self.gtin = "03055555555557"
+        company = mixer.blend(Company, gs1_company_prefix="305555",
+                              GLN13="3055551234562")
+        mixer.blend(TradeItem, company=company, GTIN14=self.gtin)
+        invalidate_routing_table()
+        invalidate_route_health()
+
+    def _verify(self, gtin, serial_number):
+        return Verification().verify(gtin=gtin, lot="DL232",
+                                     serial_number=serial_number,
+                                     correlation_id=None, exp="151231",
+                                     linkType=None, context=None,
+                                     reqGLN=None)
+
+    def test_unmapped_gtin(self):
+        gtin = "00000000000014"
+        # the trade item, the endpoint health and the routing table
+        with self.assertNumQueries(3):
+            self._verify(gtin, "1")
+        with self.assertNumQueries(0):
+            msg = self._verify(gtin, "1")
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+        # mapping the GTIN evicts the negative result
+        mixer.blend(GTINMap, gtin=gtin, host="localhost", port="1",
+                    use_ssl=False)
+        self.assertIsNone(negative_cache.get(gtin))
+
+    def test_unknown_serial(self):
+        with self.assertNumQueries(2):
+            self._verify(self.gtin, "1")
+        with self.assertNumQueries(0):
+            msg = self._verify(self.gtin, "1")
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL)
+        # capturing the commissioning event evicts the negative result
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'commission.xml')
+        with open(path, "rb") as epcis_doc:
+            index_message(
+                QuartetParser(stream=io.BytesIO(epcis_doc.read())).parse())
+        self.assertIsNone(negative_cache.get((self.gtin, "1")))
+        self.assertEquals(self._verify(self.gtin, "1")["data"]["verified"],
+                          True)
+
+    def test_unknown_serial_legacy(self):
+        self._verify(self.gtin, "1")
+        self.assertTrue(negative_cache.get((self.gtin, "1")))
+        # parsing alone, without indexing, evicts the negative result
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'commission.xml')
+        with open(path, "rb") as epcis_doc:
+            QuartetParser(stream=io.BytesIO(epcis_doc.read())).parse()
+        self.assertIsNone(negative_cache.get((self.gtin, "1")))
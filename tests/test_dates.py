@@ -0,0 +1,40 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from dateutil.parser import parse
+from django.test import SimpleTestCase
+
+from quartet_vrs.dates import format_exp_date
+
+
+class FormatExpDateTest(SimpleTestCase):
+
+    def test_formats(self):
+        for value in ('2015-12-31', '20151231',
+                      '2015-12-31T00:00:00.000-05:00',
+                      '2015-12-31T23:59:59Z', '2015-12-31 10:00:00',
+                      'Dec 31 2015'):
+            self.assertEquals(format_exp_date(value), '151231', value)
+            self.assertEquals(format_exp_date(value),
+                              parse(value).strftime('%y%m%d'), value)
+
+    def test_yymmdd(self):
+        # dateutil reads six digits as DDMMYY, GS1 dates are YYMMDD
+        self.assertEquals(format_exp_date('151231'), '151231')
+        self.assertEquals(format_exp_date('200229'), '200229')
+
+    def test_invalid(self):
+        for value in ('2015-02-30', '151301', 'not a date'):
+            with self.assertRaises(ValueError):
+                format_exp_date(value)
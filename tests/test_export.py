@@ -0,0 +1,73 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from quartet_vrs.request_log import DatabaseWriter
+from tests.test_request_log import make_record
+
+DAY = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+class ExportTest(APITestCase):
+
+    def setUp(self):
+        for days, gln in ((0, '0614141000005'), (1, '0614141000012'),
+                          (2, '0614141000005')):
+            DatabaseWriter().write(make_record(
+                str(days), request_gln=gln,
+                created=DAY + datetime.timedelta(days=days, hours=1)))
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.csv')
+            call_command('export_request_log', start='2019-06-01',
+                         end='2019-06-03', request_gln='0614141000005',
+                         output=path, chunk_size=1, stdout=io.StringIO())
+            with open(path, newline='') as export_file:
+                rows = list(csv.DictReader(export_file))
+        self.assertEqual([row['serial_number'] for row in rows], ['0'])
+        self.assertEqual(rows[0]['created'], (DAY + datetime.timedelta(
+            hours=1)).isoformat())
+
+    def test_endpoint(self):
+        user = User.objects.create_user(username='auditor')
+        self.client.force_authenticate(user=user)
+        url = reverse('requestLogExport')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        user.user_permissions.add(
+            Permission.objects.get(codename='view_requestlog'))
+        user = User.objects.get(pk=user.pk)
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url, {'type': 'ndjson',
+                                         'start': '2019-06-02'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['serial_number'] for line in lines],
+                         ['1', '2'])
+        response = self.client.get(url, {'type': 'xml'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'end': 'June'})
+        self.assertEqual(response.status_code, 400)
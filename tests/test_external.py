@@ -0,0 +1,359 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.test import SimpleTestCase, TestCase, override_settings
+from mixer.backend.django import mixer
+
+from quartet_vrs import external
+from quartet_vrs.cache import external_response_cache
+from quartet_vrs.models import GTINMap, RouteEndpoint
+from quartet_vrs.routing import get_route
+from quartet_vrs.verification import Verification
+
+
+class SessionPoolTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        self.route = mixer.blend(GTINMap, gtin="03066661234564",
+                                 host="vrs.example.com", port=None,
+                                 path="/vrs", use_ssl=True,
+                                 user_name='user', password='secret')
+
+    def tearDown(self):
+        external.close_sessions()
+
+    def test_base_url(self):
+        self.assertEquals(external.get_base_url(self.route),
+                          'https://vrs.example.com')
+        self.route.port = '8443'
+        self.assertEquals(external.get_base_url(self.route),
+                          'https://vrs.example.com:8443')
+
+    @override_settings(VRS_EXTERNAL_POOL_SIZE=25)
+    def test_session_reuse(self):
+        session = external.get_session(self.route)
+        self.assertIs(external.get_session(
+            GTINMap.objects.get(pk=self.route.pk)), session)
+        self.assertEquals(session.auth.username, 'user')
+        adapter = session.get_adapter('https://vrs.example.com')
+        self.assertEquals(adapter._pool_maxsize, 25)
+
+    def test_session_rebuilt_on_change(self):
+        session = external.get_session(self.route)
+        self.route.password = 'changed'
+        self.route.save()
+        rebuilt = external.get_session(self.route)
+        self.assertIsNot(rebuilt, session)
+        self.assertEquals(rebuilt.auth.password, 'changed')
+
+    def test_session_closed_on_delete(self):
+        session = external.get_session(self.route)
+        self.route.delete()
+        self.assertEquals(external._sessions, {})
+        self.assertIsNot(external.get_session(self.route), session)
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        external.reset_circuit_breakers()
+        # nothing listens on the discard port, so connections are refused
+        self.route = mixer.blend(GTINMap, gtin="03066661234564",
+                                 host="127.0.0.1", port="9", path="/vrs",
+                                 use_ssl=False, user_name=None,
+                                 connect_timeout=0.5, read_timeout=0.5)
+
+    def tearDown(self):
+        external.close_sessions()
+        external.reset_circuit_breakers()
+
+    def test_states(self):
+        now = [0]
+        breaker = external.CircuitBreaker(failure_threshold=2,
+                                          open_interval=10,
+                                          timer=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEquals(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+        now[0] = 10
+        # a single probe is let through once the interval has passed
+        self.assertTrue(breaker.allow())
+        self.assertEquals(breaker.state, breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEquals(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_timeout(self):
+        self.assertEquals(external.get_timeout(self.route), (0.5, 0.5))
+        self.route.read_timeout = None
+        with override_settings(VRS_EXTERNAL_READ_TIMEOUT=7):
+            self.assertEquals(external.get_timeout(self.route), (0.5, 7))
+
+    @override_settings(VRS_EXTERNAL_FAILURE_THRESHOLD=2)
+    def test_open_route(self):
+        for _ in range(2):
+            msg = Verification()._verify_external(self.route.gtin, "LOT",
+                                                  "1", None, "201231")
+            self.assertTrue(msg["description"].startswith(
+                'Unable to verify'))
+        msg = Verification()._verify_external(self.route.gtin, "LOT", "1",
+                                              None, "201231")
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+        self.assertEquals(msg["description"],
+                          'The external VRS at http://127.0.0.1:9 is '
+                          'unavailable.')
+
+
+class CachingVRSHandler(BaseHTTPRequestHandler):
+    cache_control = None
+    delay = 0
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(self.delay)
+        body = json.dumps({"data": {"verified": True}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.cache_control:
+            self.send_header('Cache-Control', self.cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheTTLTest(SimpleTestCase):
+
+    def _ttl(self, cache_control=None):
+        response = requests.Response()
+        if cache_control is not None:
+            response.headers['Cache-Control'] = cache_control
+        return external.get_cache_ttl(response)
+
+    @override_settings(VRS_EXTERNAL_CACHE_TTL=60,
+                       VRS_EXTERNAL_CACHE_MAX_TTL=300)
+    def test_cache_ttl(self):
+        self.assertEquals(self._ttl(), 60)
+        self.assertEquals(self._ttl('public, max-age=120'), 120)
+        self.assertEquals(self._ttl('max-age=86400'), 300)
+        self.assertEquals(self._ttl('max-age=0'), 0)
+        self.assertEquals(self._ttl('no-store'), 0)
+        self.assertEquals(self._ttl('private, max-age=120'), 0)
+
+
+class ExternalResponseCacheTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        external.reset_circuit_breakers()
+        external_response_cache.clear()
+        CachingVRSHandler.requests = 0
+        CachingVRSHandler.delay = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          CachingVRSHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.route = mixer.blend(GTINMap, gtin="03066661234564",
+                                 host="127.0.0.1",
+                                 port=str(self.server.server_address[1]),
+                                 path="/vrs/", use_ssl=False, user_name=None,
+                                 connect_timeout=None, read_timeout=None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        external.close_sessions()
+        external_response_cache.clear()
+
+    def _verify(self, serial_number='1'):
+        return Verification()._verify_external(self.route.gtin, "LOT",
+                                               serial_number, None, "201231")
+
+    def test_cached(self):
+        CachingVRSHandler.cache_control = 'max-age=120'
+        msg = self._verify()
+        msg['data']['verified'] = False
+        cached = self._verify()
+        self.assertEquals(cached["data"], {"verified": True})
+        self.assertEquals(cached["location"], "127.0.0.1")
+        # the cached response carries the id of the request it answers
+        self.assertNotEquals(cached["corrUUID"], msg["corrUUID"])
+        self.assertIsNotNone(cached["verificationTimestamp"])
+        self.assertEquals(CachingVRSHandler.requests, 1)
+        # another serial number is another URL
+        self._verify('2')
+        self.assertEquals(CachingVRSHandler.requests, 2)
+        # changing the route drops its cached responses
+        self.route.save()
+        self._verify()
+        self.assertEquals(CachingVRSHandler.requests, 3)
+
+    def test_no_store(self):
+        CachingVRSHandler.cache_control = 'no-store'
+        self._verify()
+        self._verify()
+        self.assertEquals(CachingVRSHandler.requests, 2)
+
+    def test_coalesced(self):
+        CachingVRSHandler.cache_control = 'no-store'
+        CachingVRSHandler.delay = 0.3
+        stats = external.single_flight.stats()
+        results = []
+        # _forward_verify with a route from the routing table, since the
+        # test database is not shared with other threads
+        route = get_route(self.route.gtin)
+
+        def verify(correlation_id):
+            results.append(Verification()._forward_verify(
+                route, self.route.gtin, "LOT", "1", correlation_id, "201231"))
+
+        threads = [threading.Thread(target=verify, args=(str(i),))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(CachingVRSHandler.requests, 1)
+        self.assertEquals(len(results), 5)
+        # every caller gets its own copy of the shared response
+        self.assertEquals(len({id(result) for result in results}), 5)
+        self.assertEquals({result["corrUUID"] for result in results},
+                          {str(i) for i in range(5)})
+        self.assertEquals(external.single_flight.stats()['shared'],
+                          stats['shared'] + 4)
+        self.assertEquals(external.single_flight.stats()['in_flight'], 0)
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def test_error_shared(self):
+        flight = external.SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('failed')
+
+        def call():
+            try:
+                flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        leader.join()
+        follower.join()
+        self.assertEquals(len(errors), 2)
+        self.assertEquals(flight.stats(),
+                          {'calls': 1, 'shared': 1, 'in_flight': 0})
+        # a later call is not coalesced with the finished one
+        self.assertEquals(flight.do('key', lambda: 1), 1)
+
+
+class RouteEndpointTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        external.reset_circuit_breakers()
+        external_response_cache.clear()
+        CachingVRSHandler.cache_control = 'no-store'
+        CachingVRSHandler.delay = 0
+        CachingVRSHandler.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          CachingVRSHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.route = mixer.blend(GTINMap, gtin="03066661234564",
+                                 host="vrs.example.com", port=None,
+                                 path="/vrs/", use_ssl=False, user_name=None,
+                                 connect_timeout=None, read_timeout=None)
+        # nothing listens on the discard port, so connections are refused
+        self.down = RouteEndpoint.objects.create(
+            route=self.route, host='127.0.0.1', port='9', use_ssl=False,
+            weight=100)
+        self.up = RouteEndpoint.objects.create(
+            route=self.route, host='127.0.0.1',
+            port=str(self.server.server_address[1]), use_ssl=False,
+            weight=1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        external.close_sessions()
+        external.reset_circuit_breakers()
+
+    def test_weighted_selection(self):
+        route = get_route(self.route.gtin)
+        first = [external.select_endpoints(route)[0].pk
+                 for _ in range(1000)]
+        self.assertGreater(first.count(self.down.pk), 900)
+
+    def test_least_outstanding(self):
+        route = get_route(self.route.gtin)
+        down_url = external.get_base_url(self.down)
+        external._track(down_url, 1000)
+        try:
+            self.assertEquals(external.select_endpoints(route)[0], self.up)
+        finally:
+            external._track(down_url, -1000)
+
+    @override_settings(VRS_EXTERNAL_FAILURE_THRESHOLD=1)
+    def test_failover(self):
+        route = get_route(self.route.gtin)
+        for _ in range(3):
+            response = external.get(route, 'vrs/verify')
+            self.assertEquals(response.status_code, 200)
+        self.assertEquals(CachingVRSHandler.requests, 3)
+        # the failed endpoint's breaker is open, so it is tried last
+        self.assertTrue(external.get_circuit_breaker(self.down).is_open)
+        self.assertEquals(external.select_endpoints(route)[0], self.up)
+
+    def test_given_endpoints(self):
+        # a route that was not loaded with its endpoints, as a fan-out
+        # thread would be handed
+        route = GTINMap.objects.get(pk=self.route.pk)
+        endpoints = external.get_endpoints(route)
+        with self.assertNumQueries(0):
+            response = external.get(route, 'vrs/verify', endpoints)
+        self.assertEquals(response.status_code, 200)
+
+    @override_settings(VRS_EXTERNAL_DEADLINE=0)
+    def test_deadline(self):
+        with self.assertRaises(requests.Timeout):
+            external.get(get_route(self.route.gtin), 'vrs/verify')
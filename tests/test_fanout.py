@@ -0,0 +1,166 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from mixer.backend.django import mixer
+
+from quartet_vrs import external
+from quartet_vrs.cache import external_response_cache
+from quartet_vrs.fanout import FanOutClient
+from quartet_vrs.models import GTINMap
+from quartet_vrs.verification import Verification
+
+
+class SlowVRSHandler(BaseHTTPRequestHandler):
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"data": {"verified": True},
+                           "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FanOutClientTest(SimpleTestCase):
+
+    def setUp(self):
+        self.in_flight = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def _call(self, host):
+        with self.lock:
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0),
+                                  self.in_flight[host])
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight[host] -= 1
+        return host
+
+    def test_per_host_bound(self):
+        client = FanOutClient(max_concurrency=10, max_per_host=2)
+        calls = [(host, self._call, (host,))
+                 for host in ('a', 'b') for _ in range(6)]
+        self.assertEquals(client.run(calls), ['a'] * 6 + ['b'] * 6)
+        self.assertEquals(self.peak, {'a': 2, 'b': 2})
+
+    def test_global_bound(self):
+        client = FanOutClient(max_concurrency=3, max_per_host=10)
+        calls = [(str(i), self._call, ('host',)) for i in range(9)]
+        client.run(calls)
+        self.assertEquals(self.peak['host'], 3)
+
+    def test_exceptions(self):
+        def fail():
+            raise ValueError('failed')
+        client = FanOutClient(max_concurrency=2, max_per_host=2)
+        results = client.run([('a', fail, ()), ('a', self._call, ('a',))])
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEquals(results[1], 'a')
+
+    def test_timeout(self):
+        client = FanOutClient(max_concurrency=1, max_per_host=1)
+        start = time.monotonic()
+        results = client.run([('a', self._call, ('a',))] * 4, timeout=0.08)
+        # the calls queued behind the first one are given up on
+        self.assertLess(time.monotonic() - start, 0.15)
+        self.assertEquals(results[0], 'a')
+        for result in results[1:]:
+            self.assertIsInstance(result, asyncio.TimeoutError)
+
+    def test_gather(self):
+        client = FanOutClient(max_concurrency=2, max_per_host=2)
+        results = asyncio.run(
+            client.gather([('a', self._call, ('a',))] * 2))
+        self.assertEquals(results, ['a', 'a'])
+
+
+@override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+class ExternalBatchTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        external.reset_circuit_breakers()
+        external_response_cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowVRSHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.gtins = ['0306666123456%d' % i for i in range(4)]
+        for gtin in self.gtins:
+            mixer.blend(GTINMap, gtin=gtin, host='127.0.0.1',
+                        port=str(self.server.server_address[1]),
+                        path='/vrs/', use_ssl=False, user_name=None,
+                        connect_timeout=None, read_timeout=None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        external.close_sessions()
+
+    def test_verify_batch(self):
+        items = [
+            {"gtin": gtin, "lot": "LOT", "serial_number": "1",
+             "exp": "201231", "correlation_id": gtin}
+            for gtin in self.gtins + ['00000000000017']
+        ]
+        start = time.monotonic()
+        msgs = Verification().verify_batch(items, linkType=None,
+                                           context=None, reqGLN=None)
+        elapsed = time.monotonic() - start
+        # the four partner calls overlap rather than taking 4 x 0.3s
+        self.assertLess(elapsed, 4 * SlowVRSHandler.delay)
+        for gtin, msg in zip(self.gtins, msgs):
+            self.assertEquals(msg["location"], "127.0.0.1")
+            self.assertTrue(msg["path"].startswith(
+                "/vrs/verify/gtin/%s/" % gtin))
+        self.assertEquals(msgs[-1]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+        self.assertEquals(msgs[-1]["corrUUID"], "00000000000017")
+
+    @override_settings(VRS_EXTERNAL_DEADLINE=0.45)
+    def test_deadline(self):
+        items = [
+            {"gtin": gtin, "lot": "LOT", "serial_number": "1",
+             "exp": "201231", "correlation_id": gtin}
+            for gtin in self.gtins
+        ]
+        # one call at a time, so only the first finishes in time
+        client = FanOutClient(max_concurrency=1, max_per_host=1)
+        start = time.monotonic()
+        with mock.patch('quartet_vrs.verification.get_fanout_client',
+                        return_value=client):
+            msgs = Verification().verify_batch(items, linkType=None,
+                                               context=None, reqGLN=None)
+        self.assertLess(time.monotonic() - start, 2 * SlowVRSHandler.delay)
+        self.assertTrue(msgs[0]["data"]["verified"])
+        for gtin, msg in zip(self.gtins[1:], msgs[1:]):
+            self.assertFalse(msg["data"]["verified"])
+            self.assertEquals(msg["data"]["verificationFailureReason"],
+                              Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+            self.assertEquals(msg["corrUUID"], gtin)
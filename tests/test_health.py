@@ -0,0 +1,122 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import threading
+from http.server import ThreadingHTTPServer
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from mixer.backend.django import mixer
+
+from quartet_vrs import external
+from quartet_vrs.health import HealthProber, LatencyWindow
+from quartet_vrs.health import invalidate_route_health
+from quartet_vrs.models import GTINMap, RouteEndpoint, RouteHealth
+from quartet_vrs.routing import get_route, invalidate_routing_table
+from tests.test_external import CachingVRSHandler
+
+
+class LatencyWindowTest(SimpleTestCase):
+
+    def test_percentiles(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(50))
+        for latency in range(1, 101):
+            window.add(True, float(latency))
+        window.add(False, 1000.0)
+        self.assertEquals(window.percentile(50), 51.0)
+        self.assertEquals(window.percentile(99), 100.0)
+        self.assertEquals(window.availability, 0.99)
+
+    def test_from_health(self):
+        health = RouteHealth(base_url='http://vrs.example.com',
+                             availability=0.9, latency_p50=10.0,
+                             latency_p90=20.0, latency_p99=30.0)
+        window = LatencyWindow.from_health(health, 100)
+        self.assertEquals(window.availability, 0.9)
+        self.assertEquals(window.percentile(50), 10.0)
+        self.assertEquals(window.percentile(90), 20.0)
+        self.assertEquals(window.percentile(99), 30.0)
+        health = RouteHealth(base_url='http://vrs.example.com',
+                             availability=0.0)
+        self.assertEquals(LatencyWindow.from_health(health, 10).availability,
+                          0.0)
+
+
+class HealthProberTest(TestCase):
+
+    def setUp(self):
+        external.close_sessions()
+        invalidate_routing_table()
+        invalidate_route_health()
+        CachingVRSHandler.delay = 0
+        CachingVRSHandler.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          CachingVRSHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.route = mixer.blend(GTINMap, gtin="03066661234564",
+                                 host="vrs.example.com", port=None,
+                                 path="/vrs/", use_ssl=False, user_name=None,
+                                 connect_timeout=0.5, read_timeout=0.5)
+        # nothing listens on the discard port, so connections are refused
+        self.down = RouteEndpoint.objects.create(
+            route=self.route, host='127.0.0.1', port='9', use_ssl=False,
+            weight=100)
+        self.up = RouteEndpoint.objects.create(
+            route=self.route, host='127.0.0.1',
+            port=str(self.server.server_address[1]), use_ssl=False)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        external.close_sessions()
+        external.set_unhealthy([])
+        invalidate_route_health()
+
+    @override_settings(VRS_HEALTH_UNHEALTHY_AFTER=2)
+    def test_probe_all(self):
+        prober = HealthProber()
+        prober.probe_all()
+        down = RouteHealth.objects.get(
+            base_url=external.get_base_url(self.down))
+        self.assertTrue(down.healthy)
+        self.assertEquals(down.consecutive_failures, 1)
+        prober.probe_all()
+        down.refresh_from_db()
+        self.assertFalse(down.healthy)
+        self.assertEquals(down.availability, 0.0)
+        self.assertIsNone(down.latency_p50)
+        up = RouteHealth.objects.get(base_url=external.get_base_url(self.up))
+        self.assertTrue(up.healthy)
+        self.assertEquals(up.availability, 1.0)
+        self.assertIsNotNone(up.latency_p99)
+        self.assertEquals(CachingVRSHandler.requests, 2)
+        # the unhealthy endpoint is tried last despite its weight
+        route = get_route(self.route.gtin)
+        for _ in range(20):
+            self.assertEquals(external.select_endpoints(route)[0], self.up)
+
+    def test_restart(self):
+        HealthProber().probe_all()
+        up = external.get_base_url(self.up)
+        RouteHealth.objects.filter(base_url=up).update(availability=0.5)
+        # a new prober carries on from the saved availability
+        HealthProber(window=10).probe_all()
+        self.assertEquals(RouteHealth.objects.get(base_url=up).availability,
+                          0.6)
+
+    def test_command(self):
+        call_command('probe_routes', once=True)
+        self.assertEquals(RouteHealth.objects.count(), 2)
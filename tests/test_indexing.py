@@ -0,0 +1,134 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import io
+import os
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from mixer.backend.django import mixer
+from quartet_epcis.parsing.parser import QuartetParser
+from quartet_masterdata.models import TradeItem, Company
+
+from quartet_vrs.indexing import parse_sgtin, index_message
+from quartet_vrs.models import ProductInstance, Lot
+from quartet_vrs.verification import Verification
+
+
+class IndexingTest(TestCase):
+
+    def setUp(self):
+        # these values match the values in tests/data/commission.xml
+        self.gtin = "03055555555557"
+        self.lot_number = "DL232"
+        self.expiry_date = "151231"
+        self.request_gln = "3055551234562"
+        company = mixer.blend(Company, gs1_company_prefix="305555",
+                              GLN13=self.request_gln)
+        mixer.blend(TradeItem, company=company, GTIN14=self.gtin)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'commission.xml')
+        with open(path, "rb") as epcis_doc:
+            self.message_id = QuartetParser(
+                stream=io.BytesIO(epcis_doc.read())).parse()
+
+    def _verify(self, lot, serial_number):
+        return Verification().verify(gtin=self.gtin, lot=lot,
+                                     serial_number=serial_number,
+                                     correlation_id=None,
+                                     exp=self.expiry_date, linkType=None,
+                                     context=None, reqGLN=self.request_gln)
+
+    def test_parse_sgtin(self):
+        self.assertEquals(parse_sgtin('urn:epc:id:sgtin:305555.0555555.1'),
+                          (self.gtin, '1'))
+        self.assertEquals(
+            parse_sgtin('urn:epc:id:sgtin:305555.3555555.X.1'),
+            ('33055555555558', 'X.1'))
+
+    def test_index_message(self):
+        self.assertEquals(index_message(self.message_id), 12)
+        instance = ProductInstance.objects.get(gtin=self.gtin,
+                                               serial_number='1')
+        self.assertEquals(instance.lot, self.lot_number)
+        self.assertEquals(instance.expiry, self.expiry_date)
+        # re-indexing the same message leaves the index unchanged
+        self.assertEquals(index_message(self.message_id), 0)
+        self.assertEquals(ProductInstance.objects.count(), 12)
+
+    def test_build_verification_index(self):
+        call_command('build_verification_index', chunk_size=1, clear=True)
+        self.assertEquals(
+            ProductInstance.objects.filter(gtin=self.gtin).count(), 10)
+
+    @override_settings(VRS_USE_VERIFICATION_INDEX=True,
+                       VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_from_index(self):
+        index_message(self.message_id)
+        # the trade item and the index lookup
+        with self.assertNumQueries(2):
+            msg = self._verify(self.lot_number, '1')
+        self.assertEquals(msg["data"]["verified"], True)
+        msg = self._verify('000000', '1')
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT)
+        msg = self._verify(self.lot_number, '11')
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL)
+
+    @override_settings(VRS_USE_VERIFICATION_INDEX=True,
+                       VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_batch_from_index(self):
+        index_message(self.message_id)
+        items = [
+            {"gtin": self.gtin, "lot": self.lot_number,
+             "serial_number": str(serial), "exp": self.expiry_date}
+            for serial in range(1, 12)
+        ]
+        with self.assertNumQueries(2):
+            msgs = Verification().verify_batch(items, linkType=None,
+                                               context=None,
+                                               reqGLN=self.request_gln)
+        self.assertEquals([msg["data"]["verified"] for msg in msgs],
+                          [True] * 10 + [False])
+
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_lot_expiry(self):
+        index_message(self.message_id)
+        self.assertEquals(
+            Lot.objects.get(gtin=self.gtin, lot=self.lot_number).expiry,
+            self.expiry_date)
+        msg = self._verify(self.lot_number, '1')
+        self.assertEquals(msg["data"]["verified"], True)
+        # the trade item is cached and the lot expiry is read along with
+        # the ILMD
+        with self.assertNumQueries(1):
+            msg = self._verify(self.lot_number, '2')
+        self.assertEquals(msg["data"]["verified"], True)
+        # the lot table is authoritative for the expiry
+        Lot.objects.filter(gtin=self.gtin).update(expiry='160101')
+        msg = self._verify(self.lot_number, '3')
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL_EXPIRY)
+        with override_settings(VRS_USE_VERIFICATION_INDEX=True):
+            with self.assertNumQueries(1):
+                msg = self._verify(self.lot_number, '4')
+            self.assertEquals(
+                msg["data"]["verificationFailureReason"],
+                Verification.VERIFICATION_CODE_GTIN_SERIAL_EXPIRY)
+            msgs = Verification().verify_batch(
+                [{"gtin": self.gtin, "lot": self.lot_number,
+                  "serial_number": "5", "exp": "160101"}],
+                linkType=None, context=None, reqGLN=self.request_gln)
+            self.assertEquals(msgs[0]["data"]["verified"], True)
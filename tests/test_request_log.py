@@ -0,0 +1,583 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from quartet_vrs import partitions
+from quartet_vrs.models import RequestLog
+from quartet_vrs.pagination import EstimatedCountPaginator
+from quartet_vrs.payloads import get_outcome, get_payload_fields
+from quartet_vrs.request_log import BufferedWriter, DatabaseWriter, \
+    SpoolWriter, SpoolFileError, claim_spool_file, get_spool_files, \
+    load_spool_file, should_log
+from quartet_vrs.views import RequestLogger
+
+
+def make_record(serial_number='1', **kwargs):
+    record = dict(
+        remote_address='127.0.0.1',
+        request_gln='0614141000005',
+        corr_uuid='e7f8a2b6-ae2e-4a55-9e58-6c1f2b4c5a10',
+        gtin='00313000007772',
+        lot='LOT1',
+        serial_number=serial_number,
+        user_name='test',
+        response='{}',
+        operation='verify',
+        success=True,
+        created=timezone.now()
+    )
+    record.update(kwargs)
+    return record
+
+
+class RequestLogWriterTest(TestCase):
+
+    def buffered_writer(self, **kwargs):
+        # a long interval and large batch keep the background thread
+        # from flushing so the test controls when records are written
+        kwargs.setdefault('batch_size', 1000)
+        kwargs.setdefault('flush_interval', 3600)
+        writer = BufferedWriter(**kwargs)
+        # flushing here leaves nothing for the thread to write on close
+        self.addCleanup(writer.close, 0)
+        self.addCleanup(writer.flush)
+        return writer
+
+    def test_database_writer(self):
+        DatabaseWriter().write(make_record())
+        self.assertEqual(RequestLog.objects.count(), 1)
+
+    def test_buffered_writer(self):
+        writer = self.buffered_writer()
+        with self.assertNumQueries(0):
+            for i in range(3):
+                writer.write(make_record(str(i)))
+        self.assertEqual(writer.stats()['pending'], 3)
+        # a single insert inside a savepoint
+        with self.assertNumQueries(3):
+            writer.flush()
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertEqual(writer.stats(), {'pending': 0, 'queued': 3,
+                                          'flushed': 3, 'dropped': 0,
+                                          'failed': 0})
+
+    def test_bad_record(self):
+        writer = self.buffered_writer()
+        writer.write(make_record('1'))
+        writer.write(make_record('2', success=None))
+        writer.write(make_record('3'))
+        writer.flush()
+        # the rest of the batch is written one record at a time
+        self.assertEqual(
+            sorted(RequestLog.objects.values_list('serial_number',
+                                                  flat=True)),
+            ['1', '3'])
+        stats = writer.stats()
+        self.assertEqual((stats['flushed'], stats['failed']), (2, 1))
+
+    def test_created_is_kept(self):
+        created = timezone.now() - datetime.timedelta(minutes=5)
+        writer = self.buffered_writer()
+        writer.write(make_record(created=created))
+        writer.flush()
+        self.assertEqual(RequestLog.objects.get().created, created)
+
+    def test_drop_policy(self):
+        writer = self.buffered_writer(max_queue=2)
+        for i in range(3):
+            writer.write(make_record(str(i)))
+        stats = writer.stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['dropped'], 1)
+
+    def test_block_policy(self):
+        writer = self.buffered_writer(max_queue=1, policy=BufferedWriter.BLOCK,
+                                      block_timeout=0.01)
+        writer.write(make_record('1'))
+        writer.write(make_record('2'))
+        self.assertEqual(writer.stats()['dropped'], 1)
+        writer.flush()
+        writer.write(make_record('3'))
+        self.assertEqual(writer.stats()['queued'], 2)
+
+    def test_failed_flush(self):
+        writer = self.buffered_writer()
+        writer.write(make_record(success=None))
+        writer.flush()
+        self.assertEqual(writer.stats()['failed'], 1)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            BufferedWriter(policy='spill')
+
+
+class PruneRequestLogTest(TestCase):
+
+    def test_months(self):
+        month = partitions.month_start(datetime.date(2019, 12, 24))
+        self.assertEqual(month, datetime.datetime(
+            2019, 12, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(partitions.add_months(month, 1).date(),
+                         datetime.date(2020, 1, 1))
+        self.assertEqual(partitions.add_months(month, -12).date(),
+                         datetime.date(2018, 12, 1))
+        self.assertEqual(partitions.partition_name(month),
+                         'quartet_vrs_request_log_p201912')
+
+    def test_prune(self):
+        now = timezone.now()
+        for days in (1, 100, 200):
+            DatabaseWriter().write(make_record(
+                str(days), created=now - datetime.timedelta(days=days)))
+        self.assertFalse(partitions.is_partitioned())
+        call_command('prune_request_log', days=90, batch_size=1,
+                     stdout=io.StringIO())
+        self.assertEqual(
+            list(RequestLog.objects.values_list('serial_number', flat=True)),
+            ['1'])
+
+
+class FakeCursor:
+    """
+    Records the SQL of the PostgreSQL partitioning functions and answers
+    their catalog queries.
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.statements = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def fetchone(self):
+        for text, answer in self.answers.items():
+            if text in self.statements[-1]:
+                return answer
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class PostgreSQLPartitionTest(TestCase):
+
+    def setUp(self):
+        self.cursor = FakeCursor({
+            'pg_get_serial_sequence': ('quartet_vrs_request_log_id_seq',),
+            'MIN(created)': (datetime.datetime(
+                2019, 11, 5, tzinfo=datetime.timezone.utc),),
+        })
+        connection = mock.Mock(vendor='postgresql')
+        connection.ops.quote_name = lambda name: '"%s"' % name
+        connection.cursor.return_value = self.cursor
+        patcher = mock.patch.object(partitions, 'connection', connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_convert(self):
+        now = datetime.datetime(2020, 1, 15, tzinfo=datetime.timezone.utc)
+        with mock.patch.object(partitions.timezone, 'now', return_value=now):
+            partitions.convert_to_partitioned(months_ahead=1)
+        statements = '\n'.join(self.cursor.statements)
+        self.assertIn('PARTITION BY RANGE (created)', statements)
+        for month in ('201911', '201912', '202001', '202002'):
+            self.assertIn('CREATE TABLE "quartet_vrs_request_log_p%s" '
+                          'PARTITION OF' % month, statements)
+        self.assertNotIn('p202003', statements)
+        self.assertIn('CREATE TABLE "quartet_vrs_request_log_default" '
+                      'PARTITION OF "quartet_vrs_request_log" DEFAULT',
+                      statements)
+        self.assertIn('ADD PRIMARY KEY (id, created)', statements)
+        # the indexes are dropped with the old table and built again
+        dropped = statements.index('DROP TABLE')
+        for index in RequestLog._meta.indexes:
+            self.assertIn('CREATE INDEX IF NOT EXISTS "%s" ON '
+                          '"quartet_vrs_request_log"' % index.name,
+                          statements[dropped:])
+        self.assertIn('("gtin" varchar_pattern_ops, "serial_number" '
+                      'varchar_pattern_ops)', statements)
+
+    def test_create_with_default(self):
+        self.cursor.answers['pg_class WHERE relname'] = (1,)
+        partitions.create_partitions(
+            datetime.date(2020, 3, 1), datetime.date(2020, 3, 1))
+        statements = self.cursor.statements
+        # the month's rows are moved out of the default partition before
+        # the month is attached
+        self.assertTrue(statements[-3].startswith(
+            'CREATE TABLE "quartet_vrs_request_log_p202003" (LIKE'))
+        self.assertIn('DELETE FROM "quartet_vrs_request_log_default"',
+                      statements[-2])
+        self.assertTrue(statements[-1].startswith(
+            'ALTER TABLE "quartet_vrs_request_log" ATTACH PARTITION '
+            '"quartet_vrs_request_log_p202003"'))
+
+    def test_not_postgresql(self):
+        partitions.connection.vendor = 'sqlite'
+        with self.assertRaises(ValueError):
+            partitions.convert_to_partitioned()
+
+
+class IndexMigrationTest(TestCase):
+    migration = importlib.import_module(
+        'quartet_vrs.migrations.0022_requestlog_indexes')
+
+    def migrate(self, partitioned, function='create_indexes'):
+        cursor = FakeCursor({'pg_partitioned_table': (1,)} if partitioned
+                            else {})
+        # only used to render the SQL, never executed
+        schema_editor = mock.Mock(wraps=connection.schema_editor())
+        schema_editor.execute = mock.Mock()
+        schema_editor.connection = mock.Mock(vendor='postgresql')
+        schema_editor.connection.cursor.return_value = cursor
+        getattr(self.migration, function)(apps, schema_editor)
+        return [str(call[0][0]) for call in
+                schema_editor.execute.call_args_list]
+
+    def test_concurrently(self):
+        statements = self.migrate(False)
+        self.assertEqual(len(statements), len(self.migration.INDEXES))
+        self.assertIn('"vrs_reqlog_corr_uuid_idx"', '\n'.join(statements))
+        for statement in statements:
+            self.assertTrue(statement.startswith(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS'))
+        for statement in self.migrate(False, 'drop_indexes'):
+            self.assertTrue(statement.startswith(
+                'DROP INDEX CONCURRENTLY IF EXISTS'))
+
+    def test_partitioned(self):
+        # a partitioned index cannot be built concurrently
+        for statement in self.migrate(True):
+            self.assertTrue(statement.startswith('CREATE INDEX IF NOT EXISTS'))
+        for statement in self.migrate(True, 'drop_indexes'):
+            self.assertTrue(statement.startswith('DROP INDEX IF EXISTS'))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql',
+                     'Request log partitions require PostgreSQL.')
+class PartitionIndexTest(TestCase):
+
+    def get_indexes(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes '
+                           'WHERE tablename = %s', [table])
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_indexes(self):
+        DatabaseWriter().write(make_record())
+        partitions.convert_to_partitioned(months_ahead=1)
+        self.assertTrue(partitions.is_partitioned())
+        indexes = self.get_indexes(partitions.TABLE)
+        for index in RequestLog._meta.indexes:
+            self.assertIn(index.name, indexes)
+        # every partition has its own copy of each index
+        name = partitions.partition_name(partitions.month_start(
+            timezone.now()))
+        self.assertEqual(len(self.get_indexes(name)), len(indexes))
+        self.assertEqual(
+            len(self.get_indexes(partitions.DEFAULT_PARTITION)),
+            len(indexes))
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            DatabaseWriter().write(make_record('SN%d' % i))
+
+    @override_settings(VRS_ESTIMATED_COUNT_LIMIT=3)
+    def test_count_limit(self):
+        paginator = EstimatedCountPaginator(
+            RequestLog.objects.order_by('-created'), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_count(self):
+        paginator = EstimatedCountPaginator(
+            RequestLog.objects.filter(success=True), 2)
+        self.assertEqual(paginator.count, 5)
+
+
+class SpoolWriterTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_spool(self):
+        writer = SpoolWriter(self.directory, fsync=SpoolWriter.ALWAYS)
+        with self.assertNumQueries(0):
+            for i in range(3):
+                writer.write(make_record(str(i)))
+        # the open file is not loaded
+        self.assertEqual(get_spool_files(self.directory), [])
+        writer.close()
+        self.assertEqual(len(get_spool_files(self.directory)), 1)
+        call_command('load_request_log', directory=self.directory,
+                     batch_size=2, stdout=io.StringIO())
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(writer.stats(), {'written': 3, 'failed': 0})
+
+    def test_rotate(self):
+        writer = SpoolWriter(self.directory, max_bytes=1,
+                             fsync=SpoolWriter.NEVER)
+        writer.write(make_record('1'))
+        writer.write(make_record('2'))
+        self.assertEqual(len(get_spool_files(self.directory)), 2)
+
+    def test_invalid_line(self):
+        created = timezone.now() - datetime.timedelta(days=1)
+        writer = SpoolWriter(self.directory, max_bytes=1)
+        writer.write(make_record(created=created))
+        path = get_spool_files(self.directory)[0]
+        with open(path, 'a') as spool:
+            spool.write('{"gtin": \n')
+        self.assertEqual(load_spool_file(path), 1)
+        self.assertEqual(RequestLog.objects.get().created, created)
+
+    def test_idle_rotate(self):
+        writer = SpoolWriter(self.directory, rotate_interval=0.05)
+        self.addCleanup(writer.close)
+        writer.write(make_record())
+        deadline = time.monotonic() + 5
+        while not get_spool_files(self.directory) and \
+                time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(get_spool_files(self.directory)), 1)
+
+    def test_dead_writer(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        writer = SpoolWriter(self.directory)
+        writer.write(make_record('1'))
+        writer.write(make_record('2'))
+        writer.close()
+        # as if the process had died before closing its file
+        path = get_spool_files(self.directory)[0]
+        os.rename(path, path.replace(
+            'requests-%d-' % os.getpid(), 'requests-%d-' % process.pid
+        ) + '.part')
+        self.assertEqual(len(get_spool_files(self.directory)), 1)
+        call_command('load_request_log', directory=self.directory,
+                     stdout=io.StringIO())
+        self.assertEqual(RequestLog.objects.count(), 2)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_running_writer(self):
+        writer = SpoolWriter(self.directory)
+        self.addCleanup(writer.close)
+        writer.write(make_record())
+        # the open file of a running process is left alone
+        self.assertEqual(get_spool_files(self.directory), [])
+
+    def test_claim(self):
+        writer = SpoolWriter(self.directory)
+        writer.write(make_record())
+        writer.close()
+        path = get_spool_files(self.directory)[0]
+        claimed = claim_spool_file(path)
+        self.assertTrue(claimed.endswith('.%d.loading' % os.getpid()))
+        # a second loader finds the file gone
+        self.assertIsNone(claim_spool_file(path))
+        self.assertEqual(load_spool_file(path), 0)
+        # a file claimed by this, running, loader is left alone
+        self.assertEqual(get_spool_files(self.directory), [])
+
+    def test_quarantine(self):
+        writer = SpoolWriter(self.directory, max_bytes=1)
+        writer.write(make_record('1', unknown='x'))
+        writer.write(make_record('2'))
+        stdout = io.StringIO()
+        call_command('load_request_log', directory=self.directory,
+                     stdout=stdout)
+        self.assertEqual(
+            list(RequestLog.objects.values_list('serial_number', flat=True)),
+            ['2'])
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.endswith('.jsonl.bad')]), 1)
+        self.assertIn('Loaded 1 requests.', stdout.getvalue())
+        with self.assertRaises(SpoolFileError):
+            writer.write(make_record('3', unknown='x'))
+            load_spool_file(get_spool_files(self.directory)[0])
+
+
+class PayloadTest(TestCase):
+    message = {
+        'verificationTimestamp': '2019-06-01T10:00:00Z',
+        'responderGLN': '0614141000005',
+        'data': {'verified': False,
+                 'verificationFailureReason': 'No_match_serial_number'},
+        'corrUUID': 'e7f8a2b6-ae2e-4a55-9e58-6c1f2b4c5a10',
+        'location': 'https://vrs.example.com'
+    }
+
+    def log(self, data=None, **kwargs):
+        record = make_record(success=False, **kwargs)
+        del record['response']
+        record.update(get_payload_fields(self.message if data is None
+                                         else data))
+        DatabaseWriter().write(record)
+        return RequestLog.objects.get()
+
+    @override_settings(VRS_REQUEST_LOG_PAYLOAD='raw')
+    def test_raw(self):
+        request_log = self.log()
+        self.assertEqual(json.loads(request_log.response), self.message)
+        self.assertFalse(request_log.verified)
+        self.assertEqual(request_log.failure_reason, 'No_match_serial_number')
+        self.assertEqual(request_log.responder_gln, '0614141000005')
+        self.assertEqual(request_log.location, 'https://vrs.example.com')
+
+    def test_compressed(self):
+        # the default
+        request_log = self.log()
+        self.assertIsNone(request_log.response)
+        self.assertIsNotNone(request_log.payload)
+        self.assertEqual(json.loads(request_log.get_response()), self.message)
+
+    @override_settings(VRS_REQUEST_LOG_PAYLOAD='none')
+    def test_none(self):
+        request_log = self.log()
+        self.assertIsNone(request_log.payload)
+        message = json.loads(request_log.get_response())
+        self.assertEqual(message['data'], self.message['data'])
+        self.assertEqual(message['location'], self.message['location'])
+
+    def test_outcome(self):
+        self.assertEqual(get_outcome('{}'), dict(
+            verified=None, failure_reason=None, responder_gln=None,
+            location=None))
+        self.assertEqual(get_outcome([]), get_outcome(None))
+
+    def test_batch_outcome(self):
+        verified = {'responderGLN': '0614141000012',
+                    'data': {'verified': True}}
+        outcome = get_outcome([verified, self.message])
+        self.assertFalse(outcome['verified'])
+        self.assertEqual(outcome['failure_reason'], 'No_match_serial_number')
+        self.assertEqual(outcome['responder_gln'], '0614141000005')
+        outcome = get_outcome([verified, verified])
+        self.assertTrue(outcome['verified'])
+        self.assertEqual(outcome['responder_gln'], '0614141000012')
+
+    def test_truncate(self):
+        message = {'responderGLN': '0' * 20, 'location': 'x' * 400,
+                   'data': {'verified': False,
+                            'verificationFailureReason': 'y' * 60}}
+        request_log = self.log(message)
+        self.assertEqual(request_log.responder_gln, '0' * 13)
+        self.assertEqual(request_log.location, 'x' * 300)
+        self.assertEqual(request_log.failure_reason, 'y' * 50)
+
+    @override_settings(VRS_REQUEST_LOG_PAYLOAD='none')
+    def test_none_connectivity(self):
+        request_log = self.log({'responderGLN': '0614141000005'},
+                               operation='checkConnectivity')
+        self.assertEqual(request_log.responder_gln, '0614141000005')
+        self.assertEqual(json.loads(request_log.get_response()),
+                         {'responderGLN': '0614141000005'})
+
+    @override_settings(VRS_REQUEST_LOG_PAYLOAD='none')
+    def test_none_batch(self):
+        request_log = self.log([self.message], operation='verifyBatch')
+        self.assertFalse(request_log.verified)
+        self.assertEqual(json.loads(request_log.get_response()),
+                         [self.message])
+
+    @override_settings(VRS_REQUEST_LOG_PAYLOAD='compressed')
+    def test_spool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SpoolWriter(directory, max_bytes=1)
+            record = make_record()
+            del record['response']
+            record.update(get_payload_fields(self.message))
+            writer.write(record)
+            load_spool_file(get_spool_files(directory)[0])
+        self.assertEqual(json.loads(RequestLog.objects.get().get_response()),
+                         self.message)
+
+
+class LoggingPolicyTest(TestCase):
+
+    def log(self, success, req_gln='0614141000005'):
+        request = Request(APIRequestFactory().get(
+            '/', {'reqGLN': req_gln, 'exp': '201231'}))
+        RequestLogger.log(request, response={'data': {'verified': success}},
+                          operation='verify', success=success)
+
+    def test_default(self):
+        self.log(True)
+        self.assertEqual(RequestLog.objects.count(), 1)
+
+    @override_settings(VRS_REQUEST_LOG_SUCCESS_SAMPLE_RATE=0,
+                       VRS_REQUEST_LOG_ALWAYS_GLNS=['0614141000012'])
+    def test_tiers(self):
+        with self.assertNumQueries(0):
+            self.log(True)
+        self.log(False)
+        self.log(True, '0614141000012')
+        self.assertEqual(
+            list(RequestLog.objects.order_by('pk').values_list(
+                'success', 'request_gln')),
+            [(False, '0614141000005'), (True, '0614141000012')])
+
+    @override_settings(VRS_REQUEST_LOG_SUCCESS_SAMPLE_RATE=0.25,
+                       VRS_REQUEST_LOG_SAMPLE_RATES={'checkConnectivity': 1})
+    def test_sample_rates(self):
+        with mock.patch('quartet_vrs.request_log.random.random',
+                        side_effect=[0.2, 0.3]):
+            self.assertEqual(should_log('verify', True), 0.25)
+            self.assertFalse(should_log('verify', True))
+        self.assertEqual(should_log('checkConnectivity', True), 1.0)
+        self.assertEqual(should_log('verify', False), 1.0)
+
+    @override_settings(VRS_REQUEST_LOG_SUCCESS_SAMPLE_RATE=0.25)
+    def test_sample_rate_logged(self):
+        with mock.patch('quartet_vrs.request_log.random.random',
+                        return_value=0.2):
+            self.log(True)
+        self.log(False)
+        self.assertEqual(
+            list(RequestLog.objects.order_by('pk').values_list(
+                'success', 'sample_rate')),
+            [(True, 0.25), (False, 1.0)])
@@ -0,0 +1,141 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+import datetime
+import io
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from quartet_vrs.models import RequestLog, RequestLogRollup, \
+    RollupWatermark
+from quartet_vrs.request_log import DatabaseWriter
+from tests.test_request_log import make_record
+
+HOUR = datetime.datetime(2019, 6, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+def log(minutes=0, success=True, reason=None, **kwargs):
+    response = {'data': {'verified': success}}
+    if reason:
+        response['data']['verificationFailureReason'] = reason
+    DatabaseWriter().write(make_record(
+        created=HOUR + datetime.timedelta(minutes=minutes), success=success,
+        response=json.dumps(response), **kwargs))
+
+
+class RollupTest(APITestCase):
+
+    def rollup(self, settle=True):
+        if settle:
+            # entries are only counted once they have been in the table
+            # for VRS_ROLLUP_LAG
+            RequestLog.objects.update(inserted=HOUR)
+        call_command('rollup_request_log', batch_size=2,
+                     stdout=io.StringIO())
+
+    def test_rollup(self):
+        log(1)
+        log(2)
+        log(3, success=False, reason='No_match_serial_number')
+        log(61)
+        self.rollup()
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR, success=True).count, 2)
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR, success=False).failure_reason, 'No_match_serial_number')
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR + datetime.timedelta(hours=1)).count, 1)
+        # only entries after the watermark are added
+        log(4)
+        self.rollup()
+        self.rollup()
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR, success=True).count, 3)
+        self.assertEqual(RollupWatermark.objects.get().last_id,
+                         RequestLog.objects.latest('pk').pk)
+
+    def test_sample_rate(self):
+        log(1, sample_rate=0.25)
+        log(2, sample_rate=0.25)
+        log(3, success=False, reason='No_match_serial_number')
+        self.rollup()
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR, success=True).count, 8)
+        self.assertEqual(RequestLogRollup.objects.get(
+            hour=HOUR, success=False).count, 1)
+
+    def test_sample_rate_batches(self):
+        # each entry counts as 2.5 requests and lands in its own run, only
+        # the total is rounded
+        for minutes in range(3):
+            log(minutes, sample_rate=0.4)
+            self.rollup()
+        rollup = RequestLogRollup.objects.get(hour=HOUR)
+        self.assertAlmostEqual(rollup.weight, 7.5)
+        self.assertEqual(rollup.count, 8)
+
+    def test_lag(self):
+        log(1)
+        RequestLog.objects.update(inserted=HOUR)
+        DatabaseWriter().write(make_record(created=HOUR))
+        log(2)
+        self.rollup(settle=False)
+        # the watermark stops before the recently inserted entry even
+        # though it was created long ago
+        self.assertEqual(RequestLogRollup.objects.get(hour=HOUR).count, 1)
+        with override_settings(VRS_ROLLUP_LAG=0):
+            self.rollup(settle=False)
+        self.assertEqual(RequestLogRollup.objects.get(hour=HOUR).count, 3)
+
+    def test_overlapping_loads(self):
+        # two spool loads of old entries, the first one's insert has not
+        # committed when the rollup runs
+        log(1)
+        log(2)
+        first = RequestLog.objects.order_by('pk').first()
+        record = {field.attname: getattr(first, field.attname)
+                  for field in RequestLog._meta.concrete_fields
+                  if field.attname != 'inserted'}
+        first.delete()
+        self.rollup(settle=False)
+        self.assertFalse(RequestLogRollup.objects.exists())
+        # the first load commits and both settle
+        RequestLog.objects.create(**record)
+        self.rollup()
+        self.assertEqual(RequestLogRollup.objects.get(hour=HOUR).count, 2)
+
+    def test_api(self):
+        log(1, request_gln='0614141000005')
+        log(2, request_gln='0614141000012')
+        log(3, request_gln='0614141000012', success=False, reason='No_code')
+        self.rollup()
+        user = User.objects.create_user(username='dashboard')
+        self.client.force_authenticate(user=user)
+        url = reverse('requestlogrollup-list')
+        response = self.client.get(url, {'request_gln': '0614141000012',
+                                         'start': HOUR.isoformat(),
+                                         'success': 'false'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if isinstance(data, dict) else data
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['failure_reason'], 'No_code')
+        self.assertEqual(results[0]['count'], 1)
+        response = self.client.get(url, {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
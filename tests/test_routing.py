@@ -0,0 +1,67 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2019 SerialLab Corp.  All rights reserved.
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from mixer.backend.django import mixer
+
+from quartet_vrs.models import GTINMap
+from quartet_vrs.routing import PrefixTrie, get_route
+from quartet_vrs.routing import invalidate_routing_table
+
+
+class PrefixTrieTest(TestCase):
+
+    def test_longest_match(self):
+        trie = PrefixTrie()
+        trie.insert('3066', 'short')
+        trie.insert('306666', 'long')
+        self.assertEquals(trie.longest_match('3066661234564'), 'long')
+        self.assertEquals(trie.longest_match('3066771234564'), 'short')
+        self.assertIsNone(trie.longest_match('3077771234564'))
+
+
+class RoutingTest(TestCase):
+
+    def setUp(self):
+        invalidate_routing_table()
+        self.company_route = mixer.blend(GTINMap, gtin=None, prefix='306666',
+                                         host='company.example.com')
+        self.gtin_route = mixer.blend(GTINMap, gtin='03066661234564',
+                                      prefix=None, host='gtin.example.com')
+
+    def test_get_route(self):
+        get_route('03066661234564')
+        with self.assertNumQueries(0):
+            # exact GTIN routes override prefix routes
+            self.assertEquals(get_route('03066661234564'), self.gtin_route)
+            # any indicator digit matches the company prefix
+            self.assertEquals(get_route('13066669999995'),
+                              self.company_route)
+            self.assertIsNone(get_route('03077779999990'))
+
+    def test_rebuilt_on_change(self):
+        self.assertIsNone(get_route('03077779999990'))
+        route = mixer.blend(GTINMap, gtin=None, prefix='3077',
+                            host='other.example.com')
+        self.assertEquals(get_route('03077779999990'), route)
+        route.delete()
+        self.assertIsNone(get_route('03077779999990'))
+
+    def test_blank_values(self):
+        route = GTINMap(gtin='', prefix='3088', host='blank.example.com')
+        route.save()
+        self.assertIsNone(GTINMap.objects.get(pk=route.pk).gtin)
+        with self.assertRaises(ValidationError):
+            GTINMap(gtin='', prefix='', host='none.example.com').clean()
@@ -14,18 +14,22 @@
 # Copyright 2019 SerialLab Corp.  All rights reserved.
 import os, io, uuid, json
 import django
+from unittest import mock
 from django.contrib.auth.models import Group, User
 from rest_framework.test import force_authenticate
 from rest_framework.test import APITestCase
 from rest_framework.test import APIRequestFactory, APIClient
 from django.urls import reverse
+from django.test import override_settings
 from mixer.backend.django import mixer
 from quartet_vrs.verification import Verification
 from quartet_masterdata.models import TradeItem, Company
+from quartet_epcis.models.events import InstanceLotMasterData
 from quartet_epcis.parsing.parser import QuartetParser
 from quartet_vrs.management.commands.create_vrs_groups import Command
 from quartet_vrs.views import GTINMapView, CheckConnectivityView, VerifyView
 from quartet_vrs.models import GTINMap, RequestLog
+from quartet_vrs.serializers import BatchVerificationSerializer
 
 os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
 django.setup()
@@ -108,6 +112,19 @@ class ViewTest(APITestCase):
         response = view(request)
         self.assertEquals(response.status_code, 401)
 
+    def test_check_connectivity_denied_log(self):
+        factory = APIRequestFactory()
+        user = User.objects.get(username='testuser')
+        view = CheckConnectivityView.as_view()
+        request = factory.get("/checkConnectivity/?gtin={0}&reqGLN={1}".format(self.gtin, self.invalid_gln))
+        force_authenticate(request, user=user)
+        response = view(request)
+        self.assertEquals(response.status_code, 403)
+        request_log = RequestLog.objects.get()
+        self.assertEquals(request_log.operation, 'checkConnectivity')
+        self.assertEquals(request_log.request_gln, self.invalid_gln)
+        self.assertFalse(request_log.success)
+
     def test_check_connectivity_200(self):
         pass
         # factory = APIRequestFactory()
@@ -187,7 +204,7 @@ class ViewTest(APITestCase):
 
 
         # check the logged data
-        log_data = json.loads(log_entry.response)
+        log_data = json.loads(log_entry.get_response())
 
         self.assertEquals(msg["responderGLN"], log_data["responderGLN"])
         self.assertEquals(msg["corrUUID"], log_data["corrUUID"])
@@ -311,3 +328,150 @@ class ViewTest(APITestCase):
         response = client.get(url)
         self.assertEquals(response.status_code, 200)
 
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_batch(self):
+        corrID = str(uuid.uuid4())
+        data = {
+            "reqGLN": self.request_gln,
+            "items": [
+                {"gtin": self.gtin, "lot": self.lot_number,
+                 "ser": self.serial_number, "exp": "151231",
+                 "corrUUID": corrID},
+                {"gtin": self.gtin, "lot": self.lot_number,
+                 "ser": "000000000000", "exp": "151231"},
+                {"gtin": self.gtin, "lot": "000000",
+                 "ser": "2", "exp": "151231"},
+                {"gtin": "00000000000014", "lot": self.lot_number,
+                 "ser": self.serial_number, "exp": "151231"},
+            ]
+        }
+        response = self.client.post(reverse('verifyBatch'), data,
+                                    format='json')
+        self.assertEquals(response.status_code, 200)
+        msgs = response.json()
+        self.assertEquals(len(msgs), 4)
+        self.assertEquals(msgs[0]["data"]["verified"], True)
+        self.assertEquals(msgs[0]["corrUUID"], corrID)
+        self.assertEquals(msgs[0]["responderGLN"], self.response_gln)
+        self.assertEquals(msgs[1]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL)
+        self.assertEquals(msgs[2]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL_LOT)
+        self.assertEquals(msgs[3]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+        log_entry = RequestLog.objects.get(operation='verifyBatch')
+        self.assertEquals(log_entry.request_gln, self.request_gln)
+        self.assertFalse(log_entry.success)
+
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_batch_queries(self):
+        items = [
+            {"gtin": self.gtin, "lot": self.lot_number,
+             "serial_number": str(serial), "exp": "151231"}
+            for serial in range(1, 12)
+        ]
+        # trade items, entry events with their ilmd and the lots regardless
+        # of the batch size
+        with self.assertNumQueries(3):
+            msgs = Verification().verify_batch(items, linkType=None,
+                                               context=None,
+                                               reqGLN=self.request_gln)
+        self.assertEquals([msg["data"]["verified"] for msg in msgs],
+                          [True] * 10 + [False])
+
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_batch_bad_expiry(self):
+        InstanceLotMasterData.objects.filter(
+            name='itemExpirationDate').update(value='not a date')
+        data = {
+            "reqGLN": self.request_gln,
+            "items": [
+                {"gtin": self.gtin, "lot": self.lot_number,
+                 "ser": self.serial_number, "exp": "151231"},
+                {"gtin": "00000000000014", "lot": self.lot_number,
+                 "ser": self.serial_number, "exp": "151231"},
+            ]
+        }
+        response = self.client.post(reverse('verifyBatch'), data,
+                                    format='json')
+        self.assertEquals(response.status_code, 200)
+        msgs = response.json()
+        # only the item with the bad ILMD fails, as it does in verify()
+        msg = Verification().verify(gtin=self.gtin, lot=self.lot_number,
+                                    serial_number=self.serial_number,
+                                    correlation_id=None, exp="151231",
+                                    linkType=None, context=None,
+                                    reqGLN=self.request_gln)
+        self.assertEquals(msgs[0]["data"], msg["data"])
+        self.assertEquals(msgs[0]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL)
+        self.assertEquals(msgs[1]["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_NOT_FOUND)
+
+    def test_verify_batch_invalid(self):
+        data = {"reqGLN": self.request_gln,
+                "items": [{"gtin": "123", "lot": "", "ser": "1"}]}
+        response = self.client.post(reverse('verifyBatch'), data,
+                                    format='json')
+        self.assertEquals(response.status_code, 400)
+
+    def test_verify_batch_invalid_context(self):
+        item = {"gtin": self.gtin, "lot": self.lot_number, "ser": "1"}
+        data = {"reqGLN": self.request_gln, "context": "other",
+                "items": [item]}
+        response = self.client.post(reverse('verifyBatch'), data,
+                                    format='json')
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('context', response.json())
+
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_batch_error(self):
+        item = {"gtin": self.gtin, "lot": self.lot_number, "ser": "1"}
+        data = {"reqGLN": self.request_gln, "items": [item]}
+        with mock.patch.object(Verification, 'verify_batch',
+                               side_effect=RuntimeError('secret')):
+            response = self.client.post(reverse('verifyBatch'), data,
+                                        format='json')
+        self.assertEquals(response.status_code, 500)
+        self.assertNotIn('secret', response.content.decode())
+        self.assertFalse(RequestLog.objects.get(
+            operation='verifyBatch').success)
+
+    @override_settings(VRS_BATCH_MAX_ITEMS=2)
+    def test_verify_batch_too_many(self):
+        item = {"gtin": self.gtin, "lot": self.lot_number, "ser": "1"}
+        data = {"reqGLN": self.request_gln, "items": [item] * 3}
+        response = self.client.post(reverse('verifyBatch'), data,
+                                    format='json')
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('items', response.json())
+
+    def test_verify_batch_max_items(self):
+        item = {"gtin": self.gtin, "lot": self.lot_number, "ser": "1"}
+        serializer = BatchVerificationSerializer(
+            data={"reqGLN": self.request_gln, "items": [item] * 5000})
+        self.assertTrue(serializer.is_valid())
+        serializer = BatchVerificationSerializer(
+            data={"reqGLN": self.request_gln, "items": [item] * 5001})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('items', serializer.errors)
+
+    @override_settings(VRS_ALLOW_ALL_REQ_GLNS=True)
+    def test_verify_queries(self):
+        # the trade item and a single ILMD and lot lookup for the EPC
+        with self.assertNumQueries(2):
+            msg = Verification().verify(gtin=self.gtin, lot=self.lot_number,
+                                        serial_number=self.serial_number,
+                                        correlation_id=None, exp="151231",
+                                        linkType=None, context=None,
+                                        reqGLN=self.request_gln)
+        self.assertEquals(msg["data"]["verified"], True)
+        # the trade item is now served from the cache
+        with self.assertNumQueries(1):
+            msg = Verification().verify(gtin=self.gtin, lot=self.lot_number,
+                                        serial_number="000000000000",
+                                        correlation_id=None, exp="151231",
+                                        linkType=None, context=None,
+                                        reqGLN=self.request_gln)
+        self.assertEquals(msg["data"]["verificationFailureReason"],
+                          Verification.VERIFICATION_CODE_GTIN_SERIAL)
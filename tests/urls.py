@@ -10,6 +10,7 @@ from quartet_vrs import views
 
 router = routers.DefaultRouter()
 router.register(r'gtinmap', views.GTINMapView)
+router.register(r'requestlogrollup', views.RequestLogRollupView)
 
 app_name = 'quartet_vrs'
 
@@ -24,6 +25,14 @@ urlpatterns = [
         r'^verify/gtin/(?P<gtin>[0-9]{14})/lot/(?P<lot>[\w{}.-]*)/ser/(?P<serial_number>[\x21-\x22\x25-\x2F\x30-\x39\x3A-\x3F\x41-\x5A\x5F\x61-\x7A]{0,20})/?$',
         views.VerifyView.as_view(), name="verify"
     ),
+    url(
+        r'^verify/batch/?$',
+        views.BatchVerifyView.as_view(), name="verifyBatch"
+    ),
+    url(
+        r'^requestlog/export/?$',
+        views.RequestLogExportView.as_view(), name="requestLogExport"
+    ),
     path('', include(router.urls))
 ]
 